@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def read_only_transaction(connection: Any, db_type: str) -> AsyncIterator[None]:
+    """
+    Statements run inside are refused by the database itself if they write, whatever
+    got past the SQL checks, and are rolled back afterwards:
+    - PostgreSQL and MySQL: a READ ONLY transaction
+    - SQLite: PRAGMA query_only for the duration
+    - SQL Server has no read-only transaction: the work is rolled back (pyodbc does
+      not autocommit)
+    """
+    if db_type == "postgresql":
+        transaction = connection.transaction(readonly=True)
+        await transaction.start()
+        try:
+            yield
+        finally:
+            await transaction.rollback()
+
+    elif db_type == "mysql":
+        async with connection.cursor() as cursor:
+            await cursor.execute("START TRANSACTION READ ONLY")
+        try:
+            yield
+        finally:
+            await connection.rollback()
+
+    elif db_type == "sqlite":
+        await connection.execute("PRAGMA query_only = ON")
+        try:
+            yield
+        finally:
+            await connection.execute("PRAGMA query_only = OFF")
+
+    elif db_type == "sqlserver":
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(connection.rollback)
+
+    else:
+        logger.warning(f"No read-only transaction for {db_type}")
+        yield
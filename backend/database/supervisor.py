@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import asyncpg
+import pymysql
+import pyodbc
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_INTERVAL = float(os.getenv("DB_KEEPALIVE_INTERVAL", "30"))
+PING_TIMEOUT = float(os.getenv("DB_PING_TIMEOUT", "5"))
+RECONNECT_ATTEMPTS = int(os.getenv("DB_RECONNECT_ATTEMPTS", "5"))
+RECONNECT_BASE_DELAY = float(os.getenv("DB_RECONNECT_BASE_DELAY", "0.5"))
+RECONNECT_MAX_DELAY = float(os.getenv("DB_RECONNECT_MAX_DELAY", "30"))
+
+# MySQL client errors for a lost session: can't connect, server gone away, lost connection
+MYSQL_CONNECTION_ERRORS = {2003, 2006, 2013, 2055}
+
+# asyncpg errors that end the session (57014 query_canceled is deliberately not here)
+POSTGRES_CONNECTION_ERRORS = (
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.AdminShutdownError,
+    asyncpg.exceptions.CrashShutdownError,
+    asyncpg.exceptions.CannotConnectNowError
+)
+
+
+class ConnectionSupervisor:
+    """
+    Owns the single live database connection:
+    - pings it while idle so firewalls do not drop it and breakage is noticed early
+    - reconnects with exponential backoff (plus jitter) when it breaks
+    - retries a read-only operation once on a fresh connection
+    - runs one operation at a time: drivers reject (asyncpg) or interleave (aiomysql)
+      overlapping statements on a connection
+    """
+
+    def __init__(self, db_type: str, connect: Callable[[], Awaitable[Any]]):
+        self.db_type = db_type
+        self._connect = connect
+        self.connection = None
+        self.alive = False
+        self.reconnects = 0
+        self.latency_ms = None
+        self.last_error = None
+        self.last_check = None
+        self._in_flight = 0
+        self._last_activity = time.monotonic()
+        self._reconnect_lock = asyncio.Lock()
+        self._operation_lock = asyncio.Lock()
+        self._ping_done = asyncio.Event()
+        self._ping_done.set()
+        self._keepalive_task = None
+
+    async def start(self):
+        self.connection = await self._connect()
+        self.alive = True
+        self._last_activity = time.monotonic()
+        self._keepalive_task = asyncio.create_task(self._keepalive())
+
+    async def stop(self):
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+            try:
+                await self._keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self._keepalive_task = None
+        connection, self.connection = self.connection, None
+        self.alive = False
+        await self._close(connection)
+
+    async def run(self, operation: Callable[[Any], Awaitable[Any]], read_only: bool = False) -> Any:
+        """Run operation(connection), reconnecting on a broken connection and retrying once if read_only"""
+        if not self.alive:
+            await self.reconnect(self.connection)
+
+        for attempt in (1, 2):
+            await self._ping_done.wait()
+            self._in_flight += 1
+            try:
+                async with self._operation_lock:
+                    # Taken once it is this operation's turn: a reconnect may have replaced it meanwhile
+                    connection = self.connection
+                    return await operation(connection)
+            except Exception as e:
+                if not self.is_connection_error(e, connection):
+                    raise
+                logger.warning(f"🔌 {self.db_type} connection lost: {str(e)}")
+                self.alive = False
+                self.last_error = str(e)
+                await self.reconnect(connection)
+                if not read_only or attempt == 2:
+                    raise
+                logger.info("Retrying read-only statement on the new connection")
+            finally:
+                self._in_flight -= 1
+                self._last_activity = time.monotonic()
+
+    async def reconnect(self, stale: Any):
+        """Replace a broken connection; concurrent callers share a single reconnect"""
+        async with self._reconnect_lock:
+            if self.alive and self.connection is not stale:
+                return
+
+            await self._close(stale)
+            delay = RECONNECT_BASE_DELAY
+            for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+                try:
+                    self.connection = await self._connect()
+                    self.alive = True
+                    self.reconnects += 1
+                    self._last_activity = time.monotonic()
+                    logger.info(f"✅ Reconnected to {self.db_type} database (attempt {attempt})")
+                    return
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.warning(f"Reconnect attempt {attempt}/{RECONNECT_ATTEMPTS} failed: {str(e)}")
+                    if attempt == RECONNECT_ATTEMPTS:
+                        raise ConnectionError(
+                            f"Could not reconnect to {self.db_type} database after {attempt} attempts: {str(e)}"
+                        ) from e
+                    await asyncio.sleep(delay + random.uniform(0, delay / 2))
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def check(self) -> Dict[str, Any]:
+        """Ping the connection unless a statement is using it, and report its health"""
+        if self._in_flight == 0 and self.connection is not None and self._ping_done.is_set():
+            self._ping_done.clear()
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(self._ping(self.connection), PING_TIMEOUT)
+                self.alive = True
+                self.latency_ms = (time.monotonic() - start) * 1000
+            except Exception as e:
+                self.alive = False
+                self.last_error = str(e) or type(e).__name__
+                logger.warning(f"🔌 {self.db_type} ping failed: {self.last_error}")
+            finally:
+                self._ping_done.set()
+                self.last_check = time.time()
+                self._last_activity = time.monotonic()
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "alive": self.alive,
+            "latency_ms": self.latency_ms,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+            "last_check": self.last_check
+        }
+
+    def is_connection_error(self, error: Exception, connection: Any = None) -> bool:
+        """Whether an error means the session is gone, as opposed to a failing statement"""
+        if isinstance(error, (ConnectionError, asyncio.IncompleteReadError)):
+            return True
+        if self.db_type == "postgresql":
+            if isinstance(error, POSTGRES_CONNECTION_ERRORS):
+                return True
+            return connection is not None and connection.is_closed()
+        if self.db_type == "mysql":
+            if isinstance(error, pymysql.err.InterfaceError):
+                return True
+            return isinstance(error, pymysql.err.OperationalError) and bool(error.args) \
+                and error.args[0] in MYSQL_CONNECTION_ERRORS
+        if self.db_type == "sqlite":
+            # aiosqlite raises ValueError once its worker thread has stopped
+            message = str(error).lower()
+            return isinstance(error, (ValueError, sqlite3.ProgrammingError)) \
+                and ("closed" in message or "no active connection" in message)
+        if self.db_type == "sqlserver":
+            # SQLSTATE class 08 is "connection exception"
+            return isinstance(error, pyodbc.Error) and bool(error.args) and str(error.args[0]).startswith("08")
+        return False
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+            try:
+                if not self.alive:
+                    await self.reconnect(self.connection)
+                elif time.monotonic() - self._last_activity >= KEEPALIVE_INTERVAL:
+                    await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Keepalive could not restore the {self.db_type} connection: {str(e)}")
+
+    async def _ping(self, connection: Any):
+        if self.db_type == "postgresql":
+            await connection.fetchval("SELECT 1")
+        elif self.db_type == "mysql":
+            await connection.ping(reconnect=False)
+        elif self.db_type == "sqlite":
+            cursor = await connection.execute("SELECT 1")
+            await cursor.fetchone()
+        elif self.db_type == "sqlserver":
+            # pyodbc blocks, keep the ping off the event loop
+            await asyncio.to_thread(lambda: connection.cursor().execute("SELECT 1").fetchone())
+
+    async def _close(self, connection: Optional[Any]):
+        """Close a connection, ignoring errors from one that is already broken"""
+        if connection is None:
+            return
+        try:
+            if self.db_type in ("mysql", "sqlserver"):
+                connection.close()
+            else:
+                await connection.close()
+        except Exception as e:
+            logger.debug(f"Ignoring error while closing {self.db_type} connection: {str(e)}")
@@ -1,17 +1,19 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 import logging
+import os
 import time
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, aclosing
 import asyncpg
 import aiomysql
 import aiosqlite
 import pyodbc  # for SQL Server
 import urllib.parse
 import json
+import asyncio
 
 from models.sql_models import (
     DatabaseType, 
@@ -22,14 +24,33 @@ from models.sql_models import (
     TextToSQLResponse, 
     ExplainRequest,
     ExplainResponse, 
+    ExplainBatchRequest,
+    ExplainBatchResponse,
     ValidateSQLRequest,  
     ValidateSQLResponse, 
     SchemaResponse, 
-    QueryHistory
+    QueryHistory,
+    ApproximateQueryRequest,
+    ProfileRequest,
+    ProfileResponse
 )
 
-from services.sql_generator import SQLGenerator
+from services.sql_generator import SQLGenerator, FALLBACK_SQL
 from services.sql_explainer import SQLExplainer
+from services.ollama_client import shared_ollama_client, close_shared_ollama_client
+from services.approximate_query import ApproximateQueryEngine, DEFAULT_SAMPLE_PERCENTS
+from services.index_advisor import IndexAdvisor
+from services.query_profiler import QueryProfiler
+from services.sql_optimizer import SQLOptimizer
+from services.query_cache import QueryCache, normalize_question
+from services.similar_questions import SimilarQuestionIndex
+from services.query_stats import QueryShapeStats, SHAPE_SORT_KEYS
+from database.supervisor import ConnectionSupervisor
+from database.read_only import read_only_transaction
+from utils.sql_ir import parse_sql
+from utils.sql_fingerprint import schema_fingerprint
+from utils.single_flight import SingleFlight
+from utils.deadline import Deadline
 
 # Configure logging
 logging.basicConfig(
@@ -38,16 +59,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+INDEX_ADVISOR_ENABLED = os.getenv("INDEX_ADVISOR_ENABLED", "true").lower() == "true"
+# Executed queries waiting for the index advisor: beyond this, new ones are not recorded
+INDEX_ADVISOR_MAX_PENDING = int(os.getenv("INDEX_ADVISOR_MAX_PENDING", "8"))
+# How often a pending generation checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+# Per-request latency budget in milliseconds, as an alternative to the deadline_ms field
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
 # Global state
 class AppState:
     def __init__(self):
-        self.db_connection = None
+        self.db_supervisor = None
         self.db_type = None
+        self.db_version = None  # Server version where rewrites depend on it (MySQL), else None
+        self.ollama_client = None
         self.db_name = None
         self.is_connected = False
         self.sql_generator = None
         self.sql_explainer = None
         self.query_history = []
+        self.schema_snapshot = []  # Last fetched schema, reused where row counts suffice
+        self.schema_fingerprint = None
+        self.sql_cache = QueryCache()
+        self.explanation_cache = QueryCache(table="explanation_cache")
+        self.similar_questions = None
+        self.query_flights = SingleFlight()
+        self.index_advisor = IndexAdvisor()
+        self.query_shapes = QueryShapeStats()
+        self.sql_optimizer = SQLOptimizer()
+        # The event loop only keeps weak references to tasks: these stay alive until done
+        self.background_tasks = set()
+        self.indexing_tasks = set()
+    
+    @property
+    def db_connection(self):
+        """Current live connection; the supervisor replaces it after a reconnect"""
+        return self.db_supervisor.connection if self.db_supervisor else None
 
 state = AppState()
 
@@ -55,12 +103,22 @@ state = AppState()
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting Text-to-SQL Backend...")
-    state.sql_generator = SQLGenerator()
-    state.sql_explainer = SQLExplainer()
+    # All services share one pool of Ollama servers (OLLAMA_HOSTS) and their connections
+    state.ollama_client = shared_ollama_client()
+    state.sql_generator = SQLGenerator(client=state.ollama_client)
+    state.sql_explainer = SQLExplainer(client=state.ollama_client, cache=state.explanation_cache)
+    state.similar_questions = SimilarQuestionIndex(client=state.ollama_client)
+    # Don't wait for Ollama: each server is probed and warmed up in the background, /api/ready reports it
+    state.ollama_client.start(state.sql_generator.model_name)
     yield
     # Shutdown
+    pending = state.background_tasks | state.indexing_tasks
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
     if state.is_connected and state.db_connection:
         await disconnect_database()
+    await close_shared_ollama_client()
     logger.info("Shutdown complete")
 
 # Create FastAPI app
@@ -115,6 +173,10 @@ async def connect_database(credentials: ConnectRequest):
             success = await connect_with_credentials(credentials)
         
         if success:
+            # Plans observed on the previous database no longer apply
+            state.index_advisor = IndexAdvisor()
+            state.schema_fingerprint = None
+            
             # Fetch and store schema for later use
             await fetch_schema()
             
@@ -135,22 +197,17 @@ async def connect_database(credentials: ConnectRequest):
 async def disconnect_database():
     """Disconnect from database"""
     global state
-    if state.is_connected and state.db_connection:
+    if state.is_connected and state.db_supervisor:
         try:
-            if state.db_type == DatabaseType.POSTGRESQL:
-                await state.db_connection.close()
-            elif state.db_type == DatabaseType.MYSQL:
-                state.db_connection.close()
-                await state.db_connection.wait_closed()
-            elif state.db_type == DatabaseType.SQLITE:
-                await state.db_connection.close()
-            elif state.db_type == DatabaseType.SQLSERVER:
-                state.db_connection.close()
+            await state.db_supervisor.stop()
             
             state.is_connected = False
-            state.db_connection = None
+            state.db_supervisor = None
             state.db_type = None
+            state.db_version = None
             state.db_name = None
+            state.schema_snapshot = []
+            state.schema_fingerprint = None
             logger.info("Disconnected from database")
             
             return DisconnectResponse(message="Disconnected successfully")
@@ -173,92 +230,49 @@ async def get_schema():
         logger.error(f"Schema fetch error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 @app.post("/api/text-to-sql", response_model=TextToSQLResponse)
-async def text_to_sql(request: TextToSQLRequest):
-    """Convert natural language to SQL"""
+async def text_to_sql(request: TextToSQLRequest, http_request: Request):
+    """
+    Convert natural language to SQL. With a deadline (deadline_ms or the
+    X-Request-Deadline-Ms header) a stage that runs over degrades instead: the last
+    fetched schema, no similar-question search, template or fallback SQL instead of
+    the model, the SQL without executing it; "degradations" lists what was applied.
+    """
     start_time = time.time()
     try:
         logger.info(f"Processing query: {request.query}")
+        deadline = Deadline.from_request(request.deadline_ms, http_request.headers.get(DEADLINE_HEADER))
         
-        # Get schema if connected
-        schema_data = None
-        if state.is_connected:
-            logger.info("🔄 Database is connected, fetching schema...")
-            schema_data = await fetch_schema()
-            
-            # 🔴 CRITICAL DEBUGGING
-            logger.info("=" * 60)
-            logger.info(f"SCHEMA FETCH RESULT:")
-            logger.info(f"Schema type: {type(schema_data)}")
-            logger.info(f"Schema length: {len(schema_data)}")
-            
-            if schema_data and len(schema_data) > 0:
-                logger.info(f"First table: {schema_data[0]}")
-                # Extract table names
-                table_names = []
-                for table in schema_data:
-                    if isinstance(table, dict):
-                        name = table.get('name') or table.get('table_name', 'unknown')
-                        table_names.append(name)
-                logger.info(f"Tables in schema: {table_names}")
-            else:
-                logger.warning("⚠️ Schema data is empty or None!")
-            logger.info("=" * 60)
-        else:
-            logger.warning("⚠️ Not connected to database!")
-        
-        # Generate SQL using Ollama SQLCoder
-        logger.info(f"Calling SQLGenerator.generate with schema of length: {len(schema_data) if schema_data else 0}")
-        sql = await state.sql_generator.generate(
-            natural_language_query=request.query,
-            schema=schema_data
-        )
-        
-        # CRITICAL: Verify SQL is not empty
-        if not sql or sql.strip() == "":
-            logger.error("❌ Generated SQL is empty!")
-            sql = f"-- Error: Could not generate SQL for: {request.query}"
-        
-        logger.info(f"✅ Final SQL to return: {sql[:100]}...")
-        
-        results = None
-        execution_time = None
-        error = None
+        schema_data = await load_generation_schema(deadline)
         
-        # Execute if connected and requested
-        if state.is_connected and request.execute:
-            execution_start = time.time()
+        cache_key = generation_cache_key(request.query)
+        lookup = await find_cached_sql(request.query, cache_key, deadline)
+        sql = lookup["sql"]
+        cached = sql is not None
+        if not cached:
+            # Generate SQL using Ollama SQLCoder
+            logger.info(f"Calling SQLGenerator.generate with schema of length: {len(schema_data) if schema_data else 0}")
             try:
-                results = await execute_query(sql, request.limit)
-                execution_time = time.time() - execution_start
-                logger.info(f"Query executed, returned {len(results) if results else 0} rows")
-            except Exception as e:
-                error = str(e)
-                logger.warning(f"Query execution failed: {error}")
-        
-        # Add to history
-        history_item = {
-            "id": len(state.query_history) + 1,
-            "query": request.query,
-            "sql": sql,
-            "timestamp": time.time(),
-            "status": "success" if results is not None else "error" if error else "pending"
-        }
-        state.query_history.append(history_item)
-        
-        # Create response dictionary explicitly
-        response_dict = {
-            "sql": sql,
-            "results": results,
-            "error": error,
-            "execution_time": execution_time,
-            "row_count": len(results) if results else 0
-        }
+                sql = await cancel_on_disconnect(http_request, deadline.within("generation", state.sql_generator.generate(
+                    natural_language_query=request.query,
+                    schema=schema_data,
+                    examples=lookup["examples"],
+                    validate=explain_dry_run,
+                    dialect=state.db_type
+                )))
+            except asyncio.TimeoutError:
+                sql, source = state.sql_generator.generate_without_model(request.query, schema_data, state.db_type)
+                deadline.degrade(f"{source}_sql")
         
-        logger.info(f"📤 Response dict: {response_dict}")
+        response_dict = await complete_text_to_sql(
+            request, sql, schema_data, cache_key=cache_key, cached=cached, similar_question=lookup["similar_question"],
+            deadline=deadline
+        )
         
         # Return as Pydantic model
         return TextToSQLResponse(**response_dict)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Text-to-SQL error: {str(e)}")
         error_response = {
@@ -270,16 +284,100 @@ async def text_to_sql(request: TextToSQLRequest):
         }
         return TextToSQLResponse(**error_response)
 
+@app.post("/api/text-to-sql/stream")
+async def text_to_sql_stream(request: TextToSQLRequest, http_request: Request):
+    """
+    Convert natural language to SQL, streamed as Server-Sent Events:
+    "token" events carry each model token and the cleaned SQL so far, "sql" the
+    validated statement, and "result" the same fields as /api/text-to-sql
+    """
+    logger.info(f"Processing streamed query: {request.query}")
+    
+    # Token streaming is never cut short; the deadline bounds the other stages
+    deadline = Deadline.from_request(request.deadline_ms, http_request.headers.get(DEADLINE_HEADER))
+    
+    async def event_stream():
+        try:
+            schema_data = await load_generation_schema(deadline)
+            
+            cache_key = generation_cache_key(request.query)
+            lookup = await find_cached_sql(request.query, cache_key, deadline)
+            sql = lookup["sql"]
+            cached = sql is not None
+            if not cached:
+                # Leaving this block early closes the Ollama stream and stops generation
+                generation = state.sql_generator.generate_stream(request.query, schema_data, examples=lookup["examples"],
+                                                                 dialect=state.db_type)
+                async with aclosing(generation) as events:
+                    async for event in events:
+                        if event["type"] == "token":
+                            yield sse_event("token", {"token": event["token"], "sql": event["sql"]})
+                            if await http_request.is_disconnected():
+                                logger.info("Client disconnected, cancelling generation")
+                                return
+                        else:
+                            sql = event["sql"]
+            
+            yield sse_event("sql", {"sql": sql, "cached": cached})
+            yield sse_event("result", await complete_text_to_sql(
+                request, sql, schema_data, cache_key=cache_key, cached=cached,
+                similar_question=lookup["similar_question"], deadline=deadline
+            ))
+            yield sse_event("done", {})
+        except Exception as e:
+            logger.error(f"Streamed text-to-SQL error: {str(e)}")
+            yield sse_event("error", {"error": str(e)})
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.post("/api/execute/approximate")
+async def execute_approximate(request: ApproximateQueryRequest, http_request: Request):
+    """Stream sampled estimates of an aggregate query, refined until the exact result arrives (SSE)"""
+    if not state.is_connected:
+        raise HTTPException(status_code=400, detail="Not connected to database")
+    
+    engine = ApproximateQueryEngine(execute_query, state.db_type)
+    schema_data = state.schema_snapshot or await fetch_schema()
+    
+    async def event_stream():
+        try:
+            async for stage in engine.progressive(
+                request.sql,
+                schema=schema_data,
+                sample_percents=request.sample_percents,
+                refine=request.refine,
+                confidence=request.confidence,
+                limit=request.limit
+            ):
+                yield sse_event(stage["stage"], stage)
+                if await http_request.is_disconnected():
+                    logger.info("Client stopped listening, abandoning refinement")
+                    return
+            yield sse_event("done", {})
+        except Exception as e:
+            logger.error(f"Approximate execution error: {str(e)}")
+            yield sse_event("error", {"error": str(e)})
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.post("/api/explain", response_model=ExplainResponse)
-async def explain_sql(request: ExplainRequest):
+async def explain_sql(request: ExplainRequest, http_request: Request):
     """Explain SQL query in plain English"""
     try:
-        explanation = await state.sql_explainer.explain(request.sql)
+        explanation = await cancel_on_disconnect(http_request, state.sql_explainer.explain(request.sql))
         return ExplainResponse(explanation=explanation)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Explain error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/explain/batch", response_model=ExplainBatchResponse)
+async def explain_sql_batch(request: ExplainBatchRequest, http_request: Request):
+    """Explain many queries (e.g. a page of history); identical shapes are explained once"""
+    explanations = await cancel_on_disconnect(http_request, state.sql_explainer.explain_many(request.queries))
+    return ExplainBatchResponse(explanations=explanations)
+
 @app.get("/api/history")
 async def get_history(limit: int = 50):
     """Get query history for History tab in UI"""
@@ -287,6 +385,69 @@ async def get_history(limit: int = 50):
         "queries": state.query_history[-limit:]
     }
 
+@app.get("/api/history/shapes")
+async def get_history_shapes(limit: int = 20, sort: str = "total_ms"):
+    """Execution latency per query shape (SQL fingerprint), slowest first"""
+    if sort not in SHAPE_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(SHAPE_SORT_KEYS)}")
+    return {
+        "shapes": state.query_shapes.summary(limit, sort),
+        "tracked": len(state.query_shapes.shapes)
+    }
+
+@app.post("/api/profile", response_model=ProfileResponse)
+async def profile_sql(request: ProfileRequest):
+    """Run a query under the dialect's analyze mode (rolled back) and return its plan tree"""
+    if not state.is_connected:
+        raise HTTPException(status_code=400, detail="Not connected to database")
+    
+    is_valid, message = await validate_query(request.sql)
+    if not is_valid:
+        raise HTTPException(status_code=400, detail=message)
+    
+    try:
+        profile = await state.db_supervisor.run(
+            lambda connection: QueryProfiler(connection, state.db_type).profile(request.sql),
+            read_only=parse_sql(request.sql).read_only
+        )
+        return ProfileResponse(**profile)
+    except Exception as e:
+        logger.error(f"Profile error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/stats")
+async def get_stats():
+    """Generation counters, template fast-path and SQL cache hit rates, and Ollama server load"""
+    return {
+        "generation": state.sql_generator.generation_stats() if state.sql_generator else None,
+        "fast_path": state.sql_generator.templates.stats() if state.sql_generator else None,
+        "ollama": state.ollama_client.status() if state.ollama_client else None,
+        "sql_cache": state.sql_cache.stats(),
+        "explanation": state.sql_explainer.stats() if state.sql_explainer else None,
+        "coalesced": {
+            "generation": state.sql_generator.flights.stats() if state.sql_generator else None,
+            "execution": state.query_flights.stats()
+        }
+    }
+
+@app.get("/api/index-advisor")
+async def index_advisor(what_if: bool = True):
+    """Ranked index suggestions per table, based on plans of executed generated queries"""
+    suggestions = state.index_advisor.suggest(state.schema_snapshot)
+    
+    hypothetical = False
+    if what_if and suggestions and state.is_connected and state.db_type == DatabaseType.POSTGRESQL:
+        try:
+            hypothetical = await state.index_advisor.what_if(suggestions, execute_query)
+        except Exception as e:
+            logger.warning(f"Hypothetical index check failed: {str(e)}")
+    
+    return {
+        "tables": suggestions,
+        "observed_queries": len(state.index_advisor.queries),
+        "what_if": hypothetical
+    }
+
 @app.post("/api/validate")
 async def validate_sql(request: ValidateSQLRequest):
     """Validate SQL query without executing"""
@@ -302,57 +463,80 @@ async def validate_sql(request: ValidateSQLRequest):
 
 @app.get("/api/health")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness: the process is up, whatever the state of Ollama"""
+    # Ping the database rather than trusting the connect-time flag
+    database_health = await state.db_supervisor.check() if state.is_connected and state.db_supervisor else None
     return {
         "status": "healthy",
-        "database_connected": state.is_connected,
+        "database_connected": bool(database_health and database_health["alive"]),
+        "database_health": database_health,
         "database_type": state.db_type,
         "database_name": state.db_name,
-        "ollama_available": await state.sql_generator.check_availability() if state.sql_generator else False
+        "ollama_available": bool(state.ollama_client and state.ollama_client.ready)
     }
 
+@app.get("/api/ready")
+async def readiness_check():
+    """Readiness: 503 until at least one Ollama server answers with the model loaded"""
+    ollama_status = state.ollama_client.status() if state.ollama_client else {"ready": False, "endpoints": []}
+    return JSONResponse(
+        status_code=200 if ollama_status["ready"] else 503,
+        content={"ready": ollama_status["ready"], "ollama": ollama_status}
+    )
+
 # Helper Functions
 async def connect_with_credentials(credentials: ConnectRequest):
     """Connect using individual credentials"""
     try:
+        if state.db_supervisor:
+            await state.db_supervisor.stop()
+            state.db_supervisor = None
+        
         state.db_type = credentials.db_type.lower()
         
-        if state.db_type == DatabaseType.POSTGRESQL:
-            state.db_connection = await asyncpg.connect(
-                host=credentials.host,
-                port=credentials.port or 5433,
-                database=credentials.database,
-                user=credentials.username,
-                password=credentials.password
-            )
-            state.db_name = credentials.database
-            
-        elif state.db_type == DatabaseType.MYSQL:
-            state.db_connection = await aiomysql.connect(
-                host=credentials.host,
-                port=credentials.port or 3306,
-                db=credentials.database,
-                user=credentials.username,
-                password=credentials.password,
-                autocommit=True
-            )
-            state.db_name = credentials.database
-            
-        elif state.db_type == DatabaseType.SQLITE:
-            state.db_connection = await aiosqlite.connect(credentials.database)
-            state.db_name = credentials.database
+        # The supervisor calls this again to reconnect after the connection breaks
+        async def open_connection():
+            if state.db_type == DatabaseType.POSTGRESQL:
+                return await asyncpg.connect(
+                    host=credentials.host,
+                    port=credentials.port or 5433,
+                    database=credentials.database,
+                    user=credentials.username,
+                    password=credentials.password
+                )
+                
+            elif state.db_type == DatabaseType.MYSQL:
+                return await aiomysql.connect(
+                    host=credentials.host,
+                    port=credentials.port or 3306,
+                    db=credentials.database,
+                    user=credentials.username,
+                    password=credentials.password,
+                    autocommit=True
+                )
+                
+            elif state.db_type == DatabaseType.SQLITE:
+                return await aiosqlite.connect(credentials.database)
+                
+            elif state.db_type == DatabaseType.SQLSERVER:
+                # SQL Server connection using pyodbc
+                conn_str = (
+                    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+                    f"SERVER={credentials.host},{credentials.port or 1433};"
+                    f"DATABASE={credentials.database};"
+                    f"UID={credentials.username};"
+                    f"PWD={credentials.password}"
+                )
+                return pyodbc.connect(conn_str)
             
-        elif state.db_type == DatabaseType.SQLSERVER:
-            # SQL Server connection using pyodbc
-            conn_str = (
-                f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                f"SERVER={credentials.host},{credentials.port or 1433};"
-                f"DATABASE={credentials.database};"
-                f"UID={credentials.username};"
-                f"PWD={credentials.password}"
-            )
-            state.db_connection = pyodbc.connect(conn_str)
-            state.db_name = credentials.database
+            raise ValueError(f"Unsupported database type: {state.db_type}")
+        
+        supervisor = ConnectionSupervisor(state.db_type, open_connection)
+        await supervisor.start()
+        state.db_supervisor = supervisor
+        state.db_name = credentials.database
+        # MySQL before 8.0 has neither window functions nor CTEs (SQLite's version is the local library's)
+        state.db_version = supervisor.connection.get_server_info() if state.db_type == DatabaseType.MYSQL else None
         
         state.is_connected = True
         logger.info(f"Connected to {state.db_type} database: {state.db_name}")
@@ -394,22 +578,41 @@ async def fetch_schema() -> List[Dict[str, Any]]:
         logger.info(f"Fetching schema for {state.db_type} database")
         
         if state.db_type == DatabaseType.POSTGRESQL:
-            return await fetch_postgresql_schema()
+            fetch_dialect_schema = fetch_postgresql_schema
         elif state.db_type == DatabaseType.MYSQL:
-            return await fetch_mysql_schema()
+            fetch_dialect_schema = fetch_mysql_schema
         elif state.db_type == DatabaseType.SQLITE:
-            return await fetch_sqlite_schema()
+            fetch_dialect_schema = fetch_sqlite_schema
         elif state.db_type == DatabaseType.SQLSERVER:
-            return await fetch_sqlserver_schema()
+            fetch_dialect_schema = fetch_sqlserver_schema
         else:
             logger.warning(f"Unsupported database type: {state.db_type}")
             return []
+        
+        # Through the supervisor so a connection found dead is restored first
+        schema = await state.db_supervisor.run(fetch_dialect_schema, read_only=True)
+        
+        state.schema_snapshot = schema
+        
+        # Cached SQL written against the old schema may reference what is gone
+        fingerprint = schema_fingerprint(schema)
+        if fingerprint:
+            if state.schema_fingerprint and fingerprint != state.schema_fingerprint:
+                state.sql_cache.invalidate(state.schema_fingerprint)
+                state.similar_questions.invalidate(state.schema_fingerprint)
+            state.schema_fingerprint = fingerprint
+        return schema
             
     except Exception as e:
         logger.error(f"Schema fetch failed: {str(e)}")
         return []
 
-async def fetch_postgresql_schema() -> List[Dict[str, Any]]:
+def raise_if_disconnected(error: Exception, connection):
+    """Let a lost connection reach the supervisor, which reconnects and retries, rather than yield no schema"""
+    if state.db_supervisor and state.db_supervisor.is_connection_error(error, connection):
+        raise error
+
+async def fetch_postgresql_schema(connection) -> List[Dict[str, Any]]:
     """Fetch PostgreSQL schema"""
     try:
         # Get all tables
@@ -420,7 +623,7 @@ async def fetch_postgresql_schema() -> List[Dict[str, Any]]:
         AND table_type = 'BASE TABLE'
         ORDER BY table_name;
         """
-        table_rows = await state.db_connection.fetch(tables_query)
+        table_rows = await connection.fetch(tables_query)
         
         schema = []
         for table_row in table_rows:
@@ -445,7 +648,7 @@ async def fetch_postgresql_schema() -> List[Dict[str, Any]]:
             WHERE table_name = $1 AND table_schema = 'public'
             ORDER BY ordinal_position;
             """
-            column_rows = await state.db_connection.fetch(columns_query, table_name)
+            column_rows = await connection.fetch(columns_query, table_name)
             
             columns = []
             for col in column_rows:
@@ -459,9 +662,10 @@ async def fetch_postgresql_schema() -> List[Dict[str, Any]]:
             # Get row count (estimate for performance)
             try:
                 count_query = f'SELECT COUNT(*) as count FROM "{table_name}"'
-                count_result = await state.db_connection.fetch(count_query)
+                count_result = await connection.fetch(count_query)
                 row_count = count_result[0]['count'] if count_result else 0
-            except:
+            except Exception as e:
+                raise_if_disconnected(e, connection)
                 row_count = 0
             
             schema.append({
@@ -474,10 +678,11 @@ async def fetch_postgresql_schema() -> List[Dict[str, Any]]:
         return schema
         
     except Exception as e:
+        raise_if_disconnected(e, connection)
         logger.error(f"Error fetching PostgreSQL schema: {str(e)}")
         return []
 
-async def fetch_mysql_schema() -> List[Dict[str, Any]]:
+async def fetch_mysql_schema(connection) -> List[Dict[str, Any]]:
     """Fetch MySQL schema"""
     try:
         # Get all tables and columns
@@ -493,7 +698,7 @@ async def fetch_mysql_schema() -> List[Dict[str, Any]]:
         ORDER BY TABLE_NAME, ORDINAL_POSITION;
         """
         
-        async with state.db_connection.cursor(aiomysql.DictCursor) as cursor:
+        async with connection.cursor(aiomysql.DictCursor) as cursor:
             await cursor.execute(query)
             rows = await cursor.fetchall()
             
@@ -518,11 +723,12 @@ async def fetch_mysql_schema() -> List[Dict[str, Any]]:
             # Get row counts for each table
             for table_name in tables_dict:
                 try:
-                    async with state.db_connection.cursor() as count_cursor:
+                    async with connection.cursor() as count_cursor:
                         await count_cursor.execute(f"SELECT COUNT(*) FROM `{table_name}`")
                         count_result = await count_cursor.fetchone()
                         tables_dict[table_name]["rowCount"] = count_result[0] if count_result else 0
-                except:
+                except Exception as e:
+                    raise_if_disconnected(e, connection)
                     tables_dict[table_name]["rowCount"] = 0
             
             schema = list(tables_dict.values())
@@ -530,16 +736,17 @@ async def fetch_mysql_schema() -> List[Dict[str, Any]]:
             return schema
             
     except Exception as e:
+        raise_if_disconnected(e, connection)
         logger.error(f"Error fetching MySQL schema: {str(e)}")
         return []
 
-async def fetch_sqlite_schema() -> List[Dict[str, Any]]:
+async def fetch_sqlite_schema(connection) -> List[Dict[str, Any]]:
     """Fetch SQLite schema"""
     try:
         tables = []
         
         # Get all tables
-        cursor = await state.db_connection.execute(
+        cursor = await connection.execute(
             "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name;"
         )
         table_rows = await cursor.fetchall()
@@ -548,7 +755,7 @@ async def fetch_sqlite_schema() -> List[Dict[str, Any]]:
             table_name = table_row[0]
             
             # Get columns
-            cursor = await state.db_connection.execute(f"PRAGMA table_info(`{table_name}`)")
+            cursor = await connection.execute(f"PRAGMA table_info(`{table_name}`)")
             columns_data = await cursor.fetchall()
             
             columns = []
@@ -562,10 +769,11 @@ async def fetch_sqlite_schema() -> List[Dict[str, Any]]:
             
             # Get row count
             try:
-                cursor = await state.db_connection.execute(f"SELECT COUNT(*) FROM `{table_name}`")
+                cursor = await connection.execute(f"SELECT COUNT(*) FROM `{table_name}`")
                 count = await cursor.fetchone()
                 row_count = count[0] if count else 0
-            except:
+            except Exception as e:
+                raise_if_disconnected(e, connection)
                 row_count = 0
             
             tables.append({
@@ -578,13 +786,14 @@ async def fetch_sqlite_schema() -> List[Dict[str, Any]]:
         return tables
         
     except Exception as e:
+        raise_if_disconnected(e, connection)
         logger.error(f"Error fetching SQLite schema: {str(e)}")
         return []
 
-async def fetch_sqlserver_schema() -> List[Dict[str, Any]]:
+async def fetch_sqlserver_schema(connection) -> List[Dict[str, Any]]:
     """Fetch SQL Server schema"""
     try:
-        cursor = state.db_connection.cursor()
+        cursor = connection.cursor()
         
         # Get all tables and columns
         query = """
@@ -632,11 +841,12 @@ async def fetch_sqlserver_schema() -> List[Dict[str, Any]]:
         # Get row counts for each table
         for table_name in tables_dict:
             try:
-                count_cursor = state.db_connection.cursor()
+                count_cursor = connection.cursor()
                 count_cursor.execute(f"SELECT COUNT(*) FROM [{table_name}]")
                 count_result = count_cursor.fetchone()
                 tables_dict[table_name]["rowCount"] = count_result[0] if count_result else 0
-            except:
+            except Exception as e:
+                raise_if_disconnected(e, connection)
                 tables_dict[table_name]["rowCount"] = 0
         
         schema = list(tables_dict.values())
@@ -644,173 +854,333 @@ async def fetch_sqlserver_schema() -> List[Dict[str, Any]]:
         return schema
         
     except Exception as e:
+        raise_if_disconnected(e, connection)
         logger.error(f"Error fetching SQL Server schema: {str(e)}")
         return []
 
-async def fetch_sqlite_schema():
-    """Fetch SQLite schema"""
+async def execute_query(sql: str, limit: Optional[int] = None):
+    """Execute SQL query and return results"""
+    if not state.is_connected:
+        raise Exception("Not connected to database")
+    
+    # Only single read-only statements get to the database, and run where it refuses writes
+    parsed = parse_sql(sql)
+    if parsed.read_only_violation:
+        raise Exception(f"Query refused: {parsed.read_only_violation}")
+    
+    # Bound the rows in the dialect's syntax, unless the statement already does
+    sql = parsed.with_limit(limit, state.db_type)
+    limited = parse_sql(sql)
+    supervisor = state.db_supervisor
+    
+    def run():
+        # Having passed the check it only reads: retried once if the connection dropped under it
+        return supervisor.run(lambda connection: run_read_only(connection, sql), read_only=True)
+    
     try:
-        tables = []
-        
-        # Get all tables
-        cursor = await state.db_connection.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name;"
-        )
-        table_rows = await cursor.fetchall()
-        
-        for table_row in table_rows:
-            table_name = table_row[0]
-            
-            # Get columns
-            cursor = await state.db_connection.execute(f"PRAGMA table_info(`{table_name}`)")
-            columns_data = await cursor.fetchall()
-            
-            columns = []
-            for col in columns_data:
-                columns.append({
-                    "name": col[1],
-                    "type": col[2],
-                    "nullable": not col[3],
-                    "isPrimary": col[5] == 1
-                })
-            
-            # Get row count
-            try:
-                cursor = await state.db_connection.execute(f"SELECT COUNT(*) FROM `{table_name}`")
-                count = await cursor.fetchone()
-                row_count = count[0] if count else 0
-            except:
-                row_count = 0
-            
-            tables.append({
-                "name": table_name,
-                "columns": columns,
-                "rowCount": row_count
-            })
-        
-        logger.info(f"SQLite: Fetched {len(tables)} tables: {[t['name'] for t in tables]}")
-        return tables
-        
+        # Identical reads already running on this connection are joined, not repeated: the same
+        # text however spaced or commented. Not by fingerprint, which lower-cases identifiers
+        # that MySQL may tell apart (`Users` and `users`); that only groups latency statistics
+        rows = await state.query_flights.do((id(supervisor), limited.compact), run)
+        return [dict(row) for row in rows]  # each caller gets rows it can modify
     except Exception as e:
-        logger.error(f"Error fetching SQLite schema: {str(e)}")
-        return []
+        logger.error(f"Query execution failed: {str(e)}")
+        raise e
 
-async def fetch_sqlserver_schema():
-    """Fetch SQL Server schema"""
+async def explain_dry_run(sql: str) -> bool:
+    """Whether the database can plan the statement; EXPLAIN without ANALYZE does not run it"""
+    explain = {
+        DatabaseType.POSTGRESQL: "EXPLAIN",
+        DatabaseType.MYSQL: "EXPLAIN",
+        DatabaseType.SQLITE: "EXPLAIN QUERY PLAN"
+    }.get(state.db_type)
+    if not explain or not state.is_connected or not state.db_supervisor:
+        # Nothing to check against (SQL Server plans need SHOWPLAN in a batch of its own)
+        return True
+    statement = f"{explain} {sql.strip().rstrip(';')}"
     try:
-        cursor = state.db_connection.cursor()
-        
-        # Get all tables and columns
-        query = """
-        SELECT 
-            t.TABLE_NAME,
-            c.COLUMN_NAME,
-            c.DATA_TYPE,
-            c.IS_NULLABLE,
-            CASE WHEN pk.COLUMN_NAME IS NOT NULL THEN 1 ELSE 0 END as IS_PRIMARY
-        FROM INFORMATION_SCHEMA.TABLES t
-        JOIN INFORMATION_SCHEMA.COLUMNS c 
-            ON t.TABLE_NAME = c.TABLE_NAME
-        LEFT JOIN (
-            SELECT ku.TABLE_NAME, ku.COLUMN_NAME
-            FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
-            JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE ku
-                ON tc.CONSTRAINT_NAME = ku.CONSTRAINT_NAME
-            WHERE tc.CONSTRAINT_TYPE = 'PRIMARY KEY'
-        ) pk ON c.TABLE_NAME = pk.TABLE_NAME AND c.COLUMN_NAME = pk.COLUMN_NAME
-        WHERE t.TABLE_TYPE = 'BASE TABLE'
-        ORDER BY t.TABLE_NAME, c.ORDINAL_POSITION;
-        """
-        
-        cursor.execute(query)
-        rows = cursor.fetchall()
+        await state.db_supervisor.run(lambda connection: run_statement(connection, statement), read_only=True)
+        return True
+    except Exception as e:
+        logger.info(f"Dry run rejected SQL: {str(e)}")
+        return False
+
+async def run_read_only(connection, sql: str):
+    """Run one statement in a read-only transaction of the current database type"""
+    async with read_only_transaction(connection, state.db_type):
+        return await run_statement(connection, sql)
+
+async def run_statement(connection, sql: str):
+    """Run one statement on a connection of the current database type"""
+    if state.db_type == DatabaseType.POSTGRESQL:
+        rows = await connection.fetch(sql)
+        return [dict(row) for row in rows]
         
-        # Group by table
-        tables_dict = {}
-        for row in rows:
-            table_name = row[0]
-            if table_name not in tables_dict:
-                tables_dict[table_name] = {
-                    "name": table_name,
-                    "columns": [],
-                    "rowCount": 0
-                }
+    elif state.db_type == DatabaseType.MYSQL:
+        async with connection.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql)
+            rows = await cursor.fetchall()
+            return rows
             
-            tables_dict[table_name]["columns"].append({
-                "name": row[1],
-                "type": row[2],
-                "nullable": row[3] == 'YES',
-                "isPrimary": row[4]
-            })
+    elif state.db_type == DatabaseType.SQLITE:
+        cursor = await connection.execute(sql)
+        rows = await cursor.fetchall()
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
         
-        # Get row counts for each table
-        for table_name in tables_dict:
-            try:
-                count_cursor = state.db_connection.cursor()
-                count_cursor.execute(f"SELECT COUNT(*) FROM [{table_name}]")
-                count_result = count_cursor.fetchone()
-                tables_dict[table_name]["rowCount"] = count_result[0] if count_result else 0
-            except:
-                tables_dict[table_name]["rowCount"] = 0
+    elif state.db_type == DatabaseType.SQLSERVER:
+        cursor = connection.cursor()
+        cursor.execute(sql)
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+async def load_generation_schema(deadline: Optional[Deadline] = None) -> Optional[List[Dict[str, Any]]]:
+    """Schema handed to the generator; None when no database is connected"""
+    deadline = deadline or Deadline()
+    # Get schema if connected
+    schema_data = None
+    if state.is_connected:
+        logger.info("🔄 Database is connected, fetching schema...")
+        try:
+            # A fetch that runs over finishes in the background and refreshes the snapshot
+            schema_data = await deadline.within("schema", fetch_schema(), detach=True)
+        except asyncio.TimeoutError:
+            schema_data = state.schema_snapshot
+            deadline.degrade("stale_schema")
         
-        schema = list(tables_dict.values())
-        logger.info(f"SQL Server: Fetched {len(schema)} tables: {[t['name'] for t in schema]}")
-        return schema
+        # 🔴 CRITICAL DEBUGGING
+        logger.info("=" * 60)
+        logger.info(f"SCHEMA FETCH RESULT:")
+        logger.info(f"Schema type: {type(schema_data)}")
+        logger.info(f"Schema length: {len(schema_data)}")
         
-    except Exception as e:
-        logger.error(f"Error fetching SQL Server schema: {str(e)}")
-        return []
+        if schema_data and len(schema_data) > 0:
+            logger.info(f"First table: {schema_data[0]}")
+            # Extract table names
+            table_names = []
+            for table in schema_data:
+                if isinstance(table, dict):
+                    name = table.get('name') or table.get('table_name', 'unknown')
+                    table_names.append(name)
+            logger.info(f"Tables in schema: {table_names}")
+        else:
+            logger.warning("⚠️ Schema data is empty or None!")
+        logger.info("=" * 60)
+    else:
+        logger.warning("⚠️ Not connected to database!")
+    return schema_data
 
-async def execute_query(sql: str, limit: Optional[int] = None):
-    """Execute SQL query and return results"""
-    if not state.is_connected:
-        raise Exception("Not connected to database")
+async def complete_text_to_sql(request: TextToSQLRequest, sql: str, schema_data: Optional[List[Dict[str, Any]]],
+                               cache_key: Optional[str] = None, cached: bool = False,
+                               similar_question: Optional[str] = None,
+                               deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """Rewrite, optionally execute and record generated SQL; returns the TextToSQLResponse fields"""
+    deadline = deadline or Deadline()
+    # SQL written under time pressure (stale schema, no model) is not worth remembering
+    cacheable = not deadline.degradations
+    generated_sql = sql
+    # CRITICAL: Verify SQL is not empty
+    if not sql or sql.strip() == "":
+        logger.error("❌ Generated SQL is empty!")
+        sql = f"-- Error: Could not generate SQL for: {request.query}"
     
-    # Add LIMIT if not present and limit is specified
-    if limit and "LIMIT" not in sql.upper():
-        sql += f" LIMIT {limit}"
+    # Rewrite generated SQL before it reaches the database
+    optimization = state.sql_optimizer.optimize(
+        sql,
+        schema=schema_data,
+        db_type=state.db_type,
+        visible_columns=request.visible_columns,
+        rules=request.rewrite_rules,
+        server_version=state.db_version
+    )
+    sql = optimization["sql"]
+    rewrites = optimization["rewrites"]
     
-    try:
-        if state.db_type == DatabaseType.POSTGRESQL:
-            rows = await state.db_connection.fetch(sql)
-            return [dict(row) for row in rows]
-            
-        elif state.db_type == DatabaseType.MYSQL:
-            async with state.db_connection.cursor(aiomysql.DictCursor) as cursor:
-                await cursor.execute(sql)
-                rows = await cursor.fetchall()
-                return rows
-                
-        elif state.db_type == DatabaseType.SQLITE:
-            cursor = await state.db_connection.execute(sql)
-            rows = await cursor.fetchall()
-            columns = [description[0] for description in cursor.description]
-            return [dict(zip(columns, row)) for row in rows]
-            
-        elif state.db_type == DatabaseType.SQLSERVER:
-            cursor = state.db_connection.cursor()
-            cursor.execute(sql)
-            columns = [column[0] for column in cursor.description]
-            rows = cursor.fetchall()
-            return [dict(zip(columns, row)) for row in rows]
+    logger.info(f"✅ Final SQL to return: {sql[:100]}...")
+    
+    results = None
+    execution_time = None
+    error = None
+    sample_percent = None
+    confidence_bounds = None
+    
+    # Execute if connected and requested
+    if state.is_connected and request.execute:
+        execution_start = time.time()
+        try:
+            estimate, results = await deadline.within("execution", execute_generated_sql(sql, schema_data, request))
+            if estimate:
+                sample_percent = estimate["sample_percent"]
+                confidence_bounds = estimate["bounds"]
+            execution_time = time.time() - execution_start
+            if not estimate:
+                state.query_shapes.record(sql, execution_time)
             
-    except Exception as e:
-        logger.error(f"Query execution failed: {str(e)}")
-        raise e
+            # The advisor may EXPLAIN the query: in the background, off the request's clock
+            if not estimate:
+                schedule_query_plan(sql, execution_time)
+            logger.info(f"Query executed, returned {len(results) if results else 0} rows")
+        except asyncio.TimeoutError:
+            deadline.degrade("sql_only")
+        except Exception as e:
+            error = str(e)
+            state.query_shapes.record(sql, None)
+            logger.warning(f"Query execution failed: {error}")
+    
+    # Add to history
+    history_item = {
+        "id": len(state.query_history) + 1,
+        "query": request.query,
+        "sql": sql,
+        "fingerprint": parse_sql(sql).fingerprint,
+        "execution_time": execution_time,
+        "timestamp": time.time(),
+        "status": "success" if results is not None else "error" if error else "pending"
+    }
+    state.query_history.append(history_item)
+    
+    # Cache what the model wrote (rewrites depend on the request), unless it failed
+    if cache_key and cacheable and not cached and error is None and generated_sql and generated_sql.strip() != FALLBACK_SQL:
+        state.sql_cache.put(cache_key, generated_sql, state.schema_fingerprint)
+        schedule_question_indexing(request.query, generated_sql)
+    
+    # Create response dictionary explicitly
+    response_dict = {
+        "sql": sql,
+        "results": results,
+        "error": error,
+        "execution_time": execution_time,
+        "row_count": len(results) if results else 0,
+        "sample_percent": sample_percent,
+        "confidence_bounds": confidence_bounds,
+        "rewrites": rewrites,
+        "cached": cached,
+        "similar_question": similar_question,
+        "degradations": deadline.degradations
+    }
+    
+    logger.info(f"📤 Response dict: {response_dict}")
+    return response_dict
 
-async def validate_query(sql: str):
-    """Basic SQL validation"""
-    sql_upper = sql.upper().strip()
+def generation_cache_key(question: str) -> str:
+    """Same question, schema, model and dialect produce the same SQL"""
+    return QueryCache.key(normalize_question(question), state.schema_fingerprint, state.sql_generator.model_name, state.db_type)
+
+async def find_cached_sql(question: str, cache_key: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    SQL answering a question without generation: an exact cache hit, else the SQL of a
+    close enough paraphrase. A less similar past question comes back as a few-shot example.
+    """
+    deadline = deadline or Deadline()
+    sql = state.sql_cache.get(cache_key)
+    if sql is not None:
+        logger.info("⚡ Using cached SQL for this question")
+        return {"sql": sql, "examples": None, "similar_question": None}
     
-    # Check for dangerous operations
-    dangerous_keywords = ['DROP', 'DELETE', 'TRUNCATE', 'ALTER', 'CREATE', 'INSERT', 'UPDATE']
+    similar = None
+    try:
+        similar = await deadline.within("lookup", state.similar_questions.search(question, state.schema_fingerprint, state.db_type))
+    except asyncio.TimeoutError:
+        deadline.degrade("skipped_similar_questions")
+    except Exception as e:
+        logger.warning(f"Similar question search failed: {str(e)}")
     
-    first_word = sql_upper.split()[0] if sql_upper.split() else ''
+    if similar and similar["reuse"]:
+        logger.info(f"⚡ Reusing SQL of similar question \"{similar['question']}\" ({similar['similarity']:.2f})")
+        return {"sql": similar["sql"], "examples": None, "similar_question": similar["question"]}
+    if similar:
+        return {"sql": None, "examples": [similar], "similar_question": None}
+    return {"sql": None, "examples": None, "similar_question": None}
+
+async def execute_generated_sql(sql: str, schema_data: Optional[List[Dict[str, Any]]],
+                                 request: TextToSQLRequest):
+    """(sampling estimate or None, rows) for the execution mode the request asked for"""
+    estimate = None
+    if request.execution_mode == "approximate":
+        estimate = await execute_approximate_query(sql, schema_data, request.limit)
+    if estimate:
+        return estimate, estimate["results"]
+    return None, await execute_query(sql, request.limit)
+
+async def execute_approximate_query(sql: str, schema: Optional[List[Dict[str, Any]]], limit: Optional[int] = None):
+    """Run the first sampling stage of an aggregate query; None if it cannot be sampled"""
+    engine = ApproximateQueryEngine(execute_query, state.db_type)
+    plan = engine.plan(sql, schema)
+    if not plan["eligible"]:
+        logger.info(f"Approximate mode skipped: {plan['reason']}")
+        return None
+    return await engine.estimate(plan, DEFAULT_SAMPLE_PERCENTS[0], limit=limit)
+
+async def record_query_plan(supervisor, db_type: str, schema: List[Dict[str, Any]], sql: str,
+                            execution_time: float):
+    """Feed an executed query to the index advisor; failures never affect the request"""
+    async def explain(statement: str):
+        # Queued behind other statements by the supervisor, and never sent after a disconnect or to
+        # the next database: a stopped supervisor would open a fresh connection
+        if state.db_supervisor is not supervisor:
+            raise ConnectionError("Disconnected before the query plan was captured")
+        return await supervisor.run(lambda connection: run_read_only(connection, statement), read_only=True)
     
-    if first_word not in ['SELECT', 'WITH', 'EXPLAIN', 'SHOW', 'DESCRIBE']:
-        for keyword in dangerous_keywords:
-            if keyword in sql_upper:
-                return False, f"Dangerous operation detected: {keyword}"
+    if state.db_supervisor is not supervisor:
+        return
+    try:
+        await state.index_advisor.observe(sql, execution_time, db_type, explain, schema)
+    except Exception as e:
+        logger.warning(f"Index advisor could not record query: {str(e)}")
+
+def schedule_query_plan(sql: str, execution_time: float):
+    """
+    Record the query plan in a background task, unless too many are already pending. The
+    EXPLAIN goes through the connection supervisor, which runs one operation at a time
+    """
+    if not INDEX_ADVISOR_ENABLED:
+        return
+    if len(state.background_tasks) >= INDEX_ADVISOR_MAX_PENDING:
+        logger.info("Index advisor busy, query not recorded")
+        return
+    task = asyncio.create_task(record_query_plan(
+        state.db_supervisor, state.db_type, state.schema_snapshot, sql, execution_time
+    ))
+    state.background_tasks.add(task)
+    task.add_done_callback(state.background_tasks.discard)
+
+async def index_question(question: str, sql: str, fingerprint: Optional[str], dialect: Optional[str]):
+    try:
+        await state.similar_questions.add(question, sql, fingerprint, dialect)
+    except Exception as e:
+        logger.warning(f"Could not index question: {str(e)}")
+
+def schedule_question_indexing(question: str, sql: str):
+    """Embed and index the question in a background task, off the response path"""
+    task = asyncio.create_task(index_question(question, sql, state.schema_fingerprint, state.db_type))
+    state.indexing_tasks.add(task)
+    task.add_done_callback(state.indexing_tasks.discard)
+
+async def cancel_on_disconnect(http_request: Request, coroutine):
+    """Await a model call, cancelling it (and its request to Ollama) if the client goes away first"""
+    task = asyncio.create_task(coroutine)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                logger.info("Client disconnected, cancelling generation")
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def validate_query(sql: str):
+    """A single read-only statement: allowed statement type, nothing that writes, no denied function"""
+    violation = parse_sql(sql).read_only_violation
+    if violation:
+        return False, violation
     
     return True, "Query is valid"
 
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, validator
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 from enum import Enum
 import re
 
@@ -45,6 +45,11 @@ class TextToSQLRequest(BaseModel):
     query: str = Field(..., min_length=1, max_length=1000)
     execute: bool = False
     limit: Optional[int] = Field(100, ge=1, le=10000)
+    execution_mode: Literal["exact", "approximate"] = "exact"
+    visible_columns: Optional[List[str]] = None
+    rewrite_rules: Optional[Dict[str, bool]] = None
+    # Latency budget in milliseconds; stages that run over degrade instead of failing
+    deadline_ms: Optional[int] = Field(None, ge=1, le=600000)
 
 class TextToSQLResponse(BaseModel):
     sql: str
@@ -52,6 +57,26 @@ class TextToSQLResponse(BaseModel):
     error: Optional[str] = None
     execution_time: Optional[float] = None
     row_count: Optional[int] = None
+    sample_percent: Optional[float] = None
+    confidence_bounds: Optional[List[Dict[str, Any]]] = None
+    rewrites: Optional[List[Dict[str, str]]] = None
+    cached: bool = False
+    similar_question: Optional[str] = None
+    # What the deadline cost: stale_schema, skipped_similar_questions, template_sql, fallback_sql, sql_only
+    degradations: List[str] = []
+
+class ApproximateQueryRequest(BaseModel):
+    sql: str
+    sample_percents: Optional[List[float]] = None
+    refine: bool = True
+    confidence: float = Field(0.95, gt=0, lt=1)
+    limit: Optional[int] = Field(100, ge=1, le=10000)
+
+    @validator('sample_percents')
+    def check_sample_percents(cls, v):
+        if v is not None and any(p <= 0 or p >= 100 for p in v):
+            raise ValueError('Sample percents must be between 0 and 100')
+        return v
 
 class ExplainRequest(BaseModel):
     sql: str
@@ -59,6 +84,29 @@ class ExplainRequest(BaseModel):
 class ExplainResponse(BaseModel):
     explanation: str
 
+class ExplainBatchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=200)
+
+class ExplainBatchItem(BaseModel):
+    sql: str
+    explanation: Optional[str] = None
+    error: Optional[str] = None
+    cached: bool = False
+
+class ExplainBatchResponse(BaseModel):
+    explanations: List[ExplainBatchItem]
+
+class ProfileRequest(BaseModel):
+    sql: str
+
+class ProfileResponse(BaseModel):
+    dialect: str
+    sql: str
+    total_time_ms: float
+    planning_time_ms: Optional[float] = None
+    execution_time_ms: Optional[float] = None
+    plan: Dict[str, Any]
+
 class ValidateSQLRequest(BaseModel):
     sql: str
 
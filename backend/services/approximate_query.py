@@ -0,0 +1,239 @@
+import logging
+import math
+import os
+import time
+from statistics import NormalDist
+from typing import Optional, List, Dict, Any, Callable, Awaitable, AsyncIterator
+
+from utils.sql_ast import parse_select, tokens_to_sql, SelectItem
+from utils.sql_ir import parse_sql
+
+logger = logging.getLogger(__name__)
+
+# Aggregates that can be estimated from a uniform row sample
+ESTIMABLE_AGGREGATES = ['COUNT', 'SUM', 'AVG']
+
+DEFAULT_SAMPLE_PERCENTS = [1.0, 10.0]
+
+# Dialects with a row-level sampling rewrite in build_sample_sql()
+SAMPLING_DIALECTS = ('postgresql', 'mysql', 'sqlite', 'sqlserver')
+
+
+class ApproximateQueryEngine:
+    """
+    Run aggregate queries over a random sample of a large table:
+    - PostgreSQL: TABLESAMPLE BERNOULLI
+    - MySQL / SQLite / SQL Server: a randomly filtered subquery in place of the table
+    Every row is kept independently with the same probability: page-level sampling
+    (TABLESAMPLE SYSTEM, SQL Server's TABLESAMPLE) keeps clustered rows together and
+    would make the intervals far too narrow. COUNT and SUM are scaled up by the
+    sampling fraction, AVG is used as-is, and each estimate carries a
+    normal-approximation confidence interval.
+    """
+
+    def __init__(self, execute: Callable[..., Awaitable[List[Dict[str, Any]]]], db_type: str,
+                 min_rows: Optional[int] = None):
+        self.execute = execute
+        self.db_type = db_type
+        self.min_rows = min_rows if min_rows is not None else int(os.getenv("APPROX_MIN_ROWS", "100000"))
+
+    def plan(self, sql: str, schema: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Check whether a query can be sampled and describe how"""
+        if self.db_type not in SAMPLING_DIALECTS:
+            return {"eligible": False, "reason": f"Sampling is not implemented for {self.db_type}"}
+        query = parse_select(sql)
+        if query is None:
+            return {"eligible": False, "reason": "Only single SELECT statements can be sampled"}
+        if query.ctes or query.distinct or query.top:
+            return {"eligible": False, "reason": "CTEs, DISTINCT and TOP are not supported for sampling"}
+        if len(query.tables) != 1 or query.tables[0].subquery or not query.tables[0].name:
+            return {"eligible": False, "reason": "Sampling needs a single base table without joins"}
+        if query.having:
+            return {"eligible": False, "reason": "HAVING filters on exact aggregate values"}
+        if query.offset or (query.limit and not query.limit.isdigit()):
+            return {"eligible": False, "reason": "Only a plain LIMIT n can be applied to sampled groups"}
+
+        aggregates = {}
+        for index, item in enumerate(query.select_items):
+            call = item.aggregate
+            if not call:
+                if not query.group_by:
+                    return {"eligible": False, "reason": f"'{item.expr}' is neither aggregated nor grouped"}
+                continue
+            function, args = call
+            argument = tokens_to_sql(args)
+            if function not in ESTIMABLE_AGGREGATES:
+                return {"eligible": False, "reason": f"{function} cannot be estimated from a sample"}
+            if argument.upper().startswith('DISTINCT'):
+                return {"eligible": False, "reason": "DISTINCT aggregates cannot be estimated from a sample"}
+            aggregates[index] = {"function": function, "argument": argument}
+
+        if not aggregates:
+            return {"eligible": False, "reason": "No COUNT/SUM/AVG aggregates to estimate"}
+
+        table = query.tables[0]
+        row_count = self._row_count(table.name, schema)
+        if row_count is not None and row_count < self.min_rows:
+            return {
+                "eligible": False,
+                "reason": f"{table.name} has {row_count} rows, below the sampling threshold of {self.min_rows}"
+            }
+
+        # Drivers name an unaliased aggregate differently (count, COUNT(*) or nothing at all): the
+        # estimates and the exact result both run with each one aliased to its own text instead
+        unnamed = [query.select_items[index] for index in aggregates if not query.select_items[index].alias]
+        for item in unnamed:
+            item.alias = item.expr
+
+        return {
+            "eligible": True,
+            "sql": query.to_sql() if unnamed else sql,
+            "table": table.name,
+            "row_count": row_count,
+            "aggregates": aggregates
+        }
+
+    def build_sample_sql(self, plan: Dict[str, Any], percent: float) -> str:
+        """Rewrite the planned query to read only `percent` percent of the table"""
+        query = parse_select(plan["sql"])
+        table = query.tables[0]
+        alias = table.alias or table.name
+
+        if self.db_type == "postgresql":
+            table.source = f"{table.name} AS {alias} TABLESAMPLE BERNOULLI ({percent})"
+            table.alias = None
+        elif self.db_type == "sqlserver":
+            threshold = int(percent * 10000)
+            table.source = f"(SELECT * FROM {table.name} WHERE ABS(CHECKSUM(NEWID())) % 1000000 < {threshold})"
+            table.alias = alias
+        elif self.db_type == "mysql":
+            table.source = f"(SELECT * FROM {table.name} WHERE RAND() < {percent / 100})"
+            table.alias = alias
+        elif self.db_type == "sqlite":
+            threshold = int(percent * 10000)
+            table.source = f"(SELECT * FROM {table.name} WHERE ABS(RANDOM()) % 1000000 < {threshold})"
+            table.alias = alias
+        else:
+            raise NotImplementedError(f"Sampling not implemented for {self.db_type}")
+
+        # The row limit is written in the dialect's syntax (TOP on SQL Server) once the query is built
+        limit, query.limit = query.limit, None
+
+        # Keep the original select list (ORDER BY may refer to it) and
+        # append the helper sums needed for the estimates and their variance
+        for index, aggregate in plan["aggregates"].items():
+            argument = aggregate["argument"]
+            query.select_items.append(SelectItem.from_sql(f"COUNT({argument}) AS _approx_{index}_n"))
+            if aggregate["function"] != "COUNT":
+                query.select_items.append(SelectItem.from_sql(f"SUM(1.0 * ({argument})) AS _approx_{index}_sum"))
+                query.select_items.append(
+                    SelectItem.from_sql(f"SUM(1.0 * ({argument}) * ({argument})) AS _approx_{index}_sq"))
+
+        sample_sql = query.to_sql()
+        return parse_sql(sample_sql).with_limit(int(limit), self.db_type) if limit else sample_sql
+
+    async def estimate(self, plan: Dict[str, Any], percent: float, confidence: float = 0.95,
+                       limit: Optional[int] = None) -> Dict[str, Any]:
+        """Run the sampled query once and turn the helper sums into estimates with bounds"""
+        sample_sql = self.build_sample_sql(plan, percent)
+        start = time.time()
+        rows = await self.execute(sample_sql, limit)
+        elapsed = time.time() - start
+
+        fraction = percent / 100
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        query = parse_select(plan["sql"])
+
+        results, bounds = [], []
+        for row in rows:
+            row = dict(row)
+            row_bounds = {}
+            for index, aggregate in plan["aggregates"].items():
+                name = query.select_items[index].alias
+                value, low, high = self._estimate_value(aggregate["function"], row, index, fraction, z)
+                row[name] = value
+                row_bounds[name] = {"low": low, "high": high}
+            for key in [k for k in row if k.startswith('_approx_')]:
+                del row[key]
+            results.append(row)
+            bounds.append(row_bounds)
+
+        logger.info(f"Approximate query over {percent}% of {plan['table']} took {elapsed:.3f}s")
+        return {
+            "sample_percent": percent,
+            "confidence": confidence,
+            "sql": sample_sql,
+            "results": results,
+            "bounds": bounds,
+            "execution_time": elapsed
+        }
+
+    async def progressive(self, sql: str, schema: Optional[List[Dict[str, Any]]] = None,
+                          sample_percents: Optional[List[float]] = None, refine: bool = True,
+                          confidence: float = 0.95, limit: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield a first estimate, then estimates over larger samples and finally
+        the exact result. The consumer stops the sequence simply by no longer
+        iterating (e.g. when the HTTP client disconnects).
+        """
+        plan = self.plan(sql, schema)
+        if plan["eligible"]:
+            percents = sorted(sample_percents or DEFAULT_SAMPLE_PERCENTS)
+            if not refine:
+                percents = percents[:1]
+            for percent in percents:
+                estimate = await self.estimate(plan, percent, confidence, limit)
+                estimate["stage"] = "estimate"
+                yield estimate
+            if not refine:
+                return
+        else:
+            logger.info(f"Query not eligible for sampling: {plan['reason']}")
+
+        if plan["eligible"]:
+            sql = plan["sql"]
+        start = time.time()
+        rows = await self.execute(sql, limit)
+        yield {
+            "stage": "exact",
+            "sample_percent": 100.0,
+            "sql": sql,
+            "results": rows,
+            "bounds": None,
+            "execution_time": time.time() - start,
+            "reason": None if plan["eligible"] else plan["reason"]
+        }
+
+    def _estimate_value(self, function: str, row: Dict[str, Any], index: int, fraction: float, z: float):
+        """Horvitz-Thompson estimate for COUNT/SUM and sample mean for AVG, with z-bounds"""
+        n = float(row.get(f"_approx_{index}_n") or 0)
+        if function == "COUNT":
+            value = n / fraction
+            stderr = math.sqrt((1 - fraction) * n) / fraction
+            return round(value), max(0, math.floor(value - z * stderr)), math.ceil(value + z * stderr)
+
+        total = float(row.get(f"_approx_{index}_sum") or 0)
+        squares = float(row.get(f"_approx_{index}_sq") or 0)
+        if function == "SUM":
+            value = total / fraction
+            stderr = math.sqrt((1 - fraction) * squares) / fraction
+            return value, value - z * stderr, value + z * stderr
+
+        # AVG
+        if n == 0:
+            return None, None, None
+        mean = total / n
+        variance = max(squares / n - mean * mean, 0.0)
+        if n < 2:
+            return mean, None, None
+        stderr = math.sqrt(variance / n * (1 - fraction))
+        return mean, mean - z * stderr, mean + z * stderr
+
+    def _row_count(self, table_name: str, schema: Optional[List[Dict[str, Any]]]) -> Optional[int]:
+        for table in schema or []:
+            if not isinstance(table, dict):
+                continue
+            name = table.get('name') or table.get('table_name')
+            if name and name.lower() == table_name.lower():
+                return table.get('rowCount', table.get('row_count'))
+        return None
@@ -0,0 +1,332 @@
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Callable, Awaitable
+
+from sqlparse import tokens as T
+
+from utils.sql_ast import tokenize, is_identifier, unquote
+from utils.sql_ir import parse_sql
+
+logger = logging.getLogger(__name__)
+
+RANGE_OPERATORS = ['<', '>', '<=', '>=']
+EQUALITY_OPERATORS = ['=', 'IN']
+
+# Index keys: equality columns first, then at most one range column
+MAX_INDEX_COLUMNS = 3
+
+
+class IndexAdvisor:
+    """
+    Collects execution plans of generated queries and suggests indexes for
+    large tables that are read with sequential scans while being filtered by
+    selective predicates or joined on a key.
+
+    Each executed query is recorded under its fingerprint (the query shape with
+    literals removed) so suggestions can name the shapes that would benefit and
+    the execution time they have accumulated.
+    """
+
+    def __init__(self, min_rows: Optional[int] = None, max_queries: int = 500):
+        self.min_rows = min_rows if min_rows is not None else int(os.getenv("INDEX_ADVISOR_MIN_ROWS", "10000"))
+        self.max_queries = max_queries
+        self.queries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    async def observe(self, sql: str, execution_time: float, db_type: str,
+                      fetch: Callable[..., Awaitable[List[Dict[str, Any]]]],
+                      schema: Optional[List[Dict[str, Any]]] = None) -> None:
+        """Capture the plan of an executed query and record the index candidates it reveals"""
+        parsed = parse_sql(sql)
+        query = parsed.select
+        if query is None or not query.tables:
+            return
+
+        fingerprint = parsed.fingerprint
+        entry = self.queries.get(fingerprint)
+        if entry is None:
+            aliases = {t.reference.lower(): t.name for t in self._base_tables(query)}
+            plan = await self._capture_plan(sql, db_type, fetch)
+            scanned = self._scanned_tables(plan, db_type, aliases)
+            entry = {
+                "fingerprint": fingerprint,
+                "sql": sql.strip(),
+                "count": 0,
+                "total_time": 0.0,
+                "scanned_tables": sorted(scanned) if scanned is not None else None,
+                "candidates": self._candidates(query, scanned, schema)
+            }
+            self.queries[fingerprint] = entry
+            if len(self.queries) > self.max_queries:
+                self.queries.popitem(last=False)
+        else:
+            self.queries.move_to_end(fingerprint)
+
+        entry["count"] += 1
+        entry["total_time"] += execution_time or 0.0
+
+    def suggest(self, schema: Optional[List[Dict[str, Any]]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Ranked index suggestions grouped by table"""
+        row_counts = self._row_counts(schema)
+        suggestions: Dict[tuple, Dict[str, Any]] = {}
+
+        for entry in self.queries.values():
+            for candidate in entry["candidates"]:
+                table = candidate["table"]
+                rows = row_counts.get(table.lower())
+                if rows is not None and rows < self.min_rows:
+                    continue
+
+                key = (table, tuple(candidate["columns"]))
+                suggestion = suggestions.setdefault(key, {
+                    "table": table,
+                    "columns": candidate["columns"],
+                    "ddl": self._ddl(table, candidate["columns"]),
+                    "reasons": [],
+                    "row_count": rows,
+                    "fingerprints": [],
+                    "occurrences": 0,
+                    "total_time": 0.0
+                })
+                if candidate["reason"] not in suggestion["reasons"]:
+                    suggestion["reasons"].append(candidate["reason"])
+                suggestion["fingerprints"].append({
+                    "fingerprint": entry["fingerprint"],
+                    "sql": entry["sql"],
+                    "count": entry["count"],
+                    "total_time": entry["total_time"]
+                })
+                suggestion["occurrences"] += entry["count"]
+                suggestion["total_time"] += entry["total_time"]
+
+        by_table: Dict[str, List[Dict[str, Any]]] = {}
+        ranked = sorted(suggestions.values(), key=lambda s: (s["total_time"], s["occurrences"]), reverse=True)
+        for suggestion in ranked:
+            by_table.setdefault(suggestion["table"], []).append(suggestion)
+        return by_table
+
+    async def what_if(self, suggestions: Dict[str, List[Dict[str, Any]]],
+                      fetch: Callable[..., Awaitable[List[Dict[str, Any]]]]) -> bool:
+        """
+        PostgreSQL only: estimate each suggestion with hypothetical indexes
+        (hypopg extension). Adds a "what_if" entry with plan costs before and
+        after. Returns False when hypopg is not installed.
+        """
+        installed = await fetch("SELECT 1 AS installed FROM pg_extension WHERE extname = 'hypopg'")
+        if not installed:
+            return False
+
+        for table_suggestions in suggestions.values():
+            for suggestion in table_suggestions:
+                sql = suggestion["fingerprints"][0]["sql"].rstrip(';')
+                try:
+                    before = await self._plan_cost(sql, fetch)
+                    columns = ', '.join(suggestion["columns"])
+                    await fetch(f"SELECT * FROM hypopg_create_index('CREATE INDEX ON {suggestion['table']} ({columns})')")
+                    after = await self._plan_cost(sql, fetch)
+                    suggestion["what_if"] = {
+                        "cost_before": before,
+                        "cost_after": after,
+                        "improvement": round(1 - after / before, 4) if before else None
+                    }
+                except Exception as e:
+                    logger.warning(f"What-if check failed for {suggestion['ddl']}: {str(e)}")
+                finally:
+                    await fetch("SELECT hypopg_reset()")
+        return True
+
+    async def _plan_cost(self, sql: str, fetch) -> Optional[float]:
+        rows = await fetch(f"EXPLAIN (FORMAT JSON) {sql}")
+        plan = self._load_json(rows)
+        if isinstance(plan, list) and plan:
+            return plan[0]["Plan"]["Total Cost"]
+        return None
+
+    async def _capture_plan(self, sql: str, db_type: str, fetch) -> Optional[Any]:
+        """Run the dialect's EXPLAIN (without executing the query)"""
+        sql = sql.strip().rstrip(';')
+        try:
+            if db_type == "postgresql":
+                return self._load_json(await fetch(f"EXPLAIN (FORMAT JSON) {sql}"))
+            elif db_type == "mysql":
+                return self._load_json(await fetch(f"EXPLAIN FORMAT=JSON {sql}"))
+            elif db_type == "sqlite":
+                return await fetch(f"EXPLAIN QUERY PLAN {sql}")
+        except Exception as e:
+            logger.warning(f"Could not capture plan: {str(e)}")
+        return None
+
+    def _scanned_tables(self, plan: Any, db_type: str, aliases: Dict[str, str]) -> Optional[set]:
+        """Tables read with a full scan, or None when the plan gives no answer"""
+        if plan is None:
+            return None
+
+        scanned = set()
+        if db_type == "postgresql":
+            def walk(node):
+                if node.get("Node Type") == "Seq Scan" and node.get("Relation Name"):
+                    scanned.add(node["Relation Name"])
+                for child in node.get("Plans", []):
+                    walk(child)
+            for item in plan if isinstance(plan, list) else [plan]:
+                walk(item.get("Plan", {}))
+
+        elif db_type == "mysql":
+            def walk(node):
+                if isinstance(node, dict):
+                    if node.get("access_type") == "ALL" and node.get("table_name"):
+                        name = node["table_name"]
+                        scanned.add(aliases.get(name.lower(), name))
+                    for value in node.values():
+                        walk(value)
+                elif isinstance(node, list):
+                    for value in node:
+                        walk(value)
+            walk(plan)
+
+        elif db_type == "sqlite":
+            for row in plan:
+                match = re.match(r'SCAN (?:TABLE )?(\S+)', row.get("detail", ""))
+                if match:
+                    name = match.group(1)
+                    scanned.add(aliases.get(name.lower(), name))
+
+        return scanned
+
+    def _candidates(self, query, scanned: Optional[set], schema) -> List[Dict[str, Any]]:
+        """Index candidates on scanned tables from WHERE predicates and join conditions"""
+        tables = self._base_tables(query)
+        aliases = {t.reference.lower(): t.name for t in tables}
+        columns_by_table = self._columns(schema)
+
+        def resolve(qualifier, column):
+            if qualifier:
+                table = aliases.get(qualifier.lower())
+                return (table, column) if table else None
+            owners = [t.name for t in tables if column.lower() in columns_by_table.get(t.name.lower(), set())]
+            if len(owners) == 1:
+                return owners[0], column
+            if not owners and len(tables) == 1:
+                return tables[0].name, column
+            return None
+
+        equality, ranges, joins = {}, {}, {}
+        conditions = [query.where] + [t.condition for t in query.tables if t.condition]
+        for condition in conditions:
+            if not condition:
+                continue
+            for kind, left, right in self._predicates(condition):
+                target = resolve(*left)
+                if not target:
+                    continue
+                if kind == "join":
+                    other = resolve(*right)
+                    joins.setdefault(target[0], []).append(target[1])
+                    if other:
+                        joins.setdefault(other[0], []).append(other[1])
+                elif kind == "equality":
+                    equality.setdefault(target[0], []).append(target[1])
+                else:
+                    ranges.setdefault(target[0], []).append(target[1])
+
+        candidates = []
+        for table in sorted({t.name for t in tables}):
+            if scanned is not None and table not in scanned:
+                continue
+            keys = self._unique(equality.get(table, [])) + self._unique(ranges.get(table, []))[:1]
+            if keys:
+                candidates.append({"table": table, "columns": keys[:MAX_INDEX_COLUMNS], "reason": "selective filter"})
+            for column in self._unique(joins.get(table, [])):
+                candidates.append({"table": table, "columns": [column], "reason": "join key"})
+        return candidates
+
+    def _predicates(self, condition: str) -> List[tuple]:
+        """Find `col op literal` and `col = col` comparisons in a condition"""
+        atoms = []
+        tokens = [t for t in tokenize(condition) if not t.is_whitespace]
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            if is_identifier(token) or token.ttype in T.Name.Builtin:
+                if (index + 2 < len(tokens) and tokens[index + 1].match(T.Punctuation, '.')
+                        and is_identifier(tokens[index + 2])):
+                    atoms.append(("column", (unquote(token.value), unquote(tokens[index + 2].value))))
+                    index += 3
+                    continue
+                atoms.append(("column", (None, unquote(token.value))))
+            elif token.ttype in T.Literal or token.ttype in T.Name.Placeholder:
+                atoms.append(("literal", token.value))
+            elif token.ttype in T.Operator.Comparison:
+                atoms.append(("operator", token.value.upper()))
+            elif token.is_keyword:
+                atoms.append(("operator", token.normalized))
+            else:
+                atoms.append(("other", token.value))
+            index += 1
+
+        predicates = []
+        for i in range(len(atoms) - 2):
+            left, op, right = atoms[i], atoms[i + 1], atoms[i + 2]
+            if op[0] != "operator":
+                continue
+            operator = op[1]
+            if left[0] == "literal" and right[0] == "column":
+                left, right = right, left
+                operator = {'<': '>', '>': '<', '<=': '>=', '>=': '<='}.get(operator, operator)
+            if left[0] != "column":
+                continue
+
+            if right[0] == "column" and operator == '=' and left[1][0] != right[1][0]:
+                predicates.append(("join", left[1], right[1]))
+            elif operator in EQUALITY_OPERATORS and (right[0] == "literal" or operator == 'IN'):
+                predicates.append(("equality", left[1], None))
+            elif operator in RANGE_OPERATORS and right[0] == "literal":
+                predicates.append(("range", left[1], None))
+            elif operator == 'BETWEEN':
+                predicates.append(("range", left[1], None))
+            elif operator == 'LIKE' and right[0] == "literal" and not right[1].startswith("'%"):
+                predicates.append(("range", left[1], None))
+        return predicates
+
+    def _base_tables(self, query) -> list:
+        return [t for t in query.tables if t.name]
+
+    def _unique(self, columns: List[str]) -> List[str]:
+        seen, result = set(), []
+        for column in columns:
+            if column.lower() not in seen:
+                seen.add(column.lower())
+                result.append(column)
+        return result
+
+    def _ddl(self, table: str, columns: List[str]) -> str:
+        name = f"idx_{table}_{'_'.join(columns)}".lower()
+        return f"CREATE INDEX {name} ON {table} ({', '.join(columns)});"
+
+    def _load_json(self, rows: List[Dict[str, Any]]) -> Optional[Any]:
+        """EXPLAIN ... JSON comes back as a single row holding the document"""
+        if not rows:
+            return None
+        value = next(iter(rows[0].values()))
+        return json.loads(value) if isinstance(value, str) else value
+
+    def _columns(self, schema) -> Dict[str, set]:
+        columns = {}
+        for table in schema or []:
+            if isinstance(table, dict):
+                name = table.get('name') or table.get('table_name', '')
+                columns[name.lower()] = {
+                    (c.get('name') or c.get('column_name', '')).lower()
+                    for c in table.get('columns', []) if isinstance(c, dict)
+                }
+        return columns
+
+    def _row_counts(self, schema) -> Dict[str, Optional[int]]:
+        counts = {}
+        for table in schema or []:
+            if isinstance(table, dict):
+                name = table.get('name') or table.get('table_name', '')
+                counts[name.lower()] = table.get('rowCount', table.get('row_count'))
+        return counts
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# JSON file of extra vocabulary, same layout as DEFAULT_LEXICON; its terms are added to the defaults
+INTENT_LEXICON_PATH = os.getenv("INTENT_LEXICON_PATH", "")
+
+# Where a category maps values to terms, the first value found in this order wins
+# (a question with both "total" and "count" aggregates with SUM)
+DEFAULT_LEXICON: Dict[str, Any] = {
+    "aggregation": {
+        "SUM": ["sum", "total"],
+        "AVG": ["average", "avg", "mean"],
+        "COUNT": ["count", "how many", "number of"],
+        "MAX": ["maximum", "max"],
+        "MIN": ["minimum", "min"],
+    },
+    "sort_order": {
+        "DESC": ["top", "best", "highest"],
+        "ASC": ["worst", "lowest"],
+    },
+    "filtering": ["where", "with", "having", "greater", "less", "than", "above", "below", "between"],
+    "grouping": ["group", "by", "each", "per", "category"],
+    "sorting": ["order", "sort", "limit"],
+    "joining": ["with", "and", "together", "join", "combined"],
+    # A question using a domain's terms targets the tables named after its table terms,
+    # and the numeric column named after its column terms
+    "domains": {
+        "salary": {
+            "terms": ["salary", "wage", "income", "pay"],
+            "tables": ["user", "employee", "staff"],
+            "columns": ["salary", "wage", "income"],
+        },
+    },
+}
+
+# Underscores included: a question can name a table or column outright
+WORD = re.compile(r'[a-z0-9_]+')
+
+
+def words(text: str) -> List[str]:
+    return WORD.findall(text.lower())
+
+
+def singular(word: str) -> str:
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def load_lexicon(path: str = INTENT_LEXICON_PATH) -> Dict[str, Any]:
+    """DEFAULT_LEXICON with the terms of the JSON file at path added; the defaults alone if it cannot be read"""
+    lexicon = json.loads(json.dumps(DEFAULT_LEXICON))
+    if not path:
+        return lexicon
+    try:
+        with open(path, encoding="utf-8") as f:
+            custom = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Could not load intent lexicon {path}: {str(e)}")
+        return lexicon
+
+    for category, entries in custom.items():
+        if isinstance(entries, list):
+            lexicon.setdefault(category, []).extend(entries)
+        elif category == "domains":
+            for name, domain in entries.items():
+                merged = lexicon["domains"].setdefault(name, {"terms": [], "tables": [], "columns": []})
+                for part in ("terms", "tables", "columns"):
+                    merged[part].extend(domain.get(part, []))
+        else:
+            for value, terms in entries.items():
+                lexicon.setdefault(category, {}).setdefault(value, []).extend(terms)
+    logger.info(f"✅ Intent lexicon extended from {path}")
+    return lexicon
+
+
+class IntentLexicon:
+    """
+    The lexicon compiled into one hash table of word sequences, so a question is
+    scanned in a single pass: every run of up to `longest` words is one dict
+    lookup, whatever the size of the vocabulary. Terms match whole words; a
+    plural matches its singular term.
+    """
+
+    def __init__(self, lexicon: Optional[Dict[str, Any]] = None):
+        self.lexicon = lexicon or load_lexicon()
+        self.phrases: Dict[Tuple[str, ...], List[Tuple[str, Optional[str]]]] = {}
+        for category, entries in self.lexicon.items():
+            if isinstance(entries, list):
+                for term in entries:
+                    self._add(term, category, None)
+            elif category == "domains":
+                for name, domain in entries.items():
+                    for term in domain.get("terms", []):
+                        self._add(term, "domains", name)
+            else:
+                for value, terms in entries.items():
+                    for term in terms:
+                        self._add(term, category, value)
+        self.longest = max((len(key) for key in self.phrases), default=1)
+
+    def scan(self, question: str) -> Dict[str, Set[Optional[str]]]:
+        """Categories the question uses, each with the values its terms map to (None for plain flags)"""
+        tokens = words(question)
+        found: Dict[str, Set[Optional[str]]] = {}
+        for start in range(len(tokens)):
+            for length in range(1, min(self.longest, len(tokens) - start) + 1):
+                hits = self.phrases.get(tuple(tokens[start:start + length]))
+                if hits is None and length == 1:
+                    hits = self.phrases.get((singular(tokens[start]),))
+                for category, value in hits or ():
+                    found.setdefault(category, set()).add(value)
+        return found
+
+    def first(self, found: Dict[str, Set[Optional[str]]], category: str) -> Optional[str]:
+        """The value of a category found in the question that comes first in the lexicon"""
+        values = found.get(category, ())
+        return next((value for value in self.lexicon.get(category, {}) if value in values), None)
+
+    def _add(self, term: str, category: str, value: Optional[str]) -> None:
+        key = tuple(words(term))
+        if key and (category, value) not in self.phrases.get(key, []):
+            self.phrases.setdefault(key, []).append((category, value))
+
+
+class SchemaIndex:
+    """
+    Inverted index over a schema analysis: each table and column name, and each
+    word in it (with singulars), points at the tables and columns carrying it, so
+    finding what a question mentions costs a lookup per question word instead of
+    a scan of every table. table_columns maps each lower-case table name to the
+    table and its columns by lower-case name, for resolving references in SQL.
+    """
+
+    def __init__(self, analysis: Dict):
+        self.position: Dict[str, int] = {}
+        self.table_names: Dict[str, Set[str]] = {}
+        self.tables: Dict[str, Set[str]] = {}
+        self.columns: Dict[str, Set[Tuple[str, str]]] = {}
+        self.table_columns: Dict[str, Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]] = {}
+        for position, table in enumerate(analysis["tables"]):
+            self.position[table["name"]] = position
+            self.table_columns[table["name"].lower()] = (table, {c["name"].lower(): c for c in table["columns"]})
+            name = table["name"].lower()
+            for key in {name, singular(name)}:
+                self.table_names.setdefault(key, set()).add(table["name"])
+            for key in self._keys(table["name"]):
+                self.tables.setdefault(key, set()).add(table["name"])
+            for column in table["columns"]:
+                for key in self._keys(column["name"]):
+                    self.columns.setdefault(key, set()).add((table["name"], column["name"]))
+
+    def find_tables(self, terms: Iterable[str]) -> List[str]:
+        """Tables named by any of the terms, whole-name matches before those only sharing a word; schema order within each"""
+        named, related = set(), set()
+        for term in terms:
+            for key in {term, singular(term)}:
+                named |= self.table_names.get(key, set())
+                related |= self.tables.get(key, set())
+        order = self.position.__getitem__
+        return sorted(named, key=order) + sorted(related - named, key=order)
+
+    def find_columns(self, terms: Iterable[str]) -> Set[Tuple[str, str]]:
+        """(table, column) pairs named by any of the terms"""
+        found = set()
+        for term in terms:
+            found |= self.columns.get(term, set()) | self.columns.get(singular(term), set())
+        return found
+
+    def _keys(self, name: str) -> Set[str]:
+        parts = re.findall(r'[a-z0-9]+', name.lower())
+        return {name.lower()} | set(parts) | {singular(part) for part in parts}
@@ -0,0 +1,355 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+import httpx
+import ollama
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# Comma-separated list of Ollama servers to balance across; defaults to OLLAMA_HOST alone
+OLLAMA_HOSTS = [h.strip() for h in os.getenv("OLLAMA_HOSTS", OLLAMA_HOST).split(",") if h.strip()]
+# Requests sent to one server at a time; more wait for a free slot
+OLLAMA_ENDPOINT_CONCURRENCY = int(os.getenv("OLLAMA_ENDPOINT_CONCURRENCY", "4"))
+# Consecutive failures that take a server out of rotation, and for how long
+OLLAMA_BREAKER_FAILURES = int(os.getenv("OLLAMA_BREAKER_FAILURES", "3"))
+OLLAMA_BREAKER_COOLDOWN = float(os.getenv("OLLAMA_BREAKER_COOLDOWN", "30"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+# Non-streaming generation waits for the whole completion, so reads get a generous timeout
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "20"))
+# How long Ollama keeps the model (and its prompt cache) loaded after a request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# The warm-up request pins the model for longer, so it is resident before the first question
+OLLAMA_WARMUP_KEEP_ALIVE = os.getenv("OLLAMA_WARMUP_KEEP_ALIVE", "24h")
+OLLAMA_PROBE_INTERVAL = float(os.getenv("OLLAMA_PROBE_INTERVAL", "30"))
+
+_shared_client: Optional["OllamaPool"] = None
+
+
+def create_ollama_client(host: str = None) -> ollama.AsyncClient:
+    """Non-blocking Ollama client; share one instance so all services use the same connection pool"""
+    return ollama.AsyncClient(
+        host=host or OLLAMA_HOST,
+        timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS, max_keepalive_connections=OLLAMA_MAX_CONNECTIONS)
+    )
+
+
+def shared_ollama_client() -> "OllamaPool":
+    """The process-wide pool over OLLAMA_HOSTS, created on first use; creating it opens no connections"""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = OllamaPool(OLLAMA_HOSTS)
+    return _shared_client
+
+
+async def close_ollama_client(client: ollama.AsyncClient) -> None:
+    # ollama.AsyncClient does not expose aclose(); close its httpx pool directly
+    await client._client.aclose()
+
+
+async def close_shared_ollama_client() -> None:
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.aclose()
+        _shared_client = None
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """Whether another server could succeed: everything but a 4xx, which would fail anywhere"""
+    return not (isinstance(error, ollama.ResponseError) and 400 <= error.status_code < 500)
+
+
+def model_names(response) -> List[str]:
+    """Model names from a list() response (a dict in older ollama releases, an object in newer ones)"""
+    models = response.get("models", []) if isinstance(response, dict) else getattr(response, "models", [])
+    return [(m.get("name") or m.get("model")) if isinstance(m, dict) else m.model for m in models]
+
+
+class OllamaProbe:
+    """
+    Background readiness check for one model. Startup does not wait on Ollama:
+    the probe keeps listing models until the server answers, then sends an empty
+    warm-up generation with a long keep_alive so the model is loaded before the
+    first question. It re-checks every interval and warms up again after an outage.
+
+    States: starting, unavailable (Ollama unreachable), model_missing, ready.
+    """
+
+    def __init__(self, client: ollama.AsyncClient, model_name: str,
+                 interval: float = OLLAMA_PROBE_INTERVAL, keep_alive: str = OLLAMA_WARMUP_KEEP_ALIVE):
+        self.client = client
+        self.model_name = model_name
+        self.interval = interval
+        self.keep_alive = keep_alive
+        self.state = "starting"
+        self.last_error = None
+        self.last_check = None
+        self.warmup_ms = None
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def check(self) -> str:
+        """Probe once, warming the model up if it is not known to be loaded"""
+        try:
+            models = model_names(await self.client.list())
+            if self.model_name not in models:
+                if self.state != "model_missing":
+                    logger.warning(f"⚠️ Model {self.model_name} not found. Available: {models}")
+                self.state = "model_missing"
+            elif not self.ready:
+                started = time.perf_counter()
+                # An empty prompt only loads the model
+                await self.client.generate(model=self.model_name, prompt="", keep_alive=self.keep_alive)
+                self.warmup_ms = (time.perf_counter() - started) * 1000
+                self.state = "ready"
+                logger.info(f"🔥 Model {self.model_name} loaded in {self.warmup_ms:.0f}ms")
+            self.last_error = None
+        except Exception as e:
+            if self.state != "unavailable":
+                logger.warning(f"⚠️ Ollama not available: {str(e)}")
+            self.state = "unavailable"
+            self.last_error = str(e)
+        self.last_check = time.time()
+        return self.state
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "state": self.state,
+            "model": self.model_name,
+            "warmup_ms": round(self.warmup_ms, 1) if self.warmup_ms is not None else None,
+            "last_error": self.last_error,
+            "last_check": self.last_check
+        }
+
+    async def _run(self) -> None:
+        delay = 1.0
+        while True:
+            if await self.check() == "ready":
+                delay = 1.0
+                await asyncio.sleep(self.interval)
+            else:
+                # Retry quickly at first so readiness follows Ollama coming up
+                await asyncio.sleep(min(delay, self.interval))
+                delay *= 2
+
+
+class OllamaEndpoint:
+    """One Ollama server in the pool: its client, load and circuit breaker"""
+
+    def __init__(self, host: str, capacity: int, client: Optional[ollama.AsyncClient] = None):
+        self.host = host
+        self.client = client or create_ollama_client(host)
+        self.capacity = capacity
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0  # consecutive
+        self.errors = 0
+        self.last_error = None
+        self.opened_at = None  # breaker open since
+        self.trial = False  # a half-open trial request is in flight
+        self.probe: Optional[OllamaProbe] = None
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / self.capacity
+
+    def available(self, now: float, cooldown: float) -> bool:
+        if self.probe is not None and self.probe.state == "unavailable":
+            return False
+        if self.opened_at is None:
+            return True
+        # Half-open: after the cooldown, let a single request through to test the server
+        return now - self.opened_at >= cooldown and not self.trial
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"✅ Ollama endpoint {self.host} recovered")
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self, error: Exception, threshold: int) -> None:
+        self.failures += 1
+        self.errors += 1
+        self.last_error = str(error)
+        if self.trial or self.failures >= threshold:
+            if self.opened_at is None or self.trial:
+                logger.warning(f"🔌 Ollama endpoint {self.host} taken out of rotation: {str(error)}")
+            self.opened_at = time.time()
+        self.trial = False
+
+    def status(self, now: float, cooldown: float) -> Dict[str, Any]:
+        return {
+            "host": self.host,
+            "available": self.available(now, cooldown),
+            "circuit": "closed" if self.opened_at is None else "open",
+            "in_flight": self.in_flight,
+            "capacity": self.capacity,
+            "requests": self.requests,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "model": self.probe.status() if self.probe else None
+        }
+
+
+class OllamaPool:
+    """
+    Drop-in for ollama.AsyncClient (generate, list, embeddings) spread over several
+    Ollama servers. Each request goes to the less loaded of two random available
+    servers (power of two choices). A server takes at most `capacity` requests at
+    once, and requests wait for a free slot when every server is full.
+
+    Every server has a circuit breaker: `failure_threshold` consecutive failures
+    take it out of rotation for `cooldown` seconds, then a single trial request
+    decides whether it comes back. A request that fails on one server is retried
+    on the others, and so is a stream that fails before its first chunk. Once a
+    stream has produced output, a failure is raised to the caller.
+    """
+
+    def __init__(self, hosts: List[str], capacity: int = OLLAMA_ENDPOINT_CONCURRENCY,
+                 failure_threshold: int = OLLAMA_BREAKER_FAILURES, cooldown: float = OLLAMA_BREAKER_COOLDOWN,
+                 client_factory=create_ollama_client):
+        if not hosts:
+            raise ValueError("At least one Ollama host is required")
+        self.endpoints = [OllamaEndpoint(host, capacity, client_factory(host)) for host in hosts]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failovers = 0
+        self._slots = asyncio.Condition()
+
+    async def generate(self, **kwargs):
+        if kwargs.get("stream"):
+            return self._stream("generate", kwargs)
+        return await self._call("generate", kwargs)
+
+    async def list(self):
+        return await self._call("list", {})
+
+    async def embeddings(self, **kwargs):
+        return await self._call("embeddings", kwargs)
+
+    def start(self, model_name: str, interval: float = OLLAMA_PROBE_INTERVAL) -> None:
+        """Probe and warm up model_name on every server in the background"""
+        for endpoint in self.endpoints:
+            if endpoint.probe is None:
+                endpoint.probe = OllamaProbe(endpoint.client, model_name, interval=interval)
+                endpoint.probe.start()
+
+    @property
+    def ready(self) -> bool:
+        return any(e.probe is not None and e.probe.ready for e in self.endpoints)
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "ready": self.ready,
+            "failovers": self.failovers,
+            "endpoints": [e.status(now, self.cooldown) for e in self.endpoints]
+        }
+
+    async def aclose(self) -> None:
+        for endpoint in self.endpoints:
+            if endpoint.probe is not None:
+                await endpoint.probe.stop()
+            await close_ollama_client(endpoint.client)
+
+    async def _call(self, method: str, kwargs: Dict[str, Any]):
+        tried: Set[OllamaEndpoint] = set()
+        while True:
+            endpoint = await self._acquire(tried)
+            try:
+                result = await getattr(endpoint.client, method)(**kwargs)
+                endpoint.record_success()
+                return result
+            except Exception as e:
+                if not self._failed(endpoint, e, tried):
+                    raise
+            finally:
+                await self._release(endpoint)
+
+    async def _stream(self, method: str, kwargs: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        tried: Set[OllamaEndpoint] = set()
+        while True:
+            endpoint = await self._acquire(tried)
+            started = False
+            try:
+                stream = await getattr(endpoint.client, method)(**kwargs)
+                try:
+                    async for chunk in stream:
+                        if not started:
+                            started = True
+                            endpoint.record_success()
+                        yield chunk
+                finally:
+                    await stream.aclose()
+                if not started:
+                    endpoint.record_success()
+                return
+            except Exception as e:
+                # Part of the answer has gone out: retrying elsewhere would repeat it
+                if started or not self._failed(endpoint, e, tried):
+                    raise
+            finally:
+                await self._release(endpoint)
+
+    def _failed(self, endpoint: OllamaEndpoint, error: Exception, tried: Set[OllamaEndpoint]) -> bool:
+        """Record a failure; True when the request should be retried on another server"""
+        if not is_endpoint_failure(error):
+            return False
+        endpoint.record_failure(error, self.failure_threshold)
+        now = time.time()
+        if any(e not in tried and e.available(now, self.cooldown) for e in self.endpoints):
+            self.failovers += 1
+            logger.warning(f"↪️ Ollama request failed on {endpoint.host}, trying another server: {str(error)}")
+            return True
+        return False
+
+    async def _acquire(self, tried: Set[OllamaEndpoint]) -> OllamaEndpoint:
+        async with self._slots:
+            while True:
+                now = time.time()
+                candidates = [e for e in self.endpoints if e not in tried and e.available(now, self.cooldown)]
+                if not candidates:
+                    raise ConnectionError(f"No Ollama server available ({len(self.endpoints)} configured)")
+                free = [e for e in candidates if e.in_flight < e.capacity]
+                if free:
+                    endpoint = min(random.sample(free, min(2, len(free))), key=lambda e: (e.load, e.failures))
+                    break
+                await self._slots.wait()
+
+            if endpoint.opened_at is not None:
+                endpoint.trial = True
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            tried.add(endpoint)
+            return endpoint
+
+    async def _release(self, endpoint: OllamaEndpoint) -> None:
+        async with self._slots:
+            endpoint.in_flight -= 1
+            # A cancelled trial must not leave the server half-open forever
+            endpoint.trial = False
+            self._slots.notify_all()
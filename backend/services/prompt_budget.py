@@ -0,0 +1,120 @@
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Context window requested from Ollama; prompt and output must both fit in it
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+# Head-room for the estimator undercounting and for the model's prompt template
+PROMPT_SAFETY_MARGIN = int(os.getenv("PROMPT_SAFETY_MARGIN", "128"))
+
+TYPE_ABBREVIATIONS = [
+    (r'^character varying', 'varchar'),
+    (r'^timestamp with time zone', 'timestamptz'),
+    (r'^timestamp without time zone', 'timestamp'),
+    (r'^time without time zone', 'time'),
+    (r'^double precision', 'double'),
+    (r'^integer', 'int'),
+    (r'^(numeric|decimal)', 'dec'),
+    (r'^boolean', 'bool'),
+    (r'^character', 'char'),
+]
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast stand-in for the model tokenizer: a token per ~4 characters of a word, one per symbol"""
+    return sum((len(piece) + 3) // 4 for piece in re.findall(r'\w+|[^\w\s]', text)) + text.count('\n')
+
+
+def compact_type(data_type: str) -> str:
+    data_type = (data_type or '').lower()
+    for pattern, abbreviation in TYPE_ABBREVIATIONS:
+        if re.match(pattern, data_type):
+            return re.sub(pattern, abbreviation, data_type)
+    return data_type
+
+
+def table_line(table_info: Dict[str, Any], columns: Optional[List[Dict[str, Any]]] = None) -> str:
+    """One line per table: name(col type PK, col type, ...), with ... when columns were dropped"""
+    shown = table_info["columns"] if columns is None else columns
+    parts = [f"{c['name']} {compact_type(c['type'])}{' PK' if c['is_primary'] else ''}" for c in shown]
+    if len(shown) < len(table_info["columns"]):
+        parts.append("...")
+    return f"{table_info['name']}({', '.join(parts)})"
+
+
+class PromptBudget:
+    """
+    Keeps prompts inside num_ctx: output gets num_predict tokens, and the schema
+    gets whatever the rest of the prompt leaves. A schema that does not fit is
+    trimmed to the tables and columns most relevant to the question.
+    """
+
+    def __init__(self, num_predict: int, num_ctx: int = OLLAMA_NUM_CTX, margin: int = PROMPT_SAFETY_MARGIN):
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.margin = margin
+
+    def remaining(self, *parts: str) -> int:
+        """Tokens left for the schema once the other prompt parts and the output are accounted for"""
+        return self.num_ctx - self.num_predict - self.margin - sum(estimate_tokens(p) for p in parts)
+
+    def fit_schema(self, tables: List[Dict[str, Any]], question: str, target_tables: List[str],
+                   budget: int) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        (kept tables, their lines), most relevant first for trimming but returned in
+        name order so an untrimmed schema always renders identically
+        """
+        lines = {t["name"]: table_line(t) for t in tables}
+        if sum(self._line_cost(line) for line in lines.values()) <= budget:
+            ordered = sorted(tables, key=lambda t: t["name"])
+            return ordered, [lines[t["name"]] for t in ordered]
+
+        words = self._words(question)
+        scored = sorted(tables, key=lambda t: (-self._relevance(t, words, target_tables), t["name"]))
+
+        kept, used = {}, 0
+        for table in scored:
+            line = lines[table["name"]]
+            cost = self._line_cost(line)
+            if used + cost > budget:
+                # Keys and the columns the question mentions are enough to write a join or filter
+                columns = [c for c in table["columns"]
+                           if c["is_primary"] or c["name"] in table["foreign_keys"] or self._mentions(c["name"], words)]
+                if not columns or self._relevance(table, words, target_tables) == 0:
+                    continue
+                line = table_line(table, columns)
+                cost = self._line_cost(line)
+                if used + cost > budget:
+                    continue
+            kept[table["name"]] = (table, line)
+            used += cost
+
+        dropped = len(tables) - len(kept)
+        logger.info(f"✂️ Schema trimmed to fit {self.num_ctx} context tokens: "
+                    f"{len(kept)} tables kept, {dropped} dropped")
+        ordered = [kept[name] for name in sorted(kept)]
+        return [table for table, _ in ordered], [line for _, line in ordered]
+
+    def _line_cost(self, line: str) -> int:
+        # Each table goes on its own line in the prompt
+        return estimate_tokens(line + "\n")
+
+    def _relevance(self, table: Dict[str, Any], words: set, target_tables: List[str]) -> int:
+        score = 3 if table["name"] in target_tables else 0
+        if self._mentions(table["name"], words):
+            score += 2
+        score += sum(1 for c in table["columns"] if self._mentions(c["name"], words))
+        return score
+
+    def _words(self, text: str) -> set:
+        words = set(re.findall(r'[a-z0-9]+', text.lower()))
+        # "employees" should match an employee table
+        return words | {w[:-1] for w in words if w.endswith('s') and len(w) > 3}
+
+    def _mentions(self, name: str, words: set) -> bool:
+        parts = set(re.findall(r'[a-z0-9]+', name.lower().replace('_', ' ')))
+        parts |= {p[:-1] for p in parts if p.endswith('s') and len(p) > 3}
+        return bool(parts & words - {'id'})
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Next to the backend package rather than wherever the server was started from
+SQL_CACHE_PATH = os.getenv(
+    "SQL_CACHE_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sql_cache.db")
+)
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "1000"))
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", "86400"))
+
+
+def normalize_question(question: str) -> str:
+    """Case, spacing and trailing punctuation do not change what is being asked"""
+    return re.sub(r'\s+', ' ', question.lower()).strip().rstrip('?.!').strip()
+
+
+class QueryCache:
+    """
+    Two-tier cache of JSON-serializable values: an in-memory LRU in front of a
+    SQLite table that survives restarts. Entries expire after ttl seconds and are
+    tagged with the schema fingerprint they were computed against, so everything
+    derived from an old schema can be dropped at once.
+    """
+
+    def __init__(self, path: str = SQL_CACHE_PATH, table: str = "sql_cache",
+                 max_entries: int = SQL_CACHE_SIZE, ttl: float = SQL_CACHE_TTL):
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = None
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                f"key TEXT PRIMARY KEY, fingerprint TEXT, value TEXT, created_at REAL)"
+            )
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_fingerprint ON {table} (fingerprint)")
+            self._db.commit()
+        except sqlite3.Error as e:
+            # The memory tier still works without the disk tier
+            logger.warning(f"⚠️ Persistent cache at {path} unavailable: {str(e)}")
+            self._db = None
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        return hashlib.sha1("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.memory.get(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None or time.time() - entry[2] > self.ttl:
+            if entry is not None:
+                self.delete(key)
+            self.misses += 1
+            return None
+        self.memory.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, value: Any, fingerprint: Optional[str] = None) -> None:
+        entry = (fingerprint, value, time.time())
+        self._remember(key, entry)
+        if self._db is None:
+            return
+        try:
+            with self._lock:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, fingerprint, value, created_at) VALUES (?, ?, ?, ?)",
+                    (key, fingerprint, json.dumps(value, default=str), entry[2])
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache write failed: {str(e)}")
+
+    def delete(self, key: str) -> None:
+        self.memory.pop(key, None)
+        self._execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def invalidate(self, fingerprint: str) -> None:
+        """Drop every entry computed against a schema that has since changed"""
+        for key in [k for k, entry in self.memory.items() if entry[0] == fingerprint]:
+            del self.memory[key]
+        self._execute(f"DELETE FROM {self.table} WHERE fingerprint = ?", (fingerprint,))
+        logger.info(f"🧹 Cleared {self.table} entries for schema {fingerprint}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None
+        }
+
+    def _remember(self, key: str, entry: Tuple) -> None:
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _load(self, key: str) -> Optional[Tuple]:
+        if self._db is None:
+            return None
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    f"SELECT fingerprint, value, created_at FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache read failed: {str(e)}")
+            return None
+        return (row[0], json.loads(row[1]), row[2]) if row else None
+
+    def _execute(self, sql: str, params: Tuple) -> None:
+        if self._db is None:
+            return
+        try:
+            with self._lock:
+                self._db.execute(sql, params)
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache update failed: {str(e)}")
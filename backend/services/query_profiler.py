@@ -0,0 +1,258 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from typing import Optional, List, Dict, Any
+
+import aiomysql
+
+from database.read_only import read_only_transaction
+
+logger = logging.getLogger(__name__)
+
+# A timed run counts its rows in chunks of this size instead of holding the whole result
+PROFILE_FETCH_SIZE = 1000
+
+# MySQL EXPLAIN ANALYZE line: "-> Table scan on t  (cost=1.25 rows=10) (actual time=0.03..0.04 rows=10 loops=1)"
+MYSQL_PLAN_LINE = re.compile(
+    r'^(?P<indent>\s*)-> (?P<operation>.*?)'
+    r'(?:\s+\(cost=(?P<cost>[\d.e+]+) rows=(?P<estimated_rows>[\d.e+]+)\))?'
+    r'(?:\s+\(actual time=(?P<first>[\d.]+)\.\.(?P<last>[\d.]+) rows=(?P<rows>[\d.e+]+) loops=(?P<loops>\d+)\)'
+    r'|\s+\((?P<never>never executed)\))?\s*$'
+)
+
+
+def plan_node(operation: str, **fields) -> Dict[str, Any]:
+    """Dialect-independent plan node; fields a dialect cannot report stay None"""
+    node = {
+        "operation": operation,
+        "relation": None,
+        "detail": None,
+        "estimated_rows": None,
+        "rows": None,
+        "loops": None,
+        "time_ms": None,
+        "self_time_ms": None,
+        "cost": None,
+        "buffers": None,
+        "children": []
+    }
+    node.update(fields)
+    return node
+
+
+class QueryProfiler:
+    """
+    Run a query under the dialect's analyze mode inside a read-only transaction
+    that is always rolled back, and normalize the plan into a tree of plan_node()s:
+    - PostgreSQL: EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+    - MySQL: EXPLAIN ANALYZE (8.0.18+)
+    - SQLite: EXPLAIN QUERY PLAN, plus a timed run for the total
+    - SQL Server: SET STATISTICS PROFILE ON
+    """
+
+    def __init__(self, connection, db_type: str):
+        self.connection = connection
+        self.db_type = db_type
+
+    async def profile(self, sql: str) -> Dict[str, Any]:
+        sql = sql.strip().rstrip(';')
+        start = time.time()
+
+        if self.db_type == "postgresql":
+            profile = await self._profile_postgresql(sql)
+        elif self.db_type == "mysql":
+            profile = await self._profile_mysql(sql)
+        elif self.db_type == "sqlite":
+            profile = await self._profile_sqlite(sql)
+        elif self.db_type == "sqlserver":
+            profile = await self._profile_sqlserver(sql)
+        else:
+            raise NotImplementedError(f"Profiling not implemented for {self.db_type}")
+
+        profile["dialect"] = self.db_type
+        profile["sql"] = sql
+        profile["total_time_ms"] = (time.time() - start) * 1000
+        self._fill_self_time(profile["plan"])
+        return profile
+
+    async def _profile_postgresql(self, sql: str) -> Dict[str, Any]:
+        async with read_only_transaction(self.connection, "postgresql"):
+            rows = await self.connection.fetch(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")
+
+        document = rows[0][0]
+        if isinstance(document, str):
+            document = json.loads(document)
+        result = document[0]
+        return {
+            "planning_time_ms": result.get("Planning Time"),
+            "execution_time_ms": result.get("Execution Time"),
+            "plan": self._postgresql_node(result["Plan"])
+        }
+
+    def _postgresql_node(self, node: Dict[str, Any]) -> Dict[str, Any]:
+        operation = node["Node Type"]
+        if node.get("Join Type"):
+            operation = f"{node['Join Type']} {operation}"
+
+        details = [f"{key}: {node[key]}" for key in
+                   ("Index Name", "Index Cond", "Hash Cond", "Merge Cond", "Join Filter", "Filter", "Sort Key", "Group Key")
+                   if node.get(key)]
+        loops = node.get("Actual Loops")
+        buffers = {
+            key.lower().replace(" blocks", "").replace(" ", "_"): node[key]
+            for key in ("Shared Hit Blocks", "Shared Read Blocks", "Shared Dirtied Blocks", "Shared Written Blocks",
+                        "Temp Read Blocks", "Temp Written Blocks")
+            if key in node
+        }
+        # Actual times are per loop; report the node's total
+        time_ms = node["Actual Total Time"] * (loops or 1) if "Actual Total Time" in node else None
+
+        return plan_node(
+            operation,
+            relation=node.get("Relation Name"),
+            detail="; ".join(str(d) for d in details) or None,
+            estimated_rows=node.get("Plan Rows"),
+            rows=node["Actual Rows"] * (loops or 1) if "Actual Rows" in node else None,
+            loops=loops,
+            time_ms=time_ms,
+            cost=node.get("Total Cost"),
+            buffers=buffers or None,
+            children=[self._postgresql_node(child) for child in node.get("Plans", [])]
+        )
+
+    async def _profile_mysql(self, sql: str) -> Dict[str, Any]:
+        async with read_only_transaction(self.connection, "mysql"):
+            async with self.connection.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(f"EXPLAIN ANALYZE {sql}")
+                rows = await cursor.fetchall()
+
+        text = next(iter(rows[0].values())) if rows else ""
+        return {
+            "planning_time_ms": None,
+            "execution_time_ms": None,
+            "plan": self._mysql_tree(text)
+        }
+
+    def _mysql_tree(self, text: str) -> Dict[str, Any]:
+        """Rebuild the tree from the indentation of EXPLAIN ANALYZE output"""
+        root = plan_node("Query")
+        stack = [(-1, root)]
+        for line in text.splitlines():
+            match = MYSQL_PLAN_LINE.match(line)
+            if not match:
+                continue
+            loops = int(match.group("loops")) if match.group("loops") else None
+            node = plan_node(
+                match.group("operation").strip(),
+                estimated_rows=float(match.group("estimated_rows")) if match.group("estimated_rows") else None,
+                rows=float(match.group("rows")) * loops if match.group("rows") else None,
+                loops=loops if not match.group("never") else 0,
+                time_ms=float(match.group("last")) * loops if match.group("last") else None,
+                cost=float(match.group("cost")) if match.group("cost") else None
+            )
+            table = re.search(r' on (\w+)', node["operation"])
+            if table:
+                node["relation"] = table.group(1)
+
+            depth = len(match.group("indent"))
+            while stack[-1][0] >= depth:
+                stack.pop()
+            stack[-1][1]["children"].append(node)
+            stack.append((depth, node))
+
+        return root["children"][0] if len(root["children"]) == 1 else root
+
+    async def _profile_sqlite(self, sql: str) -> Dict[str, Any]:
+        cursor = await self.connection.execute(f"EXPLAIN QUERY PLAN {sql}")
+        plan_rows = await cursor.fetchall()
+
+        # SQLite has no per-node timing, so time a real run and roll it back
+        async with read_only_transaction(self.connection, "sqlite"):
+            await self.connection.execute("SAVEPOINT profile")
+            try:
+                run_start = time.time()
+                cursor = await self.connection.execute(sql)
+                row_count = 0
+                while True:
+                    rows = await cursor.fetchmany(PROFILE_FETCH_SIZE)
+                    if not rows:
+                        break
+                    row_count += len(rows)
+                execution_time = (time.time() - run_start) * 1000
+            finally:
+                await self.connection.execute("ROLLBACK TO profile")
+                await self.connection.execute("RELEASE profile")
+
+        root = plan_node("Query", rows=row_count, time_ms=execution_time)
+        nodes = {0: root}
+        for node_id, parent, _, detail in plan_rows:
+            table = re.match(r'(?:SCAN|SEARCH) (?:TABLE )?(\S+)', detail)
+            node = plan_node(detail.split(' ')[0], relation=table.group(1) if table else None, detail=detail)
+            nodes[node_id] = node
+            nodes.get(parent, root)["children"].append(node)
+
+        return {
+            "planning_time_ms": None,
+            "execution_time_ms": execution_time,
+            "plan": root
+        }
+
+    async def _profile_sqlserver(self, sql: str) -> Dict[str, Any]:
+        # pyodbc blocks: the run goes to a worker thread so the event loop keeps serving
+        async with read_only_transaction(self.connection, "sqlserver"):
+            profile_rows, execution_time = await asyncio.to_thread(self._run_sqlserver_profile, sql)
+
+        root = plan_node("Query")
+        nodes = {}
+        for row in profile_rows:
+            node = plan_node(
+                row.get("PhysicalOp") or (row.get("StmtText") or "").strip(),
+                detail=(row.get("Argument") or row.get("StmtText") or "").strip() or None,
+                estimated_rows=row.get("EstimateRows"),
+                rows=row.get("Rows"),
+                loops=row.get("Executes"),
+                cost=row.get("TotalSubtreeCost")
+            )
+            table = re.search(r'OBJECT:\(\[[^\]]+\]\.\[[^\]]+\]\.\[([^\]]+)\]', node["detail"] or "")
+            if table:
+                node["relation"] = table.group(1)
+            nodes[row.get("NodeId")] = node
+            nodes.get(row.get("Parent"), root)["children"].append(node)
+
+        return {
+            "planning_time_ms": None,
+            "execution_time_ms": execution_time,
+            "plan": root["children"][0] if len(root["children"]) == 1 else root
+        }
+
+    def _run_sqlserver_profile(self, sql: str):
+        cursor = self.connection.cursor()
+        profile_rows = []
+        try:
+            cursor.execute("SET STATISTICS PROFILE ON")
+            run_start = time.time()
+            cursor.execute(sql)
+            # The query's own result set comes first, then one profile result set per statement
+            while True:
+                if cursor.description and cursor.description[0][0] == "Rows":
+                    columns = [column[0] for column in cursor.description]
+                    profile_rows.extend(dict(zip(columns, row)) for row in cursor.fetchall())
+                elif cursor.description:
+                    while cursor.fetchmany(PROFILE_FETCH_SIZE):
+                        pass
+                if not cursor.nextset():
+                    break
+            execution_time = (time.time() - run_start) * 1000
+        finally:
+            cursor.execute("SET STATISTICS PROFILE OFF")
+        return profile_rows, execution_time
+
+    def _fill_self_time(self, node: Dict[str, Any]) -> None:
+        """Time spent in a node itself, excluding its children"""
+        for child in node["children"]:
+            self._fill_self_time(child)
+        if node["time_ms"] is not None:
+            child_time = sum(child["time_ms"] or 0 for child in node["children"])
+            node["self_time_ms"] = max(node["time_ms"] - child_time, 0.0)
@@ -0,0 +1,89 @@
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+from utils.sql_ir import parse_sql
+
+logger = logging.getLogger(__name__)
+
+# Shapes tracked (the least recently run is dropped first), and executions kept per shape for percentiles
+QUERY_SHAPES_MAX = int(os.getenv("QUERY_SHAPES_MAX", "1000"))
+QUERY_SHAPE_SAMPLES = int(os.getenv("QUERY_SHAPE_SAMPLES", "200"))
+
+# Columns summary() can sort by
+SHAPE_SORT_KEYS = ("total_ms", "count", "mean_ms", "p95_ms", "max_ms", "errors", "last_run")
+
+
+class QueryShapeStats:
+    """
+    Execution latency per query shape, keyed by SQL fingerprint: queries that differ
+    only in literals, casing, whitespace or comments count as one, so a slow shape
+    stands out however often its values change. Totals cover every execution;
+    percentiles the most recent `samples`.
+    """
+
+    def __init__(self, max_shapes: int = QUERY_SHAPES_MAX, samples: int = QUERY_SHAPE_SAMPLES):
+        self.max_shapes = max_shapes
+        self.samples = samples
+        self.shapes: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def record(self, sql: str, execution_time: Optional[float]) -> str:
+        """Count one execution (seconds; None when it failed) and return the query's fingerprint"""
+        parsed = parse_sql(sql)
+        fingerprint = parsed.fingerprint
+        entry = self.shapes.get(fingerprint)
+        if entry is None:
+            entry = {
+                "fingerprint": fingerprint,
+                "normalized": parsed.normalized,
+                "sql": sql.strip(),
+                "count": 0,
+                "errors": 0,
+                "total_ms": 0.0,
+                "min_ms": None,
+                "max_ms": None,
+                "recent_ms": deque(maxlen=self.samples),
+                "last_run": None
+            }
+            self.shapes[fingerprint] = entry
+            if len(self.shapes) > self.max_shapes:
+                self.shapes.popitem(last=False)
+        else:
+            self.shapes.move_to_end(fingerprint)
+
+        entry["last_run"] = time.time()
+        if execution_time is None:
+            entry["errors"] += 1
+            return fingerprint
+
+        elapsed_ms = execution_time * 1000
+        entry["count"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["min_ms"] = elapsed_ms if entry["min_ms"] is None else min(entry["min_ms"], elapsed_ms)
+        entry["max_ms"] = elapsed_ms if entry["max_ms"] is None else max(entry["max_ms"], elapsed_ms)
+        entry["recent_ms"].append(elapsed_ms)
+        return fingerprint
+
+    def summary(self, limit: int = 20, sort: str = "total_ms") -> List[Dict[str, Any]]:
+        """The `limit` shapes ranked by `sort` (one of SHAPE_SORT_KEYS), highest first"""
+        if sort not in SHAPE_SORT_KEYS:
+            raise ValueError(f"Cannot sort query shapes by {sort!r}, use one of {', '.join(SHAPE_SORT_KEYS)}")
+
+        shapes = []
+        for entry in self.shapes.values():
+            recent = sorted(entry["recent_ms"])
+            shape = {key: value for key, value in entry.items() if key != "recent_ms"}
+            shape["mean_ms"] = entry["total_ms"] / entry["count"] if entry["count"] else None
+            shape["p50_ms"] = self._percentile(recent, 0.50)
+            shape["p95_ms"] = self._percentile(recent, 0.95)
+            shapes.append(shape)
+        shapes.sort(key=lambda shape: shape[sort] or 0, reverse=True)
+        return shapes[:limit]
+
+    def _percentile(self, ordered: List[float], fraction: float) -> Optional[float]:
+        """Nearest-rank percentile of sorted values"""
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
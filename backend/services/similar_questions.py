@@ -0,0 +1,174 @@
+import logging
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from services.query_cache import normalize_question
+from utils.number_words import NUMBER_WORDS
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+# At or above this similarity the stored SQL is reused; between the two it is a few-shot hint
+SIMILAR_QUESTION_THRESHOLD = float(os.getenv("SIMILAR_QUESTION_THRESHOLD", "0.92"))
+SIMILAR_QUESTION_HINT_THRESHOLD = float(os.getenv("SIMILAR_QUESTION_HINT_THRESHOLD", "0.75"))
+SIMILAR_QUESTION_MAX_ENTRIES = int(os.getenv("SIMILAR_QUESTION_MAX_ENTRIES", "2000"))
+# After the embedding model fails, use hashed n-grams for this long before trying it again
+EMBEDDING_RETRY_SECONDS = 300
+# Name of the fallback embedder. Its vectors measure shared words, not meaning: "ascending" and
+# "descending", or "in" and "not in", score above any threshold, so its matches are only hints
+HASHED_EMBEDDER = "hashed-ngrams"
+HASHED_DIMENSIONS = 4096
+# Words that only phrase the request. Everything else (names, values, "not", "without",
+# "ascending", "above") is content, and reuse needs the same content on both sides
+QUESTION_STOPWORDS = {
+    'a', 'an', 'the', 'of', 'for', 'to', 'in', 'on', 'at', 'from', 'with', 'by', 'and', 'all',
+    'me', 'us', 'i', 'you', 'we', 'my', 'our', 'their', 'its', 'please', 'can', 'could', 'would',
+    'show', 'list', 'give', 'get', 'find', 'display', 'return', 'tell', 'see', 'want', 'need',
+    'what', 'which', 'who', 'whose', 'is', 'are', 'was', 'were', 'be', 'do', 'does', 'there', 'that'
+}
+
+
+def hashed_ngram_vector(text: str, dimensions: int = HASHED_DIMENSIONS) -> np.ndarray:
+    """Unit vector of hashed word unigrams/bigrams and character trigrams (no model needed)"""
+    words = re.findall(r'\w+', text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"#{word}#"
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    vector = np.zeros(dimensions, dtype=np.float32)
+    if features:
+        indices = np.fromiter((zlib.crc32(f.encode("utf-8")) % dimensions for f in features), dtype=np.int64)
+        vector += np.bincount(indices, minlength=dimensions).astype(np.float32)
+    return _unit(vector)
+
+
+def question_terms(text: str) -> set:
+    """
+    What must match for SQL to carry over: numbers (digits or words), quoted values and
+    every content word, singular ("top five earners" and "show me the top 5 earner" agree;
+    "employees in sales" and "employees in marketing" do not)
+    """
+    text = text.lower()
+    terms = set(re.findall(r'\d+(?:\.\d+)?', text))
+    terms.update(double or single for double, single in re.findall(r'"([^"]*)"|\'([^\']*)\'', text))
+    for word in re.findall(r'[a-z_]+', text):
+        if word in NUMBER_WORDS:
+            terms.add(NUMBER_WORDS[word])
+        elif word not in QUESTION_STOPWORDS:
+            terms.add(word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word)
+    return terms
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SimilarQuestionIndex:
+    """
+    Past questions and the SQL answering them, embedded and searched by cosine
+    similarity. A close match is reused when it asks the same thing in other words
+    ("top 5 earners" / "show me the top five earners"); paraphrases with different
+    content words ("five highest paid employees") become few-shot hints, as does
+    every match of the hashed n-gram fallback embedder. There is one index per
+    (schema fingerprint, dialect, embedder): SQL is written for one dialect, and
+    vectors of different embedders do not compare.
+    """
+
+    def __init__(self, client=None, model_name: str = EMBEDDING_MODEL,
+                 threshold: float = SIMILAR_QUESTION_THRESHOLD,
+                 hint_threshold: float = SIMILAR_QUESTION_HINT_THRESHOLD,
+                 max_entries: int = SIMILAR_QUESTION_MAX_ENTRIES):
+        self.client = client
+        self.model_name = model_name
+        self.threshold = threshold
+        self.hint_threshold = hint_threshold
+        self.max_entries = max_entries
+        self.indexes = {}  # (fingerprint, dialect, embedder) -> {"vectors", "questions", "sql"}
+        self._embeddings = OrderedDict()
+        self._model_failed_at = None
+
+    async def embed(self, question: str) -> Tuple[str, np.ndarray]:
+        """(embedder name, unit vector) for a question"""
+        text = normalize_question(question)
+        if text in self._embeddings:
+            self._embeddings.move_to_end(text)
+            return self._embeddings[text]
+
+        embedding = None
+        if self.client is not None and (
+                self._model_failed_at is None or time.time() - self._model_failed_at > EMBEDDING_RETRY_SECONDS):
+            try:
+                response = await self.client.embeddings(model=self.model_name, prompt=text)
+                vector = response["embedding"] if isinstance(response, dict) else response.embedding
+                embedding = (self.model_name, _unit(np.asarray(vector, dtype=np.float32)))
+                self._model_failed_at = None
+            except Exception as e:
+                logger.warning(f"⚠️ Embedding model {self.model_name} unavailable, using hashed n-grams: {str(e)}")
+                self._model_failed_at = time.time()
+        if embedding is None:
+            embedding = (HASHED_EMBEDDER, hashed_ngram_vector(text))
+
+        self._embeddings[text] = embedding
+        while len(self._embeddings) > 256:
+            self._embeddings.popitem(last=False)
+        return embedding
+
+    async def search(self, question: str, fingerprint: Optional[str],
+                     dialect: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Most similar past question at or above hint_threshold: {"question", "sql", "similarity", "reuse"}"""
+        if not fingerprint:
+            return None
+        embedder, vector = await self.embed(question)
+        index = self.indexes.get((fingerprint, dialect, embedder))
+        if not index:
+            return None
+
+        similarities = index["vectors"] @ vector
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity < self.hint_threshold:
+            return None
+        match = index["questions"][best]
+        return {
+            "question": match,
+            "sql": index["sql"][best],
+            "similarity": similarity,
+            # "top 10 earners" must not reuse the SQL of "top 5 earners", nor "employees in sales"
+            # that of "employees in marketing", however similar
+            "reuse": similarity >= self.threshold and embedder != HASHED_EMBEDDER
+                     and question_terms(match) == question_terms(normalize_question(question))
+        }
+
+    async def add(self, question: str, sql: str, fingerprint: Optional[str], dialect: Optional[str] = None) -> None:
+        if not fingerprint:
+            return
+        embedder, vector = await self.embed(question)
+        index = self.indexes.setdefault(
+            (fingerprint, dialect, embedder),
+            {"vectors": np.empty((0, len(vector)), dtype=np.float32), "questions": [], "sql": []}
+        )
+        text = normalize_question(question)
+        if text in index["questions"]:
+            position = index["questions"].index(text)
+            index["sql"][position] = sql
+            return
+
+        index["vectors"] = np.vstack([index["vectors"], vector])
+        index["questions"].append(text)
+        index["sql"].append(sql)
+        if len(index["questions"]) > self.max_entries:
+            # Oldest first
+            index["vectors"] = index["vectors"][1:]
+            index["questions"].pop(0)
+            index["sql"].pop(0)
+
+    def invalidate(self, fingerprint: str) -> None:
+        for key in [k for k in self.indexes if k[0] == fingerprint]:
+            del self.indexes[key]
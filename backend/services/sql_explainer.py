@@ -1,23 +1,106 @@
 import ollama
+import asyncio
 import logging
+import os
+import re
+from typing import Optional, List, Dict, Any, Tuple
+
+from services.ollama_client import shared_ollama_client, OLLAMA_KEEP_ALIVE
+from services.prompt_budget import OLLAMA_NUM_CTX
+from services.query_cache import QueryCache
+from services.sql_rule_explainer import RuleBasedExplainer
+from utils.single_flight import SingleFlight
+from utils.sql_ir import parse_sql
 
 logger = logging.getLogger(__name__)
 
+# Explanations generated at once by one batch request
+EXPLAIN_BATCH_CONCURRENCY = int(os.getenv("EXPLAIN_BATCH_CONCURRENCY", "4"))
+# Shorter literals ("1", "a", "10") also turn up as step numbers, counts and words in the
+# prose, so an explanation is never adapted to new values for them
+EXPLAIN_MIN_LITERAL_LENGTH = int(os.getenv("EXPLAIN_MIN_LITERAL_LENGTH", "3"))
+# Marks where the cache took a literal out of an explanation: ⟦lit2⟧ is the third literal
+LITERAL_PLACEHOLDER = re.compile(r"⟦lit(\d+)⟧")
+
 class SQLExplainer:
-    def __init__(self, model_name: str = "sqlcoder:latest"):
+    def __init__(self, model_name: str = "sqlcoder:latest", client: Optional[ollama.AsyncClient] = None,
+                 cache: Optional[QueryCache] = None):
         self.model_name = model_name
-        self.client = None
-        try:
-            self.client = ollama.Client(host='http://127.0.0.1:11434')
-            # Test connection
-            self.client.list()
-            logger.info(f"✅ SQLExplainer initialized with model: {model_name}")
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize Ollama client: {str(e)}")
-            raise Exception(f"Cannot initialize Ollama client: {str(e)}")
+        self.client = client or shared_ollama_client()
+        # Explanations by SQL fingerprint: queries differing only in literals share one
+        self.cache = cache
+        self.flights = SingleFlight()
+        # Simple queries are explained from their parse tree; the model handles the rest
+        self.rules = RuleBasedExplainer()
+        self.generated = 0
+        self.rule_based = 0
+        logger.info(f"✅ SQLExplainer initialized with model: {model_name}")
     
     async def explain(self, sql_query: str) -> str:
         """Explain SQL query in plain English using SQLCoder"""
+        explanation, _ = await self.explain_cached(sql_query)
+        return explanation
+    
+    async def explain_cached(self, sql_query: str) -> Tuple[str, bool]:
+        """(explanation, whether it came from the cache or a concurrent identical request)"""
+        explanation = self.rules.explain(sql_query)
+        if explanation:
+            self.rule_based += 1
+            return explanation, False
+        
+        parsed = parse_sql(sql_query)
+        key = QueryCache.key(parsed.fingerprint, self.model_name)
+        literals = parsed.literals
+        
+        entry = self.cache.get(key) if self.cache else None
+        if entry:
+            explanation = self._with_literals(entry, literals)
+            if explanation is not None:
+                return explanation, True
+        
+        # Concurrent explanations of the same shape share one generation
+        joined = self.flights.in_flight(key)
+        entry = await self.flights.do(key, lambda: self._generate_entry(key, sql_query, literals))
+        explanation = self._with_literals(entry, literals)
+        if explanation is None:
+            # The shared explanation cannot be adapted to these literals: explain this query itself
+            entry = await self.flights.do((key, tuple(literals)), lambda: self._generate_entry(key, sql_query, literals))
+            return entry["explanation"], False
+        return explanation, joined
+    
+    async def explain_many(self, sql_queries: List[str],
+                           concurrency: int = EXPLAIN_BATCH_CONCURRENCY) -> List[Dict[str, Any]]:
+        """
+        Explain each query, at most `concurrency` generations at a time; queries of the
+        same shape share one. A failure only affects its own item.
+        """
+        slots = asyncio.Semaphore(concurrency)
+        
+        async def one(sql: str) -> Dict[str, Any]:
+            async with slots:
+                try:
+                    explanation, cached = await self.explain_cached(sql)
+                    return {"sql": sql, "explanation": explanation, "cached": cached}
+                except Exception as e:
+                    return {"sql": sql, "error": str(e)}
+        
+        return await asyncio.gather(*[one(sql) for sql in sql_queries])
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "generated": self.generated,
+            "rule_based": self.rule_based,
+            "cache": self.cache.stats() if self.cache else None,
+            "coalesced": self.flights.stats()
+        }
+    
+    async def _generate_entry(self, key: str, sql_query: str, literals: List[str]) -> Dict[str, Any]:
+        entry = self._entry(await self._generate(sql_query), literals)
+        if self.cache:
+            self.cache.put(key, entry)
+        return entry
+    
+    async def _generate(self, sql_query: str) -> str:
         try:
             if not self.client:
                 raise Exception("Ollama client not available")
@@ -25,15 +108,17 @@ class SQLExplainer:
             prompt = self._build_explain_prompt(sql_query)
             logger.info(f"EXPLAIN PROMPT LENGTH: {len(prompt)}")
             
-            response = self.client.generate(
+            response = await self.client.generate(
                 model=self.model_name,
                 prompt=prompt,
                 options={
                     "temperature": 0.3,
                     "top_p": 0.9,
-                    "max_tokens": 500,
+                    "num_ctx": OLLAMA_NUM_CTX,
+                    "num_predict": 500,
                     "stop": ["\n\n", "```"]
-                }
+                },
+                keep_alive=OLLAMA_KEEP_ALIVE
             )
             
             # Handle different response formats
@@ -44,13 +129,51 @@ class SQLExplainer:
             else:
                 explanation = str(response).strip()
             
+            self.generated += 1
             logger.info(f"✅ Generated explanation for SQL")
             return explanation
-            
+        
         except Exception as e:
             logger.error(f"❌ SQL explanation failed: {str(e)}")
             raise Exception(f"SQL explanation failed: {str(e)}")
-
+    
+    def _entry(self, explanation: str, literals: List[str]) -> Dict[str, Any]:
+        """
+        Cache entry for an explanation: besides the text, a template in which each literal
+        long enough to be told apart from the prose, and mentioned exactly once, is replaced
+        by a placeholder
+        """
+        template = explanation
+        for index, literal in enumerate(literals):
+            if len(literal) < EXPLAIN_MIN_LITERAL_LENGTH or literals.index(literal) != index:
+                continue
+            pattern = re.compile(rf"(?<![\w.⟦]){re.escape(literal)}(?!\w|\.\d)")
+            if len(pattern.findall(template)) == 1:
+                template = pattern.sub(lambda match: f"⟦lit{index}⟧", template)
+        return {"literals": literals, "explanation": explanation, "template": template}
+    
+    def _with_literals(self, entry: Dict[str, Any], literals: List[str]) -> Optional[str]:
+        """
+        A cached explanation rewritten for this query's literal values ("salary > 5000"
+        becomes "salary > 7000"), or None unless every changed value has a placeholder
+        in the entry's template
+        """
+        explanation = entry["explanation"]
+        if entry["literals"] == literals:
+            return explanation
+        template = entry.get("template")
+        if template is None or len(entry["literals"]) != len(literals):
+            return None
+        
+        mapping = {}
+        for old, new in zip(entry["literals"], literals):
+            if mapping.setdefault(old, new) != new:
+                return None
+        for old, new in mapping.items():
+            if old != new and f"⟦lit{entry['literals'].index(old)}⟧" not in template:
+                return None
+        return LITERAL_PLACEHOLDER.sub(lambda match: literals[int(match.group(1))], template)
+    
     def _build_explain_prompt(self, sql: str) -> str:
         """Build prompt for SQL explanation"""
         # Build the prompt as a regular string with explicit newlines
@@ -1,90 +1,405 @@
 import ollama
+import asyncio
 import logging
-from typing import Optional, List, Dict, Any
+import os
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator, Callable, Awaitable
+from contextlib import aclosing
 import re
 import json
+import hashlib
+import time
+
+from services.ollama_client import shared_ollama_client, model_names, OLLAMA_KEEP_ALIVE
+from services.sql_templates import SQLTemplateEngine
+from services.prompt_budget import PromptBudget, estimate_tokens, OLLAMA_NUM_CTX
+from services.intent_lexicon import IntentLexicon, SchemaIndex, words
+from services.sql_validator import SchemaValidator
+from utils.sql_boundary import StatementBoundaryDetector
+from utils.single_flight import SingleFlight
+from utils.sql_ir import parse_sql, format_sql
+from utils.sql_fingerprint import schema_fingerprint
 
 logger = logging.getLogger(__name__)
 
+GENERATION_MAX_TOKENS = 500
+# Returned when generation fails outright
+FALLBACK_SQL = "SELECT 1;"
+
+# No stop strings: ";" and "\n\n" also cut statements inside literals or blank-line
+# separated CTEs, and "```" stopped at an opening fence. StatementBoundaryDetector
+# ends the generation instead.
+GENERATION_OPTIONS = {
+    "temperature": 0.1,
+    "top_p": 0.9,
+    # Ollama ignores max_tokens; num_predict bounds the output, num_ctx the whole window
+    "num_ctx": OLLAMA_NUM_CTX,
+    "num_predict": GENERATION_MAX_TOKENS
+}
+
+# Statements generated at once per question; the first that validates is used (1 = off)
+SQL_CANDIDATES = int(os.getenv("SQL_CANDIDATES", "1"))
+# Candidate i samples at CANDIDATE_TEMPERATURES[i] with seed i, so the candidates differ
+CANDIDATE_TEMPERATURES = (0.1, 0.4, 0.7, 1.0)
+
 class SQLGenerator:
-    def __init__(self, model_name: str = "sqlcoder:latest"):
+    def __init__(self, model_name: str = "sqlcoder:latest", client: Optional[ollama.AsyncClient] = None,
+                 candidates: int = SQL_CANDIDATES):
         self.model_name = model_name
-        self.client = None
+        self.client = client or shared_ollama_client()
+        self.candidates = max(candidates, 1)
+        self.stats = {
+            "generations": 0,
+            "tokens_generated": 0,
+            "early_stops": 0,
+            # Upper bound, not a measurement: the token budget early stops left unused,
+            # though the model may have ended sooner on its own
+            "max_tokens_avoided": 0,
+            # Sum over the generations that produced a token; generation_stats() has the average
+            "first_tokens": 0,
+            "time_to_first_token_total_ms": 0.0,
+            # Reported by Ollama only for generations that ran to the end: early-stopped ones
+            # close the stream before its final response and are counted as unreported instead
+            "reported_generations": 0,
+            "unreported_generations": 0,
+            "prompt_eval_tokens": 0,
+            "prompt_eval_ms": 0.0,
+            "eval_tokens": 0,
+            "eval_ms": 0.0,
+            # Prompts whose schema had to be cut down to fit num_ctx
+            "trimmed_prompts": 0,
+            # Candidate mode: questions answered that way, candidates rejected, questions with none valid
+            "candidate_rounds": 0,
+            "candidate_rejections": 0,
+            "candidate_failures": 0,
+            # Statements that did not fit the schema, and how many of those one regeneration fixed
+            "schema_rejections": 0,
+            "schema_repairs": 0
+        }
+        self.flights = SingleFlight()
+        # Common question shapes are answered from the schema without the model
+        self.templates = SQLTemplateEngine()
+        self.budget = PromptBudget(num_ctx=OLLAMA_NUM_CTX, num_predict=GENERATION_MAX_TOKENS)
+        self.lexicon = IntentLexicon()
+        self.validator = SchemaValidator()
+        # (schema fingerprint, analysis) of the last schema analyzed: it rarely changes between questions
+        self._analysis: Optional[Tuple[str, Dict]] = None
+    
+    def generation_stats(self) -> Dict[str, Any]:
+        """The counters, plus the average time to first token"""
+        first_tokens = self.stats["first_tokens"]
+        return {
+            **self.stats,
+            "avg_time_to_first_token_ms":
+                self.stats["time_to_first_token_total_ms"] / first_tokens if first_tokens else None
+        }
+    
+    async def initialize(self):
+        """Check that Ollama is reachable and the model is pulled"""
         try:
-            self.client = ollama.Client(host='http://localhost:11434')
-            models = self.client.list()
+            models = model_names(await self.client.list())
             logger.info(f"✅ Connected to Ollama successfully")
-            
-            if hasattr(models, 'models'):
-                model_names = [m.model for m in models.models]
-                logger.info(f"Available models: {model_names}")
-                if self.model_name in model_names:
-                    logger.info(f"✅ Model {self.model_name} is available")
-                else:
-                    logger.warning(f"⚠️ Model {self.model_name} not found. Available: {model_names}")
+            logger.info(f"Available models: {models}")
+            if self.model_name in models:
+                logger.info(f"✅ Model {self.model_name} is available")
             else:
-                logger.warning(f"Unexpected response format: {type(models)}")
+                logger.warning(f"⚠️ Model {self.model_name} not found. Available: {models}")
                 
         except Exception as e:
             logger.error(f"❌ Failed to initialize Ollama client: {str(e)}")
             raise Exception(f"Cannot initialize Ollama client: {str(e)}")
     
-    async def generate(self, natural_language_query: str, schema: Optional[List[Dict[str, Any]]] = None) -> str:
+    async def generate(self, natural_language_query: str, schema: Optional[List[Dict[str, Any]]] = None,
+                       examples: Optional[List[Dict[str, str]]] = None,
+                       validate: Optional[Callable[[str], Awaitable[bool]]] = None,
+                       dialect: Optional[str] = None) -> str:
         """
         Convert natural language to SQL - Works with ANY database
         Step 1: Analyze schema
         Step 2: Understand query intent
         Step 3: Generate SQL
+        examples: similar questions answered before ({"question", "sql"}), shown as few-shot hints
+        validate: database check for candidate mode (e.g. an EXPLAIN dry run)
+        dialect: database type the template fast path writes SQL for
         """
         try:
             if not self.client:
                 raise Exception("Ollama client not available")
             
-            # STEP 1: ANALYZE SCHEMA - Understand the database structure
             if not schema:
                 logger.warning("No schema provided!")
                 return self._get_fallback_query(natural_language_query)
             
-            logger.info(f"📊 Analyzing schema with {len(schema)} tables")
+            # STEP 1: ANALYZE SCHEMA - Understand the database structure
             analysis = self._analyze_schema(schema)
+            template = self.templates.match(natural_language_query, analysis, dialect)
+            if template:
+                return self._format_sql(template["sql"])
             
-            # STEP 2: UNDERSTAND QUERY INTENT - What is the user asking?
-            intent = self._analyze_intent(natural_language_query, analysis)
-            logger.info(f"🎯 Query intent: {intent['type']}")
-            
-            # STEP 3: BUILD INTELLIGENT PROMPT with schema context
-            prompt = self._build_prompt(natural_language_query, analysis, intent)
-            logger.info(f"📝 Prompt length: {len(prompt)}")
+            intent, prompt = self._prepare(natural_language_query, analysis, examples)
             
             # STEP 4: GENERATE SQL using Ollama
             logger.info("🤖 Sending request to Ollama...")
-            response = self.client.generate(
-                model=self.model_name,
-                prompt=prompt,
-                options={
-                    "temperature": 0.1,
-                    "top_p": 0.9,
-                    "max_tokens": 500,
-                    "stop": ["\n\n", "```", ";"]
-                }
-            )
+            if self.candidates > 1:
+                sql = await self.flights.do(
+                    self._flight_key(prompt) + ("candidates",),
+                    lambda: self._first_valid_candidate(prompt, analysis, validate)
+                )
+                if not sql:
+                    logger.warning("⚠️ No valid candidate, using fallback")
+                    sql = self._get_intelligent_fallback(natural_language_query, analysis, intent)
+                return self._format_sql(sql)
             
-            # Extract and clean SQL
-            raw_response = self._extract_response(response)
-            sql = self._clean_sql(raw_response)
-            logger.info(f"✅ Generated SQL: {sql[:100]}...")
+            raw_response = await self._complete_statement(prompt)
             
-            # Validate and format
-            if not self._validate_sql(sql):
-                logger.warning("⚠️ Generated SQL invalid, using fallback")
-                sql = self._get_intelligent_fallback(natural_language_query, analysis, intent)
-            
-            return self._format_sql(sql)
+            sql = self._finalize(raw_response, natural_language_query, analysis, intent)
+            return await self._repair(sql, natural_language_query, analysis, intent, examples)
             
         except Exception as e:
             logger.error(f"❌ SQL generation failed: {str(e)}")
             return self._get_fallback_query(natural_language_query)
     
+    async def generate_stream(self, natural_language_query: str, schema: Optional[List[Dict[str, Any]]] = None,
+                              examples: Optional[List[Dict[str, str]]] = None,
+                              dialect: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Same steps as generate(), but yields {"type": "token", "token", "sql"} as Ollama
+        produces text (sql is the cleaned, formatted statement so far) and finally
+        {"type": "sql", "sql"} with the validated statement
+        """
+        try:
+            if not self.client:
+                raise Exception("Ollama client not available")
+            
+            if not schema:
+                logger.warning("No schema provided!")
+                yield {"type": "sql", "sql": self._get_fallback_query(natural_language_query)}
+                return
+            
+            # STEP 1: ANALYZE SCHEMA - Understand the database structure
+            analysis = self._analyze_schema(schema)
+            template = self.templates.match(natural_language_query, analysis, dialect)
+            if template:
+                yield {"type": "sql", "sql": self._format_sql(template["sql"])}
+                return
+            
+            intent, prompt = self._prepare(natural_language_query, analysis, examples)
+            
+            logger.info("🤖 Streaming request to Ollama...")
+            raw_response = ""
+            if self.flights.in_flight(self._flight_key(prompt)):
+                # An identical prompt is already generating: wait for it instead of a second run
+                tokens = self._shared_statement(prompt)
+            else:
+                tokens = self._stream_statement(prompt)
+            # Closing this early (client gone) aborts the generation in Ollama
+            async with aclosing(tokens):
+                async for token in tokens:
+                    raw_response += token
+                    yield {
+                        "type": "token",
+                        "token": token,
+                        "sql": self._format_sql(self._clean_sql(raw_response, complete=False), partial=True)
+                    }
+            
+            sql = self._finalize(raw_response, natural_language_query, analysis, intent)
+            sql = await self._repair(sql, natural_language_query, analysis, intent, examples)
+            
+        except Exception as e:
+            logger.error(f"❌ SQL generation failed: {str(e)}")
+            sql = self._get_fallback_query(natural_language_query)
+        
+        yield {"type": "sql", "sql": sql}
+    
+    def generate_without_model(self, natural_language_query: str, schema: Optional[List[Dict[str, Any]]] = None,
+                               dialect: Optional[str] = None) -> Tuple[str, str]:
+        """
+        (sql, "template" or "fallback") without calling Ollama, for when there is no time
+        left to: a template answer if one matches, else the schema-based fallback
+        """
+        if not schema:
+            return self._get_fallback_query(natural_language_query), "fallback"
+        analysis = self._analyze_schema(schema)
+        template = self.templates.match(natural_language_query, analysis, dialect)
+        if template:
+            return self._format_sql(template["sql"]), "template"
+        intent = self._analyze_intent(natural_language_query, analysis)
+        return self._format_sql(self._get_intelligent_fallback(natural_language_query, analysis, intent)), "fallback"
+    
+    async def _complete_statement(self, prompt: str) -> str:
+        """First statement for a prompt; concurrent identical prompts share one generation"""
+        async def collect():
+            return "".join([token async for token in self._stream_statement(prompt)])
+        return await self.flights.do(self._flight_key(prompt), collect)
+    
+    async def _shared_statement(self, prompt: str) -> AsyncIterator[str]:
+        yield await self._complete_statement(prompt)
+    
+    def _flight_key(self, prompt: str) -> Tuple[str, str]:
+        return hashlib.sha1(prompt.encode("utf-8")).hexdigest(), self.model_name
+    
+    async def _first_valid_candidate(self, prompt: str, analysis: Dict,
+                                     validate: Optional[Callable[[str], Awaitable[bool]]] = None) -> Optional[str]:
+        """
+        Generate self.candidates statements concurrently and return the first to pass
+        validation, cancelling the rest; None when no candidate is valid. Candidates
+        are validated one at a time, in the order they finish.
+        """
+        async def candidate(index: int) -> str:
+            options = {
+                **GENERATION_OPTIONS,
+                "temperature": CANDIDATE_TEMPERATURES[index % len(CANDIDATE_TEMPERATURES)],
+                "seed": index
+            }
+            return self._clean_sql("".join([token async for token in self._stream_statement(prompt, options)]))
+        
+        self.stats["candidate_rounds"] += 1
+        tasks = [asyncio.ensure_future(candidate(i)) for i in range(self.candidates)]
+        rejected = set()
+        try:
+            for finished in asyncio.as_completed(tasks):
+                try:
+                    sql = await finished
+                except Exception as e:
+                    logger.warning(f"⚠️ Candidate generation failed: {str(e)}")
+                    continue
+                if sql not in rejected:
+                    if await self._candidate_is_valid(sql, analysis, validate):
+                        logger.info(f"🏁 Valid candidate after {len(rejected)} rejected")
+                        return sql
+                    rejected.add(sql)
+                self.stats["candidate_rejections"] += 1
+            self.stats["candidate_failures"] += 1
+            return None
+        finally:
+            # Cancelling a candidate closes its stream, which stops its generation in Ollama
+            for task in tasks:
+                task.cancel()
+    
+    async def _candidate_is_valid(self, sql: str, analysis: Dict,
+                                  validate: Optional[Callable[[str], Awaitable[bool]]] = None) -> bool:
+        """Looks like a query, fits the schema, and passes the database check"""
+        if not self._validate_sql(sql):
+            return False
+        errors = self.validator.validate(sql, analysis)
+        if errors:
+            logger.info(f"Candidate rejected: {'; '.join(errors)}")
+            return False
+        if validate is None:
+            return True
+        try:
+            return await validate(sql)
+        except Exception as e:
+            logger.info(f"Candidate rejected: {str(e)}")
+            return False
+    
+    async def _stream_statement(self, prompt: str, options: Dict[str, Any] = GENERATION_OPTIONS) -> AsyncIterator[str]:
+        """Yield model output until the first statement is complete, then stop the generation"""
+        detector = StatementBoundaryDetector()
+        token_count = 0
+        stopped_early = False
+        reported = False
+        start = time.perf_counter()
+        
+        # keep_alive keeps the model loaded, and with it the evaluated schema prefix
+        stream = await self.client.generate(
+            model=self.model_name,
+            prompt=prompt,
+            options=options,
+            stream=True,
+            keep_alive=OLLAMA_KEEP_ALIVE
+        )
+        async with aclosing(stream):
+            async for chunk in stream:
+                if isinstance(chunk, dict) and chunk.get("done"):
+                    self._record_eval_counts(chunk)
+                    reported = True
+                token = self._extract_response(chunk)
+                if not token:
+                    continue
+                if token_count == 0:
+                    # Mostly prompt evaluation: falls when the prefix is served from Ollama's cache
+                    self.stats["first_tokens"] += 1
+                    self.stats["time_to_first_token_total_ms"] += (time.perf_counter() - start) * 1000
+                token_count += 1
+                seen = len(detector.text)
+                end = detector.feed(token)
+                if end is not None:
+                    # Leaving the loop closes the stream, which cancels the generation
+                    stopped_early = True
+                    if end > seen:
+                        yield token[:end - seen]
+                    break
+                yield token
+        
+        self.stats["generations"] += 1
+        self.stats["tokens_generated"] += token_count
+        if not reported:
+            self.stats["unreported_generations"] += 1
+        if stopped_early:
+            self.stats["early_stops"] += 1
+            self.stats["max_tokens_avoided"] += max(GENERATION_MAX_TOKENS - token_count, 0)
+            logger.info(f"✂️ Statement complete after {token_count} tokens, generation stopped")
+    
+    def _record_eval_counts(self, final_chunk: Dict[str, Any]):
+        """Token counts and durations (ns) from Ollama's final response"""
+        self.stats["reported_generations"] += 1
+        self.stats["prompt_eval_tokens"] += final_chunk.get("prompt_eval_count") or 0
+        self.stats["prompt_eval_ms"] += (final_chunk.get("prompt_eval_duration") or 0) / 1e6
+        self.stats["eval_tokens"] += final_chunk.get("eval_count") or 0
+        self.stats["eval_ms"] += (final_chunk.get("eval_duration") or 0) / 1e6
+    
+    def _prepare(self, natural_language_query: str, analysis: Dict,
+                 examples: Optional[List[Dict[str, str]]] = None) -> Tuple[Dict, str]:
+        """Steps 2-3: query intent and the prompt built from it and the schema analysis"""
+        # STEP 2: UNDERSTAND QUERY INTENT - What is the user asking?
+        intent = self._analyze_intent(natural_language_query, analysis)
+        logger.info(f"🎯 Query intent: {intent['type']}")
+        
+        # STEP 3: BUILD INTELLIGENT PROMPT with schema context
+        prompt = self._build_prompt(natural_language_query, analysis, intent, examples)
+        logger.info(f"📝 Prompt length: {len(prompt)} chars, ~{estimate_tokens(prompt)} tokens")
+        
+        return intent, prompt
+    
+    def _finalize(self, raw_response: str, natural_language_query: str, analysis: Dict, intent: Dict) -> str:
+        """Clean the model output, falling back to a schema-based query if it is not valid SQL"""
+        sql = self._clean_sql(raw_response)
+        logger.info(f"✅ Generated SQL: {sql[:100]}...")
+        
+        # Validate and format
+        if not self._validate_sql(sql):
+            logger.warning("⚠️ Generated SQL invalid, using fallback")
+            sql = self._get_intelligent_fallback(natural_language_query, analysis, intent)
+        
+        return self._format_sql(sql)
+    
+    async def _repair(self, sql: str, natural_language_query: str, analysis: Dict, intent: Dict,
+                      examples: Optional[List[Dict[str, str]]] = None) -> str:
+        """
+        Check the statement against the schema without touching the database; if it does
+        not fit, generate once more with the errors in the prompt. The new statement is
+        used only if it passes the same check, otherwise the first one is kept.
+        """
+        errors = self.validator.validate(sql, analysis)
+        if not errors:
+            return sql
+        self.stats["schema_rejections"] += 1
+        logger.warning(f"⚠️ Generated SQL does not fit the schema: {'; '.join(errors)}")
+        
+        try:
+            prompt = self._build_prompt(natural_language_query, analysis, intent, examples, rejected=(sql, errors))
+            repaired = self._clean_sql(await self._complete_statement(prompt))
+        except Exception as e:
+            logger.error(f"❌ Regeneration failed: {str(e)}")
+            return sql
+        
+        if self._validate_sql(repaired) and not self.validator.validate(repaired, analysis):
+            self.stats["schema_repairs"] += 1
+            logger.info(f"🔧 Regenerated SQL fits the schema: {repaired[:100]}...")
+            return self._format_sql(repaired)
+        logger.warning("⚠️ Regenerated SQL still does not fit the schema, keeping the first attempt")
+        return sql
+    
     def _analyze_schema(self, schema: List[Dict[str, Any]]) -> Dict:
         """
         Deeply analyze ANY database schema to understand:
@@ -93,6 +408,11 @@ class SQLGenerator:
         - Relationships between tables
         - Which columns are metrics vs dimensions
         """
+        fingerprint = schema_fingerprint(schema)
+        if self._analysis and self._analysis[0] == fingerprint:
+            return self._analysis[1]
+        
+        logger.info(f"📊 Analyzing schema with {len(schema)} tables")
         analysis = {
             "tables": [],
             "relationships": [],
@@ -195,6 +515,9 @@ class SQLGenerator:
         
         # Detect relationships between tables
         self._detect_relationships(analysis)
+        # Question words to tables and columns, for intent analysis
+        analysis["index"] = SchemaIndex(analysis)
+        self._analysis = (fingerprint, analysis)
         
         logger.info(f"Schema analysis complete: {len(analysis['tables'])} tables, {len(analysis['relationships'])} relationships")
         return analysis
@@ -283,8 +606,7 @@ class SQLGenerator:
     
     def _analyze_intent(self, query: str, analysis: Dict) -> Dict:
         """Understand what the user is asking for"""
-        query_lower = query.lower()
-        words = query_lower.split()
+        tokens = words(query)
         
         intent = {
             "type": "select",
@@ -300,104 +622,97 @@ class SQLGenerator:
             "sort_order": None
         }
         
-        # Check for aggregation keywords
-        if any(word in query_lower for word in ['total', 'sum', 'average', 'avg', 'count', 'maximum', 'minimum', 'max', 'min']):
+        # One pass over the question against the compiled lexicon
+        found = self.lexicon.scan(query)
+        
+        if "aggregation" in found:
             intent["needs_aggregation"] = True
-            
-            if 'sum' in query_lower or 'total' in query_lower:
-                intent["aggregation_type"] = "SUM"
-            elif 'average' in query_lower or 'avg' in query_lower:
-                intent["aggregation_type"] = "AVG"
-            elif 'count' in query_lower:
-                intent["aggregation_type"] = "COUNT"
-            elif 'maximum' in query_lower or 'max' in query_lower:
-                intent["aggregation_type"] = "MAX"
-            elif 'minimum' in query_lower or 'min' in query_lower:
-                intent["aggregation_type"] = "MIN"
-        
-        # Check for filtering
-        if any(word in query_lower for word in ['where', 'with', 'having', 'greater', 'less', 'than', 'above', 'below', 'between']):
-            intent["needs_filtering"] = True
+            intent["aggregation_type"] = self.lexicon.first(found, "aggregation")
         
-        # Check for grouping
-        if any(word in query_lower for word in ['group', 'by', 'each', 'per', 'category']):
-            intent["needs_grouping"] = True
+        intent["needs_filtering"] = "filtering" in found
+        intent["needs_grouping"] = "grouping" in found
         
-        # Check for sorting
-        if any(word in query_lower for word in ['top', 'best', 'worst', 'highest', 'lowest', 'order', 'sort', 'limit']):
+        if "sorting" in found or "sort_order" in found:
             intent["needs_sorting"] = True
-            if 'top' in query_lower or 'best' in query_lower or 'highest' in query_lower:
-                intent["sort_order"] = "DESC"
-            elif 'worst' in query_lower or 'lowest' in query_lower:
-                intent["sort_order"] = "ASC"
+            intent["sort_order"] = self.lexicon.first(found, "sort_order")
         
-        # Check for joins
-        if any(word in query_lower for word in ['with', 'and', 'together', 'join', 'combined']):
-            intent["needs_joining"] = True
+        intent["needs_joining"] = "joining" in found
         
-        # Find relevant tables based on keywords
-        for table_info in analysis["tables"]:
-            table_name = table_info["name"].lower()
-            for word in words:
-                if len(word) > 3 and (word in table_name or table_name in word):
-                    intent["target_tables"].append(table_info["name"])
-                    break
+        # Find relevant tables through the schema's inverted index
+        index = analysis["index"]
+        intent["target_tables"] = index.find_tables(token for token in tokens if len(token) > 3)
         
-        # Special handling for salary/employee queries
-        if any(word in query_lower for word in ['salary', 'wage', 'income', 'pay']):
-            intent["type"] = "salary_analysis"
+        # Domain vocabulary (salary, ...): its tables and the metric column it refers to
+        domain = self.lexicon.first(found, "domains")
+        if domain:
+            vocabulary = self.lexicon.lexicon["domains"][domain]
+            intent["type"] = f"{domain}_analysis"
             intent["needs_filtering"] = True
             
-            # Find employee table and salary column
-            for table_name, metrics in analysis["metrics"].items():
-                if any(term in table_name.lower() for term in ['user', 'employee', 'staff']):
+            columns = index.find_columns(vocabulary["columns"])
+            for table_name in index.find_tables(vocabulary["tables"]):
+                if table_name not in intent["target_tables"]:
                     intent["target_tables"].append(table_name)
-                    
-                    # Find salary column
-                    for metric in metrics:
-                        if any(term in metric.lower() for term in ['salary', 'wage', 'income']):
-                            intent["salary_column"] = f"{table_name}.{metric}"
-                            break
+                metric = next((m for m in analysis["metrics"].get(table_name, []) if (table_name, m) in columns), None)
+                if metric and f"{domain}_column" not in intent:
+                    intent[f"{domain}_column"] = f"{table_name}.{metric}"
         
         return intent
     
-    def _build_prompt(self, query: str, analysis: Dict, intent: Dict) -> str:
-        """Build an intelligent prompt with schema context"""
-        
+    def _build_schema_prefix(self, analysis: Dict, query: str = "", intent: Optional[Dict] = None,
+                             task: str = "") -> str:
+        """
+        Schema, relationships and instructions: identical for every question on the same
+        schema, as long as the schema fits the context. One line per table with
+        abbreviated types; a schema too large for num_ctx keeps only the tables and
+        columns most relevant to the question.
+        """
+        header = "### Database Schema (USE EXACT NAMES):\n"
+        instructions = "### Instructions:\n"
+        instructions += "1. Use ONLY table and column names from the schema above\n"
+        instructions += "2. Return ONLY the SQL query, no explanations\n"
+        instructions += "3. End with a semicolon\n"
+        instructions += "4. Do NOT include markdown or tags\n\n"
+        
+        relationships = sorted(analysis["relationships"],
+                               key=lambda r: (r['from_table'], r['from_column'], r['to_table']))
+        relationship_lines = [
+            f"- {rel['from_table']}.{rel['from_column']} = {rel['to_table']}.{rel['to_column']}\n"
+            for rel in relationships[:5]
+        ]
+        
+        budget = self.budget.remaining(header, "### Relationships:\n", *relationship_lines, instructions, task)
+        tables, lines = self.budget.fit_schema(
+            analysis["tables"], query, (intent or {}).get("target_tables", []), budget
+        )
+        if len(tables) < len(analysis["tables"]) or any(line.endswith(", ...)") for line in lines):
+            self.stats["trimmed_prompts"] += 1
+        
+        prompt = header + "".join(f"{line}\n" for line in lines) + "\n"
+        
+        # RELATIONSHIPS SECTION (only between tables that are still in the prompt)
+        kept = {t["name"] for t in tables}
+        relationship_lines = [
+            f"- {rel['from_table']}.{rel['from_column']} = {rel['to_table']}.{rel['to_column']}\n"
+            for rel in relationships if rel['from_table'] in kept and rel['to_table'] in kept
+        ][:5]
+        if relationship_lines:
+            prompt += "### Relationships:\n" + "".join(relationship_lines) + "\n"
+        
+        return prompt + instructions
+    
+    def _build_prompt(self, query: str, analysis: Dict, intent: Dict,
+                      examples: Optional[List[Dict[str, str]]] = None,
+                      rejected: Optional[Tuple[str, List[str]]] = None) -> str:
+        """
+        Build an intelligent prompt with schema context. Everything that depends only
+        on the schema comes first, in a fixed order, so consecutive questions share a
+        prompt prefix and Ollama can reuse its cached evaluation of it.
+        rejected: (sql, errors) of an earlier attempt that did not fit the schema
+        """
         prompt = "### Task\n"
         prompt += f"Generate a SQL query to answer: {query}\n\n"
         
-        # DATABASE SCHEMA SECTION
-        prompt += "### Database Schema (USE EXACT NAMES):\n\n"
-        
-        for table_info in analysis["tables"]:
-            table_name = table_info["name"]
-            prompt += f"Table: {table_name} ({table_info['type']})\n"
-            prompt += "Columns:\n"
-            
-            for col in table_info["columns"]:
-                prompt += f"  - {col['name']} ({col['type']})"
-                if col['is_primary']:
-                    prompt += " PRIMARY KEY"
-                prompt += f"  # {col['semantic']}\n"
-            
-            # Show important columns
-            if analysis["metrics"].get(table_name):
-                prompt += f"  Numeric columns: {', '.join(analysis['metrics'][table_name][:3])}\n"
-            if analysis["dimensions"].get(table_name):
-                prompt += f"  Text columns: {', '.join(analysis['dimensions'][table_name][:3])}\n"
-            if analysis["dates"].get(table_name):
-                prompt += f"  Date columns: {', '.join(analysis['dates'][table_name][:3])}\n"
-            
-            prompt += "\n"
-        
-        # RELATIONSHIPS SECTION
-        if analysis["relationships"]:
-            prompt += "### Relationships:\n"
-            for rel in analysis["relationships"][:5]:
-                prompt += f"- {rel['from_table']}.{rel['from_column']} = {rel['to_table']}.{rel['to_column']}\n"
-            prompt += "\n"
-        
         # QUERY ANALYSIS SECTION
         prompt += "### Query Analysis:\n"
         
@@ -462,15 +777,24 @@ class SQLGenerator:
                 if analysis["names"].get(table):
                     prompt += f"- Include name columns: {', '.join(analysis['names'][table][:2])}\n"
         
-        prompt += "\n### Instructions:\n"
-        prompt += "1. Use ONLY table and column names from the schema above\n"
-        prompt += "2. Return ONLY the SQL query, no explanations\n"
-        prompt += "3. End with a semicolon\n"
-        prompt += "4. Do NOT include markdown or tags\n\n"
+        # SIMILAR QUESTIONS ANSWERED BEFORE
+        if examples:
+            prompt += "\n### Similar questions answered before:\n"
+            for example in examples:
+                prompt += f"Question: {example['question']}\n"
+                prompt += f"SQL: {' '.join(example['sql'].split())}\n"
         
-        prompt += "### SQL Query:\n"
+        # PREVIOUS ATTEMPT AND WHY IT WAS REJECTED
+        if rejected:
+            sql, errors = rejected
+            prompt += "\n### Previous attempt (rejected, do not repeat its mistakes):\n"
+            prompt += f"{' '.join(sql.split())}\n"
+            prompt += "Errors:\n" + "".join(f"- {error}\n" for error in errors)
         
-        return prompt
+        prompt += "\n### SQL Query:\n"
+        
+        # The schema gets whatever context the task leaves
+        return self._build_schema_prefix(analysis, query, intent, prompt) + prompt
     
     def _extract_response(self, response) -> str:
         """Extract response from Ollama in any format"""
@@ -481,8 +805,8 @@ class SQLGenerator:
         else:
             return str(response)
     
-    def _clean_sql(self, sql: str) -> str:
-        """Clean up generated SQL"""
+    def _clean_sql(self, sql: str, complete: bool = True) -> str:
+        """Clean up generated SQL; with complete=False, a partial statement is left unterminated"""
         if not sql:
             return ""
         
@@ -494,45 +818,29 @@ class SQLGenerator:
         # Remove comments
         sql = re.sub(r'^#.*?\n', '', sql)
         
-        # Take first statement
-        statements = sql.split(';')
-        if statements:
-            sql = statements[0].strip() + ';'
+        # Take first statement (a ';' inside a string literal does not end it)
+        detector = StatementBoundaryDetector()
+        terminated = detector.feed(sql) is not None
+        sql = sql[:detector.finish()].strip().rstrip(';').rstrip()
+        if complete or terminated:
+            sql += ';'
         
         return sql
     
-    def _format_sql(self, sql: str) -> str:
-        """Format SQL for readability"""
+    def _format_sql(self, sql: str, partial: bool = False) -> str:
+        """Format SQL for readability; partial: a statement still being generated, not worth caching its parse"""
         if not sql:
             return sql
-        
-        # Add line breaks after keywords
-        keywords = ['SELECT', 'FROM', 'WHERE', 'GROUP BY', 'ORDER BY', 'HAVING', 'JOIN', 
-                    'LEFT JOIN', 'RIGHT JOIN', 'INNER JOIN', 'LIMIT']
-        
-        for keyword in keywords:
-            sql = sql.replace(f' {keyword} ', f'\n{keyword} ')
-        
-        # Handle commas in SELECT
-        if 'SELECT' in sql:
-            parts = sql.split('\nSELECT ')
-            if len(parts) > 1:
-                select_part = parts[1].split('\nFROM')[0]
-                if ',' in select_part:
-                    formatted = select_part.replace(', ', ',\n    ')
-                    sql = sql.replace(select_part, formatted)
-        
-        return sql
+        return format_sql(sql, cache=False) if partial else parse_sql(sql).formatted
     
     def _validate_sql(self, sql: str) -> bool:
         """Basic SQL validation"""
         if not sql or len(sql) < 10:
             return False
         
-        sql_upper = sql.upper()
         valid_starts = ['SELECT', 'WITH', 'SHOW']
         
-        return any(sql_upper.startswith(word) for word in valid_starts)
+        return parse_sql(sql).first_keyword in valid_starts
     
     def _get_intelligent_fallback(self, query: str, analysis: Dict, intent: Dict) -> str:
         """Intelligent fallback based on schema analysis"""
@@ -574,7 +882,7 @@ ORDER BY {salary_col} DESC;
     
     def _get_fallback_query(self, query: str) -> str:
         """Ultimate fallback"""
-        return "SELECT 1;"
+        return FALLBACK_SQL
     
     async def check_availability(self) -> bool:
         """Check if Ollama is available"""
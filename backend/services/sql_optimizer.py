@@ -0,0 +1,433 @@
+import logging
+import os
+import re
+import sqlite3
+from typing import Optional, List, Dict, Any, Tuple
+
+import sqlparse
+from sqlparse import tokens as T
+
+from utils.sql_ast import (
+    parse_select,
+    tokenize,
+    tokens_to_sql,
+    split_conjuncts,
+    column_references,
+    quote_identifier,
+    SelectItem,
+    TableRef
+)
+
+logger = logging.getLogger(__name__)
+
+# Rule name -> what it does; every rule can be switched off on its own
+OPTIMIZER_RULES = {
+    "project_columns": "Replace SELECT * with the columns the UI displays",
+    "window_functions": "Compute correlated same-table aggregates with a window function in a single scan",
+    "hoist_scalar_subqueries": "Evaluate scalar subqueries once in a CTE instead of once per row",
+    "remove_redundant_distinct": "Drop DISTINCT when the selected columns are already unique",
+    "remove_redundant_order_by": "Drop ORDER BY where it cannot change the result",
+}
+
+# Rule -> dialect -> first server version with what its rewrite emits (window functions, CTEs);
+# an older or unknown version of these dialects gets the query unchanged
+RULE_MIN_VERSIONS = {
+    "window_functions": {"mysql": (8, 0), "mariadb": (10, 2), "sqlite": (3, 25)},
+    "hoist_scalar_subqueries": {"mysql": (8, 0), "mariadb": (10, 2), "sqlite": (3, 8, 3)},
+}
+
+
+def _version_tuple(version: Optional[str]) -> Optional[Tuple[int, ...]]:
+    match = re.match(r'\d+(\.\d+)*', (version or "").strip())
+    return tuple(int(part) for part in match.group(0).split('.')) if match else None
+
+
+class SQLOptimizer:
+    """
+    Rule-based rewrites applied to generated SQL before it is executed.
+    Works on the utils.sql_ast decomposition; anything the parser does not
+    understand is passed through unchanged. Every applied rewrite is reported.
+    """
+
+    def __init__(self, enabled_rules: Optional[List[str]] = None):
+        if enabled_rules is None:
+            configured = os.getenv("SQL_OPTIMIZER_RULES")
+            if configured is not None:
+                enabled_rules = [r.strip() for r in configured.split(',') if r.strip()]
+            else:
+                enabled_rules = list(OPTIMIZER_RULES)
+        self.enabled_rules = {r for r in enabled_rules if r in OPTIMIZER_RULES}
+
+    def optimize(self, sql: str, schema: Optional[List[Dict[str, Any]]] = None, db_type: Optional[str] = None,
+                 visible_columns: Optional[List[str]] = None,
+                 rules: Optional[Dict[str, bool]] = None,
+                 server_version: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Rewrite a query. `rules` overrides the configured rule set per call
+        ({"window_functions": False, ...}); rules whose SQL the server
+        (`server_version`, e.g. "5.7.44") cannot run are skipped. Returns the
+        SQL to run and the list of rewrites that were applied.
+        """
+        enabled = set(self.enabled_rules)
+        for rule, on in (rules or {}).items():
+            if rule in OPTIMIZER_RULES:
+                (enabled.add if on else enabled.discard)(rule)
+        enabled = {rule for rule in enabled if self._supported(rule, db_type, server_version)}
+
+        query = parse_select(sql)
+        if query is None or not enabled:
+            return {"sql": sql, "rewrites": []}
+
+        tables = self._schema_tables(schema)
+        rewrites: List[Dict[str, str]] = []
+        try:
+            if "project_columns" in enabled and visible_columns:
+                self._project_columns(query, tables, visible_columns, db_type, rewrites)
+            if "window_functions" in enabled or "hoist_scalar_subqueries" in enabled:
+                self._rewrite_scalar_subqueries(query, enabled, rewrites)
+            if "remove_redundant_distinct" in enabled:
+                self._remove_redundant_distinct(query, tables, rewrites)
+            if "remove_redundant_order_by" in enabled:
+                self._remove_redundant_order_by(query, rewrites)
+        except Exception as e:
+            logger.warning(f"SQL optimizer skipped query: {str(e)}")
+            return {"sql": sql, "rewrites": []}
+
+        if not rewrites:
+            return {"sql": sql, "rewrites": []}
+
+        optimized = sqlparse.format(query.to_sql(), reindent=True, keyword_case='upper')
+        if sql.strip().endswith(';'):
+            optimized += ';'
+        for rewrite in rewrites:
+            logger.info(f"🔧 Rewrite [{rewrite['rule']}]: {rewrite['description']}")
+        return {"sql": optimized, "rewrites": rewrites}
+
+    def _supported(self, rule: str, db_type: Optional[str], server_version: Optional[str]) -> bool:
+        """Whether the server can run what the rule writes"""
+        dialect = db_type
+        if db_type == "sqlite" and server_version is None:
+            # aiosqlite runs on the sqlite3 library of this process
+            server_version = sqlite3.sqlite_version
+        elif db_type == "mysql" and "mariadb" in (server_version or "").lower():
+            dialect = "mariadb"
+        minimum = RULE_MIN_VERSIONS.get(rule, {}).get(dialect)
+        if minimum is None:
+            return True
+        version = _version_tuple(server_version)
+        return version is not None and version >= minimum
+
+    def _project_columns(self, query, tables, visible_columns, db_type, rewrites) -> None:
+        """SELECT * on a single table -> only the displayed columns that exist there"""
+        if len(query.select_items) != 1 or query.select_items[0].expr != '*':
+            return
+        if len(query.tables) != 1 or not query.tables[0].name or query.group_by:
+            return
+
+        table = query.tables[0].name
+        columns = tables.get(table.lower(), {}).get("columns", [])
+        by_name = {c.lower(): c for c in columns}
+        projected = [by_name[c.lower()] for c in visible_columns if c.lower() in by_name]
+        if not projected or len(projected) == len(columns):
+            return
+
+        query.select_items = [SelectItem.from_sql(quote_identifier(c, db_type)) for c in projected]
+        rewrites.append({
+            "rule": "project_columns",
+            "description": f"SELECT * on {table} narrowed to {len(projected)} of {len(columns)} columns"
+        })
+
+    def _rewrite_scalar_subqueries(self, query, enabled, rewrites) -> None:
+        """Turn scalar aggregate subqueries in WHERE and the select list into window columns or CTEs"""
+        context = {
+            "outer": {t.reference.lower(): t for t in query.tables if t.name},
+            "windows": {},  # outer reference -> list of window select items
+            "counter": 0,
+            "enabled": enabled,
+            "rewrites": rewrites
+        }
+
+        if query.where:
+            query.where = self._rewrite_condition(query, query.where, context)
+
+        if not query.group_by and not query.aggregates:
+            for index, item in enumerate(query.select_items):
+                if not item.alias or not self._is_subquery(item.tokens):
+                    continue
+                replacement = self._rewrite_subquery(query, item.expr[1:-1], context)
+                if replacement:
+                    query.select_items[index] = SelectItem.from_sql(f"{replacement} AS {item.alias_sql}")
+
+        # Wrap each windowed table in a derived table that carries the window columns
+        for reference, windows in context["windows"].items():
+            table = context["outer"][reference]
+            columns = ', '.join([f"{table.name}.*"] + windows)
+            table.source = f"(SELECT {columns} FROM {table.name})"
+            table.alias = table.reference
+            table.name = None
+
+    def _rewrite_condition(self, query, condition: str, context) -> str:
+        tokens = tokenize(condition)
+        pieces, last = [], 0
+        index = 0
+        while index < len(tokens):
+            if self._starts_subquery(tokens, index):
+                end = self._closing(tokens, index)
+                if end is None:
+                    break
+                if self._is_compared(tokens, index, end):
+                    replacement = self._rewrite_subquery(query, tokens_to_sql(tokens[index + 1:end]), context)
+                    if replacement:
+                        pieces.append(tokens_to_sql(tokens[last:index]))
+                        pieces.append(replacement)
+                        last = end + 1
+                index = end + 1
+                continue
+            index += 1
+        pieces.append(tokens_to_sql(tokens[last:]))
+        return ' '.join(p for p in pieces if p)
+
+    def _rewrite_subquery(self, query, sub_sql: str, context) -> Optional[str]:
+        """Rewrite one scalar subquery; returns the expression that replaces it"""
+        sub = parse_select(sub_sql)
+        if sub is None or len(sub.select_items) != 1 or len(sub.tables) != 1 or not sub.tables[0].name:
+            return None
+        if sub.group_by or sub.having or sub.limits_rows or sub.distinct or sub.ctes:
+            return None
+        call = sub.select_items[0].aggregate
+        if not call:
+            return None
+        function, args = call
+
+        inner = sub.tables[0]
+        inner_refs = {inner.reference.lower(), inner.name.lower()}
+        outer = context["outer"]
+
+        # The aggregated expression itself must not depend on the outer row
+        if any(q and q.lower() in outer and q.lower() not in inner_refs for q, _ in column_references(args)):
+            return None
+
+        correlations, local = [], []
+        for conjunct in split_conjuncts(sub.where) if sub.where else []:
+            correlation = self._correlation(conjunct, inner_refs, outer)
+            if correlation == "unsupported":
+                return None
+            if correlation:
+                correlations.append(correlation)
+            else:
+                local.append(conjunct)
+
+        enabled = context["enabled"]
+        star = any(item.is_star for item in query.select_items)
+
+        # An uncorrelated subquery already runs once (an InitPlan): a window over the whole
+        # table would only add a full scan that keeps indexes and predicates from being used
+        if "window_functions" in enabled and correlations and not local and not star:
+            window = self._window_rewrite(function, args, inner, correlations, context)
+            if window:
+                return window
+
+        if "hoist_scalar_subqueries" in enabled and not star:
+            return self._hoist_rewrite(query, sub, function, correlations, local, context)
+        return None
+
+    def _correlation(self, conjunct: str, inner_refs: set, outer: Dict[str, TableRef]):
+        """(inner column, outer reference, outer column) for `inner.col = outer.col`, None if local"""
+        tokens = [t for t in tokenize(conjunct) if not t.is_whitespace]
+        references = column_references(tokens)
+        outer_refs = [q for q, _ in references if q and q.lower() in outer and q.lower() not in inner_refs]
+        if not outer_refs:
+            return None
+
+        comparisons = [t for t in tokens if t.ttype in T.Operator.Comparison]
+        if len(references) != 2 or len(comparisons) != 1 or comparisons[0].value != '=' or len(tokens) > 7:
+            return "unsupported"
+        (q1, c1), (q2, c2) = references
+        if q1 and q1.lower() in outer and q1.lower() not in inner_refs:
+            (q1, c1), (q2, c2) = (q2, c2), (q1, c1)
+        if q1 and q1.lower() not in inner_refs:
+            return "unsupported"
+        return (f"{q1}.{c1}" if q1 else c1, c1, q2, c2)
+
+    def _window_rewrite(self, function, args, inner, correlations, context) -> Optional[str]:
+        """Same table on both sides of a correlation: aggregate with OVER (PARTITION BY ...) in one scan"""
+        outer = context["outer"]
+        references = {ref.lower() for _, _, ref, _ in correlations}
+        if len(references) != 1:
+            return None
+        reference = references.pop()
+        if any(inner_col.lower() != outer_col.lower() for _, inner_col, _, outer_col in correlations):
+            return None
+
+        table = outer.get(reference)
+        if table is None or table.name is None or table.name.lower() != inner.name.lower():
+            return None
+
+        inner_refs = {inner.reference.lower(), inner.name.lower()}
+        argument = tokens_to_sql(self._strip_qualifiers(args, inner_refs))
+        partition = [outer_col for _, _, _, outer_col in correlations]
+
+        context["counter"] += 1
+        name = f"_window_{context['counter']}"
+        window = f"{function}({argument}) OVER (PARTITION BY {', '.join(partition)})"
+        # A correlated `a.x = b.x` never matches NULL, while PARTITION BY groups NULLs together
+        empty = "0" if function == "COUNT" else "NULL"
+        nulls = ' OR '.join(f"{c} IS NULL" for c in partition)
+        window = f"CASE WHEN {nulls} THEN {empty} ELSE {window} END"
+
+        context["windows"].setdefault(reference, []).append(f"{window} AS {name}")
+        context["rewrites"].append({
+            "rule": "window_functions",
+            "description": f"{function} subquery on {table.name} computed as a window function "
+                           f"partitioned by {', '.join(partition)}"
+        })
+        return f"{table.reference}.{name}"
+
+    def _hoist_rewrite(self, query, sub, function, correlations, local, context) -> Optional[str]:
+        """Evaluate the subquery once in a CTE and join it back"""
+        if correlations and any(t.join is None for t in query.tables[1:]):
+            # ON cannot see tables listed before a comma join
+            return None
+
+        context["counter"] += 1
+        name = f"_scalar_{context['counter']}"
+        sub.select_items[0].alias = "value"
+        sub.where = ' AND '.join(local) or None
+
+        if correlations:
+            keys = [SelectItem.from_sql(f"{inner} AS key_{i}") for i, (inner, _, _, _) in enumerate(correlations, 1)]
+            sub.group_by = [inner for inner, _, _, _ in correlations]
+            sub.select_items = keys + sub.select_items
+            condition = ' AND '.join(f"{name}.key_{i} = {ref}.{col}"
+                                     for i, (_, _, ref, col) in enumerate(correlations, 1))
+            query.tables.append(TableRef(tokenize(f"{name} ON {condition}"), join="LEFT JOIN"))
+        else:
+            query.tables.append(TableRef(tokenize(name), join="CROSS JOIN"))
+
+        query.ctes.append((name, sub.to_sql()))
+        context["rewrites"].append({
+            "rule": "hoist_scalar_subqueries",
+            "description": f"{'Correlated' if correlations else 'Scalar'} {function} subquery hoisted into CTE {name}"
+        })
+        value = f"{name}.value"
+        return f"COALESCE({value}, 0)" if correlations and function == "COUNT" else value
+
+    def _remove_redundant_distinct(self, query, tables, rewrites) -> None:
+        if not query.distinct:
+            return
+
+        selected = {item.expr.lower() for item in query.select_items}
+        if query.group_by and all(g.lower() in selected for g in query.group_by):
+            query.distinct = False
+            rewrites.append({
+                "rule": "remove_redundant_distinct",
+                "description": "DISTINCT dropped: rows are already unique per GROUP BY key"
+            })
+            return
+
+        if len(query.tables) != 1 or not query.tables[0].name or query.group_by:
+            return
+        table = query.tables[0]
+        primary_keys = tables.get(table.name.lower(), {}).get("primary_keys", [])
+        columns = {c.lower() for q, c in (self._plain_column(item) for item in query.select_items) if c}
+        if primary_keys and all(pk.lower() in columns for pk in primary_keys):
+            query.distinct = False
+            rewrites.append({
+                "rule": "remove_redundant_distinct",
+                "description": f"DISTINCT dropped: primary key of {table.name} is selected"
+            })
+
+    def _remove_redundant_order_by(self, query, rewrites) -> None:
+        # ORDER BY in derived tables and CTEs has no effect on the outer result unless it
+        # decides which rows are kept (LIMIT, TOP, OFFSET, FETCH FIRST)
+        for table in query.tables:
+            sub = table.subquery
+            if sub is not None and sub.order_by and not sub.limits_rows:
+                sub.order_by = []
+                table.source = f"({sub.to_sql()})"
+                rewrites.append({
+                    "rule": "remove_redundant_order_by",
+                    "description": f"ORDER BY removed from derived table {table.reference}"
+                })
+
+        for index, (name, body) in enumerate(query.ctes):
+            sub = parse_select(body)
+            if sub is not None and sub.order_by and not sub.limits_rows:
+                sub.order_by = []
+                query.ctes[index] = (name, sub.to_sql())
+                rewrites.append({
+                    "rule": "remove_redundant_order_by",
+                    "description": f"ORDER BY removed from CTE {name}"
+                })
+
+        # An aggregate without GROUP BY returns a single row
+        if (query.order_by and not query.group_by and not query.limits_rows and query.select_items
+                and all(item.aggregate for item in query.select_items)):
+            query.order_by = []
+            rewrites.append({
+                "rule": "remove_redundant_order_by",
+                "description": "ORDER BY removed from single-row aggregate"
+            })
+
+    def _plain_column(self, item):
+        references = column_references(item.tokens)
+        significant = [t for t in item.tokens if not t.is_whitespace]
+        if len(references) == 1 and len(significant) in (1, 3):
+            return references[0]
+        return None, None
+
+    def _strip_qualifiers(self, tokens, qualifiers: set) -> list:
+        """Drop `alias.` prefixes that refer to the given table references"""
+        result = []
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            if (index + 1 < len(tokens) and tokens[index + 1].match(T.Punctuation, '.')
+                    and token.value.lower() in qualifiers):
+                index += 2
+                continue
+            result.append(token)
+            index += 1
+        return result
+
+    def _starts_subquery(self, tokens, index) -> bool:
+        if not tokens[index].match(T.Punctuation, '('):
+            return False
+        following = next((t for t in tokens[index + 1:] if not t.is_whitespace), None)
+        return following is not None and following.match(T.Keyword.DML, 'SELECT')
+
+    def _is_subquery(self, tokens) -> bool:
+        significant = [t for t in tokens if not t.is_whitespace]
+        return (bool(significant) and self._starts_subquery(significant, 0)
+                and self._closing(significant, 0) == len(significant) - 1)
+
+    def _closing(self, tokens, start) -> Optional[int]:
+        depth = 0
+        for index in range(start, len(tokens)):
+            if tokens[index].match(T.Punctuation, '('):
+                depth += 1
+            elif tokens[index].match(T.Punctuation, ')'):
+                depth -= 1
+                if depth == 0:
+                    return index
+        return None
+
+    def _is_compared(self, tokens, start, end) -> bool:
+        """Whether a parenthesized subquery is an operand of a comparison"""
+        before = next((t for t in reversed(tokens[:start]) if not t.is_whitespace), None)
+        after = next((t for t in tokens[end + 1:] if not t.is_whitespace), None)
+        return ((before is not None and before.ttype in T.Operator.Comparison)
+                or (after is not None and after.ttype in T.Operator.Comparison))
+
+    def _schema_tables(self, schema) -> Dict[str, Dict[str, Any]]:
+        tables = {}
+        for table in schema or []:
+            if not isinstance(table, dict):
+                continue
+            name = table.get('name') or table.get('table_name', '')
+            columns = [c for c in table.get('columns', []) if isinstance(c, dict)]
+            tables[name.lower()] = {
+                "columns": [c.get('name') or c.get('column_name', '') for c in columns],
+                "primary_keys": [c.get('name') or c.get('column_name', '') for c in columns if c.get('isPrimary')]
+            }
+        return tables
@@ -0,0 +1,230 @@
+import logging
+import os
+import re
+from typing import List, Optional
+
+from utils.sql_ast import SelectQuery, split_conjuncts, unquote
+from utils.sql_ir import parse_sql
+
+logger = logging.getLogger(__name__)
+
+# Above this many clauses (sources, conditions, groupings, aggregates, sort keys) the model explains
+RULE_EXPLAIN_MAX_COMPLEXITY = int(os.getenv("RULE_EXPLAIN_MAX_COMPLEXITY", "8"))
+
+COMPARISONS = {
+    '=': 'equals', '<>': 'is not', '!=': 'is not', '>': 'is greater than', '>=': 'is at least',
+    '<': 'is less than', '<=': 'is at most'
+}
+AGGREGATES = {
+    'COUNT': 'the number of', 'SUM': 'the total of', 'AVG': 'the average of',
+    'MIN': 'the smallest', 'MAX': 'the largest'
+}
+IDENTIFIER = re.compile(r'(?:[\w$]+|"[^"]+"|`[^`]+`|\[[^\]]+\])(?:\.(?:[\w$]+|"[^"]+"|`[^`]+`|\[[^\]]+\]))*')
+LITERAL = re.compile(r"-?\d+(?:\.\d+)?|'(?:[^']|'')*'|TRUE|FALSE", re.IGNORECASE)
+AGGREGATE_CALL = re.compile(r'(?P<function>COUNT|SUM|AVG|MIN|MAX)\s*\(\s*(?P<distinct>DISTINCT\s+)?(?P<argument>.+?)\s*\)',
+                            re.IGNORECASE)
+IS_NULL = re.compile(r'(?P<left>.+?)\s+IS\s+(?P<negated>NOT\s+)?NULL', re.IGNORECASE)
+BETWEEN = re.compile(r'(?P<left>.+?)\s+(?P<negated>NOT\s+)?BETWEEN\s+(?P<low>.+?)\s+AND\s+(?P<high>.+)', re.IGNORECASE)
+IN_LIST = re.compile(r'(?P<left>.+?)\s+(?P<negated>NOT\s+)?IN\s*\((?P<values>[^()]+)\)', re.IGNORECASE)
+LIKE = re.compile(r"(?P<left>.+?)\s+(?P<negated>NOT\s+)?I?LIKE\s+(?P<pattern>'(?:[^']|'')*')", re.IGNORECASE)
+COMPARISON = re.compile(r'(?P<left>.+?)\s*(?P<operator>>=|<=|<>|!=|=|>|<)\s*(?P<right>.+)')
+# ORDER BY 2 / GROUP BY 1 name a column of the select list by position
+POSITION = re.compile(r'\d+')
+
+
+class RuleBasedExplainer:
+    """
+    Explains simple SELECTs without the model by walking the parsed query: sources
+    and joins, filters, grouping, what is returned, sorting and limits, one plain
+    English step each. Any part it cannot describe exactly (subqueries, CTEs, set
+    operations, expressions, NOT, ...) returns None so the model explains instead.
+    """
+
+    def __init__(self, max_complexity: int = RULE_EXPLAIN_MAX_COMPLEXITY):
+        self.max_complexity = max_complexity
+
+    def explain(self, sql: str) -> Optional[str]:
+        # Subqueries (a second SELECT anywhere) are left to the model
+        if len(re.findall(r'\bSELECT\b', sql, re.IGNORECASE)) != 1:
+            return None
+        parsed = parse_sql(sql)
+        query = parsed.select
+        if query is None or not query.tables or self.complexity(query) > self.max_complexity:
+            return None
+        # FETCH FIRST n ROWS is not decomposed by the parser
+        if 'FETCH' in parsed.keywords:
+            return None
+
+        steps = [
+            self._sources(query),
+            self._filter("Keeps only the rows where", query.where),
+            self._grouping(query),
+            self._filter("Keeps only the groups where", query.having),
+            self._output(query),
+            self._ordering(query),
+            self._limit(query)
+        ]
+        if any(step is None for step in steps):
+            return None
+        return "\n".join(f"{number}. {step}" for number, step in enumerate([s for s in steps if s], 1))
+
+    def complexity(self, query: SelectQuery) -> int:
+        return (len(query.tables)
+                + (len(split_conjuncts(query.where)) if query.where else 0)
+                + len(query.group_by)
+                + (len(split_conjuncts(query.having)) if query.having else 0)
+                + len(query.aggregates)
+                + len(query.order_by))
+
+    def _sources(self, query: SelectQuery) -> Optional[str]:
+        first = query.tables[0]
+        step = f"Reads rows from the {self._table(first)} table"
+        for table in query.tables[1:]:
+            join = (table.join or "").upper()
+            if not table.join or not table.condition or 'CROSS' in join or 'NATURAL' in join:
+                return None
+            condition = self._condition(re.sub(r'^ON\s+', '', table.condition, flags=re.IGNORECASE))
+            if condition is None or table.condition.upper().startswith('USING'):
+                return None
+            if 'LEFT' in join:
+                step += f", keeps all of them and adds matching rows from {self._table(table)} where {condition}"
+            elif 'RIGHT' in join or 'FULL' in join:
+                return None
+            else:
+                step += f", combined with rows from {self._table(table)} where {condition}"
+        return step + "."
+
+    def _filter(self, lead: str, condition: Optional[str]) -> Optional[str]:
+        if not condition:
+            return ""
+        conjuncts = split_conjuncts(condition)
+        # "a or b and c" reads either way: mixed AND/OR is left to the model
+        if len(conjuncts) > 1 and any(re.search(r'\bOR\b', c, re.IGNORECASE) for c in conjuncts):
+            return None
+        parts = [self._condition(c) for c in conjuncts]
+        if any(p is None for p in parts):
+            return None
+        return f"{lead} {self._list(parts)}."
+
+    def _grouping(self, query: SelectQuery) -> Optional[str]:
+        if not query.group_by:
+            return ""
+        keys = [None if POSITION.fullmatch(key) else self._operand(key) for key in query.group_by]
+        return None if None in keys else f"Groups the rows by {self._list(keys)}."
+
+    def _output(self, query: SelectQuery) -> Optional[str]:
+        items = []
+        for item in query.select_items:
+            if item.is_star:
+                items.append("all columns" if item.expr == '*' else f"all columns of {item.expr[:-2]}")
+                continue
+            description = self._operand(item.expr)
+            if description is None or LITERAL.fullmatch(item.expr):
+                return None
+            if item.alias:
+                description += f" (as {unquote(item.alias)})"
+            items.append(description)
+        lead = "For each group, returns" if query.group_by else "Returns"
+        if query.distinct:
+            lead += " each distinct combination of"
+        return f"{lead} {self._list(items)}."
+
+    def _ordering(self, query: SelectQuery) -> Optional[str]:
+        if not query.order_by:
+            return ""
+        keys = []
+        for key in query.order_by:
+            match = re.fullmatch(r'(?P<expr>.+?)(?:\s+(?P<direction>ASC|DESC))?', key, re.IGNORECASE)
+            expression = None if POSITION.fullmatch(match["expr"]) else self._operand(match["expr"])
+            if expression is None:
+                return None
+            descending = (match["direction"] or "").upper() == "DESC"
+            keys.append(f"{expression} {'from highest to lowest' if descending else 'from lowest to highest'}")
+        return f"Sorts the results by {self._list(keys)}."
+
+    def _limit(self, query: SelectQuery) -> Optional[str]:
+        limit = query.limit or query.top
+        if not limit and not query.offset:
+            return ""
+        if (limit and not limit.isdigit()) or (query.offset and not query.offset.isdigit()):
+            return None
+        step = f"Returns only the first {limit} rows" if limit else "Returns the rows"
+        if query.offset and query.offset != "0":
+            step += f", after skipping the first {query.offset}"
+        return step + "."
+
+    def _condition(self, condition: str) -> Optional[str]:
+        condition = condition.strip()
+        if condition.startswith('(') and condition.endswith(')') and condition.count('(') == 1:
+            condition = condition[1:-1].strip()
+        alternatives = re.split(r'\s+OR\s+', condition, flags=re.IGNORECASE)
+        if len(alternatives) > 1:
+            # Only plain alternatives: no grouping inside, no AND binding some of them
+            if '(' in condition or re.search(r'\bAND\b', condition, re.IGNORECASE):
+                return None
+            parts = [self._condition(part) for part in alternatives]
+            return None if any(p is None for p in parts) else " or ".join(parts)
+        if re.match(r'NOT\b', condition, re.IGNORECASE):
+            return None
+
+        match = IS_NULL.fullmatch(condition)
+        if match:
+            left = self._operand(match["left"])
+            return left and f"{left} {'has a value' if match['negated'] else 'is empty'}"
+        match = BETWEEN.fullmatch(condition)
+        if match:
+            left, low, high = (self._operand(match[part]) for part in ("left", "low", "high"))
+            if None in (left, low, high):
+                return None
+            return f"{left} is {'not ' if match['negated'] else ''}between {low} and {high}"
+        match = IN_LIST.fullmatch(condition)
+        if match:
+            left = self._operand(match["left"])
+            values = [self._operand(value) for value in match["values"].split(',')]
+            if left is None or None in values:
+                return None
+            return f"{left} is {'not ' if match['negated'] else ''}one of {self._list(values, 'or')}"
+        match = LIKE.fullmatch(condition)
+        if match:
+            left = self._operand(match["left"])
+            verb = "does not match" if match["negated"] else "matches"
+            return left and f"{left} {verb} the pattern {match['pattern']}"
+
+        match = COMPARISON.fullmatch(condition)
+        if not match:
+            return None
+        left, right = self._operand(match["left"]), self._operand(match["right"])
+        if left is None or right is None:
+            return None
+        return f"{left} {COMPARISONS[match['operator']]} {right}"
+
+    def _operand(self, expression: str) -> Optional[str]:
+        """A column, literal or aggregate call in words; None for anything more involved"""
+        expression = expression.strip()
+        if LITERAL.fullmatch(expression):
+            return expression
+        if IDENTIFIER.fullmatch(expression) and not expression[0].isdigit():
+            return '.'.join(unquote(part) for part in expression.split('.'))
+        match = AGGREGATE_CALL.fullmatch(expression)
+        if match:
+            argument = match["argument"]
+            function = match["function"].upper()
+            if argument == '*' and function == 'COUNT':
+                return "the number of rows"
+            described = self._operand(argument)
+            if described is None:
+                return None
+            distinct = "distinct " if match["distinct"] else ""
+            if function == 'COUNT':
+                return f"the number of {distinct}{described} values"
+            return f"{AGGREGATES[function]} {distinct}{described}"
+        return None
+
+    def _table(self, table) -> str:
+        name = table.name or table.source
+        return f"{name} (as {table.alias})" if table.alias and table.alias != name else name
+
+    def _list(self, items: List[str], conjunction: str = "and") -> str:
+        if len(items) <= 1:
+            return "".join(items)
+        return f"{', '.join(items[:-1])} {conjunction} {items[-1]}"
@@ -0,0 +1,202 @@
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+from utils.number_words import NUMBER_WORDS
+from utils.sql_ast import quote_identifier
+from utils.sql_ir import parse_sql
+
+logger = logging.getLogger(__name__)
+
+# Words of a column type (int4 -> int, "double precision" -> double): point and interval are not numbers
+NUMERIC_TYPES = ('int', 'integer', 'tinyint', 'smallint', 'mediumint', 'bigint', 'serial', 'smallserial',
+                 'bigserial', 'dec', 'decimal', 'numeric', 'number', 'float', 'double', 'real', 'money', 'smallmoney')
+TEMPORAL_TYPES = ('date', 'time', 'timetz', 'datetime', 'smalldatetime', 'datetimeoffset', 'timestamp', 'timestamptz')
+AGGREGATE_FUNCTIONS = {
+    'average': 'AVG', 'avg': 'AVG', 'mean': 'AVG',
+    'total': 'SUM', 'sum': 'SUM', 'sum of': 'SUM',
+    'maximum': 'MAX', 'max': 'MAX', 'highest': 'MAX',
+    'minimum': 'MIN', 'min': 'MIN', 'lowest': 'MIN'
+}
+# A filter value containing one of these is a comparison the list template cannot express
+NON_EQUALITY_WORDS = {
+    'not', 'null', 'empty', 'greater', 'less', 'more', 'fewer', 'than', 'above', 'below', 'over', 'under',
+    'between', 'like', 'before', 'after', 'since', 'contains', 'starting', 'ending', 'and', 'or'
+}
+
+COUNT_PATTERN = re.compile(
+    r"(?:how many|count(?: the| all)?|(?:what is |what's )?the (?:number|count) of|number of) "
+    r"(?P<table>[\w ]+?)(?: are there| do we have| exist| are in the database| in total)?",
+    re.IGNORECASE
+)
+TOP_N_PATTERN = re.compile(
+    r"(?:(?:show|list|get|find|give) (?:me )?|what are |which are )?(?:the )?"
+    r"(?P<direction>top|highest|bottom|lowest) (?P<n>\d+|[a-z]+) (?P<table>[\w ]+?) "
+    r"(?:by|based on|ranked by|sorted by) (?P<column>[\w ]+?)",
+    re.IGNORECASE
+)
+AGGREGATE_PATTERN = re.compile(
+    r"(?:(?:what is|what's|show|get|find|give me|calculate|compute) )?(?:the )?"
+    r"(?P<function>average|avg|mean|total|sum of|sum|maximum|max|highest|minimum|min|lowest) (?:of )?"
+    r"(?P<column>[\w ]+?) (?:per|by|for each|in each|grouped by) (?P<group>[\w ]+?)",
+    re.IGNORECASE
+)
+LIST_PATTERN = re.compile(
+    r"(?:list|show|get|find|display|give me)(?: me)?(?: all)?(?: the)? (?P<table>[\w ]+?)"
+    r"(?: (?:where|with|whose) (?P<column>[\w ]+?) (?:=|is|equals|is equal to) "
+    r"(?P<value>\"[^\"]*\"|'[^']*'|[\w.@-]+(?: [\w.@-]+)*))?",
+    re.IGNORECASE
+)
+
+
+def _key(name: str) -> str:
+    """Compare names ignoring case, separators and a plural ending: "Order Items" == order_item"""
+    key = re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+    if key.endswith('ies'):
+        return key[:-3] + 'y'
+    if key.endswith('s') and not key.endswith('ss'):
+        return key[:-1]
+    return key
+
+
+def _resolve(phrase: str, names: List[str]) -> Optional[str]:
+    """The one name the phrase refers to, or None when there is none or it is ambiguous"""
+    phrase = re.sub(r'^(?:the|all|our|every) ', '', phrase.strip().lower())
+    matches = [name for name in names if _key(name) == _key(phrase)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def _has_type(column: Dict[str, Any], types) -> bool:
+    return any(word in types for word in re.findall(r'[a-z]+', (column.get("type") or "").lower()))
+
+
+class SQLTemplateEngine:
+    """
+    Deterministic fast path for the most common question shapes:
+    - how many X
+    - top N X by Z
+    - average (total, max, min) Z per Y
+    - list X [where column is value]
+    A template answers only when the whole question matches its pattern and every
+    table and column in it resolves to exactly one name in the schema; anything
+    else falls through to the model. Identifiers are quoted and row limits written
+    in the dialect's syntax (TOP n on SQL Server).
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.by_template: Dict[str, int] = {}
+        self._templates = [
+            ("count", COUNT_PATTERN, self._count),
+            ("top_n", TOP_N_PATTERN, self._top_n),
+            ("aggregate", AGGREGATE_PATTERN, self._aggregate),
+            ("list", LIST_PATTERN, self._list),
+        ]
+
+    def match(self, question: str, analysis: Dict, dialect: Optional[str] = None) -> Optional[Dict[str, str]]:
+        """{"template", "sql"} when a template answers the question with confidence, else None"""
+        text = re.sub(r'\s+', ' ', question).strip().rstrip('?.!').strip()
+        for name, pattern, build in self._templates:
+            match = pattern.fullmatch(text)
+            sql = build(match, analysis, dialect) if match else None
+            if sql:
+                self.hits += 1
+                self.by_template[name] = self.by_template.get(name, 0) + 1
+                logger.info(f"⚡ Answered by the {name} template")
+                return {"template": name, "sql": sql}
+        self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "by_template": dict(self.by_template)
+        }
+
+    def _table(self, phrase: str, analysis: Dict) -> Optional[Dict[str, Any]]:
+        name = _resolve(phrase, [t["name"] for t in analysis["tables"]])
+        return next((t for t in analysis["tables"] if t["name"] == name), None) if name else None
+
+    def _column(self, phrase: str, table: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        name = _resolve(phrase, [c["name"] for c in table["columns"]])
+        return next((c for c in table["columns"] if c["name"] == name), None) if name else None
+
+    def _count(self, match: re.Match, analysis: Dict, dialect: Optional[str]) -> Optional[str]:
+        table = self._table(match["table"], analysis)
+        if not table:
+            return None
+        return f"SELECT COUNT(*) AS count FROM {quote_identifier(table['name'], dialect)};"
+
+    def _top_n(self, match: re.Match, analysis: Dict, dialect: Optional[str]) -> Optional[str]:
+        n = match["n"] if match["n"].isdigit() else NUMBER_WORDS.get(match["n"].lower())
+        table = self._table(match["table"], analysis)
+        if not n or not table:
+            return None
+        column = self._column(match["column"], table)
+        if not column or not _has_type(column, NUMERIC_TYPES + TEMPORAL_TYPES):
+            return None
+        order = "DESC" if match["direction"].lower() in ("top", "highest") else "ASC"
+        sql = (f"SELECT * FROM {quote_identifier(table['name'], dialect)} "
+               f"ORDER BY {quote_identifier(column['name'], dialect)} {order}")
+        return parse_sql(sql).with_limit(int(n), dialect) + ";"
+
+    def _aggregate(self, match: re.Match, analysis: Dict, dialect: Optional[str]) -> Optional[str]:
+        function = AGGREGATE_FUNCTIONS[match["function"].lower()]
+        # The measured column decides the table, so it has to exist in exactly one
+        owners = [(t, self._column(match["column"], t)) for t in analysis["tables"]]
+        owners = [(t, c) for t, c in owners if c]
+        if len(owners) != 1:
+            return None
+        table, column = owners[0]
+        allowed = NUMERIC_TYPES if function in ("AVG", "SUM") else NUMERIC_TYPES + TEMPORAL_TYPES
+        if not _has_type(column, allowed):
+            return None
+        alias = quote_identifier(f"{function.lower()}_{column['name']}", dialect)
+        table_name, column_name = quote_identifier(table["name"], dialect), quote_identifier(column["name"], dialect)
+
+        group = self._column(match["group"], table)
+        if group and group is not column:
+            group_name = quote_identifier(group["name"], dialect)
+            return (f"SELECT {group_name}, {function}({column_name}) AS {alias} FROM {table_name} "
+                    f"GROUP BY {group_name} ORDER BY {alias} DESC;")
+
+        # "per department" can also mean a related table, labelled by its name column
+        other = self._table(match["group"], analysis)
+        if not other or other is table:
+            return None
+        links = [r for r in analysis["relationships"] if r["from_table"] == table["name"] and r["to_table"] == other["name"]]
+        labels = analysis["names"].get(other["name"]) or analysis["dimensions"].get(other["name"])
+        if len(links) != 1 or not labels:
+            return None
+        other_name = quote_identifier(other["name"], dialect)
+        link, label = links[0], f"{other_name}.{quote_identifier(labels[0], dialect)}"
+        return (f"SELECT {label}, {function}({table_name}.{column_name}) AS {alias} FROM {table_name} "
+                f"JOIN {other_name} ON {table_name}.{quote_identifier(link['from_column'], dialect)} = "
+                f"{other_name}.{quote_identifier(link['to_column'], dialect)} "
+                f"GROUP BY {label} ORDER BY {alias} DESC;")
+
+    def _list(self, match: re.Match, analysis: Dict, dialect: Optional[str]) -> Optional[str]:
+        table = self._table(match["table"], analysis)
+        if not table:
+            return None
+        table_name = quote_identifier(table["name"], dialect)
+        if not match["column"]:
+            return f"SELECT * FROM {table_name};"
+
+        column = self._column(match["column"], table)
+        value = match["value"]
+        quoted = value[0] in "'\""
+        value = value[1:-1] if quoted else value
+        if not column or (not quoted and set(value.lower().split()) & NON_EQUALITY_WORDS):
+            return None
+        if _has_type(column, NUMERIC_TYPES):
+            if not re.fullmatch(r'-?\d+(?:\.\d+)?', value):
+                return None
+            literal = value
+        else:
+            literal = "'" + value.replace("'", "''") + "'"
+        return f"SELECT * FROM {table_name} WHERE {quote_identifier(column['name'], dialect)} = {literal};"
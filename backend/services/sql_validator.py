@@ -0,0 +1,228 @@
+import difflib
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlparse import tokens as T
+
+from services.intent_lexicon import SchemaIndex
+from utils.sql_ast import SelectQuery, is_identifier, parse_select, split_conjuncts, tokenize, unquote
+from utils.sql_ir import parse_sql
+
+logger = logging.getLogger(__name__)
+
+IDENTIFIER = r'(?:[\w$]+|"[^"]+"|`[^`]+`|\[[^\]]+\])(?:\.(?:[\w$]+|"[^"]+"|`[^`]+`|\[[^\]]+\]))?'
+STRING = r"'(?:[^']|'')*'"
+NUMBER = r"-?\d+(?:\.\d+)?"
+OPERATOR = r"(?:=|<>|!=|<=|>=|<|>)"
+COMPARISON = re.compile(
+    rf"(?P<column>{IDENTIFIER})\s*{OPERATOR}\s*(?P<literal>{STRING}|{NUMBER})"
+    rf"|(?P<literal_first>{STRING}|{NUMBER})\s*{OPERATOR}\s*(?P<column_last>{IDENTIFIER})"
+)
+NUMERIC_AGGREGATE = re.compile(rf"\b(?P<function>SUM|AVG)\s*\(\s*(?:DISTINCT\s+)?(?P<column>{IDENTIFIER})\s*\)",
+                               re.IGNORECASE)
+# The type's leading word: "interval" or "point" must not count as numeric
+NUMERIC_TYPE = re.compile(r'(?:(?:tiny|small|medium|big)?(?:int|serial)\d*|integer|dec|decimal|numeric|float\d*'
+                          r'|double|real|(?:small)?money|number)\b')
+
+# One source of a query: (name other clauses refer to it by, table name, alias, its columns
+# by lower-case name, or None when they are unknown, e.g. a derived table selecting *)
+Source = Tuple[str, Optional[str], Optional[str], Optional[Dict[str, Dict[str, Any]]]]
+
+
+def _suggest(name: str, candidates: List[str]) -> str:
+    by_key = {c.lower(): c for c in candidates}
+    match = difflib.get_close_matches(name.lower(), list(by_key), n=1, cutoff=0.75)
+    return f' (did you mean "{by_key[match[0]]}"?)' if match else ""
+
+
+def _split_identifier(identifier: str) -> Tuple[Optional[str], str]:
+    parts = [unquote(part) for part in re.findall(r'"[^"]+"|`[^`]+`|\[[^\]]+\]|[\w$]+', identifier)]
+    return (parts[0], parts[1]) if len(parts) == 2 else (None, parts[0])
+
+
+class SchemaValidator:
+    """
+    Checks generated SQL against the schema analysis without touching the database:
+    every table, alias and column reference has to resolve (CTEs, derived tables and
+    correlated subqueries included) and bare columns must not be ambiguous; numeric
+    columns must not be compared with text and SUM/AVG need numbers. The errors are
+    worded to be handed back to the model. What it cannot parse (set operations, ...)
+    passes: only what is certainly wrong is reported.
+    """
+
+    def validate(self, sql: str, analysis: Dict) -> List[str]:
+        query = parse_sql(sql).select
+        if query is None:
+            return []
+        errors: List[str] = []
+        self._check_query(query, analysis.get("index") or SchemaIndex(analysis), [], {}, errors)
+        return list(dict.fromkeys(errors))
+
+    def _check_query(self, query: SelectQuery, index: SchemaIndex, outer: List[List[Source]],
+                     ctes: Dict[str, Optional[Dict[str, Dict[str, Any]]]], errors: List[str]) -> None:
+        """Check one SELECT; outer holds the sources of enclosing queries, innermost first"""
+        ctes = dict(ctes)
+        for name, body in query.ctes:
+            # A recursive CTE refers to itself before its columns are known
+            ctes[name.lower()] = None
+            sub = parse_select(body)
+            if sub is not None:
+                self._check_query(sub, index, outer, ctes, errors)
+                ctes[name.lower()] = self._output_columns(sub)
+
+        sources: List[Source] = []
+        using = set()
+        for table in query.tables:
+            columns = None
+            if table.subquery is not None:
+                self._check_query(table.subquery, index, outer, ctes, errors)
+                columns = self._output_columns(table.subquery)
+            elif table.name and '(' not in table.source:
+                key = table.name.lower()
+                if key in ctes:
+                    columns = ctes[key]
+                elif key in index.table_columns:
+                    columns = index.table_columns[key][1]
+                else:
+                    known = [t["name"] for t, _ in index.table_columns.values()] + list(ctes)
+                    errors.append(f'table "{table.name}" does not exist{_suggest(table.name, known)}')
+            sources.append((table.reference.lower(), table.name, table.alias, columns))
+            if table.condition and table.condition.upper().startswith('USING'):
+                using |= {c.lower() for c in re.findall(r'[\w$]+', table.condition[5:])}
+
+        levels = [sources] + outer
+        aliases = {item.alias.lower() for item in query.select_items if item.alias}
+        conditions = [query.where, query.having] + [
+            re.sub(r'^ON\s+', '', t.condition, flags=re.IGNORECASE) for t in query.tables
+            if t.condition and not t.condition.upper().startswith('USING')
+        ]
+        expressions = [item.expr for item in query.select_items] + query.group_by + query.order_by
+        expressions = [e for e in expressions + conditions if e]
+
+        for expression in expressions:
+            references, subqueries = self._references(expression)
+            for sub in subqueries:
+                self._check_query(sub, index, levels, ctes, errors)
+            for qualifier, column in references:
+                if qualifier is None and column.lower() in aliases:
+                    continue
+                self._resolve(qualifier, column, levels, using, errors)
+
+        self._check_types([c for c in conditions if c], expressions, levels, using, errors)
+
+    def _check_types(self, conditions: List[str], expressions: List[str], levels: List[List[Source]],
+                     using: set, errors: List[str]) -> None:
+        for condition in conditions:
+            for conjunct in split_conjuncts(condition):
+                match = COMPARISON.fullmatch(conjunct.strip())
+                if not match:
+                    continue
+                identifier = match["column"] or match["column_last"]
+                literal = match["literal"] or match["literal_first"]
+                column = self._resolve(*_split_identifier(identifier), levels, using, [])
+                if (column and NUMERIC_TYPE.match((column.get("type") or "").lower())
+                        and literal.startswith("'") and not re.fullmatch(NUMBER, literal[1:-1].strip())):
+                    errors.append(f'{identifier} is numeric ({column["type"]}) but is compared with the text {literal}')
+
+        for expression in expressions:
+            for match in NUMERIC_AGGREGATE.finditer(expression):
+                column = self._resolve(*_split_identifier(match["column"]), levels, using, [])
+                column_type = (column.get("type") or "") if column else ""
+                if column_type and not NUMERIC_TYPE.match(column_type.lower()):
+                    errors.append(f'{match["function"].upper()}({match["column"]}) needs a numeric column, '
+                                  f'but {match["column"]} is {column_type}')
+
+    def _references(self, expression: str) -> Tuple[List[Tuple[Optional[str], str]], List[SelectQuery]]:
+        """(qualifier, column) references outside subqueries, and the subqueries themselves"""
+        tokens = [t for t in tokenize(expression, cache=False) if not t.is_whitespace]
+        references, subqueries = [], []
+        position = 0
+        while position < len(tokens):
+            token = tokens[position]
+            previous = tokens[position - 1] if position else None
+            following = tokens[position + 1] if position + 1 < len(tokens) else None
+            after = tokens[position + 2] if position + 2 < len(tokens) else None
+
+            if token.match(T.Punctuation, '(') and following is not None and following.match(T.Keyword.DML, 'SELECT'):
+                depth, end = 0, position
+                for end in range(position, len(tokens)):
+                    if tokens[end].match(T.Punctuation, '('):
+                        depth += 1
+                    elif tokens[end].match(T.Punctuation, ')'):
+                        depth -= 1
+                        if depth == 0:
+                            break
+                sub = parse_select(' '.join(t.value for t in tokens[position + 1:end]))
+                if sub is not None:
+                    subqueries.append(sub)
+                position = end + 1
+                continue
+
+            if is_identifier(token):
+                if following is not None and following.match(T.Punctuation, '('):
+                    position += 1  # a function call
+                    continue
+                if following is not None and following.match(T.Punctuation, '.') and after is not None:
+                    if after.value == "*" or is_identifier(after) or after.is_keyword:
+                        references.append((unquote(token.value), unquote(after.value)))
+                    position += 3
+                    continue
+                # Built-in names (INTERVAL, int, ...) and the types of casts are not columns
+                is_type = previous is not None and (previous.match(T.Keyword, 'AS') or previous.match(T.Punctuation, '::'))
+                if token.ttype not in T.Name.Builtin and not is_type:
+                    references.append((None, unquote(token.value)))
+            position += 1
+        return references, subqueries
+
+    def _resolve(self, qualifier: Optional[str], column: str, levels: List[List[Source]], using: set,
+                 errors: List[str]) -> Optional[Dict[str, Any]]:
+        """The column's schema entry, or None; a reference that is certainly wrong adds an error"""
+        if qualifier is not None:
+            key = qualifier.lower()
+            source = next((s for level in levels for s in level if s[0] == key), None)
+            if source is None:
+                aliased = next((s for level in levels for s in level if s[2] and (s[1] or "").lower() == key), None)
+                if aliased:
+                    errors.append(f'table "{aliased[1]}" is aliased as "{aliased[2]}": write {aliased[2]}.{column}')
+                else:
+                    references = [s[0] for level in levels for s in level]
+                    errors.append(f'unknown table or alias "{qualifier}" in {qualifier}.{column}'
+                                  f'{_suggest(qualifier, references)}')
+                return None
+            columns = source[3]
+            if columns is None or column == '*':
+                return None
+            if column.lower() not in columns:
+                names = [c["name"] for c in columns.values()]
+                errors.append(f'column "{column}" does not exist in {source[1] or source[0]}{_suggest(column, names)}')
+                return None
+            return columns[column.lower()]
+
+        # A bare name belongs to the innermost query that has it
+        for level in levels:
+            if any(source[3] is None for source in level):
+                # A source with unknown columns could be the one providing it
+                return None
+            owners = [source for source in level if column.lower() in source[3]]
+            if len(owners) > 1 and column.lower() not in using:
+                alternatives = " or ".join(f"{source[0]}.{column}" for source in owners)
+                errors.append(f'column "{column}" is ambiguous: write {alternatives}')
+                return None
+            if owners:
+                return owners[0][3][column.lower()]
+
+        sources = [source for level in levels for source in level]
+        names = ", ".join(source[1] or source[0] for source in sources) or "the query"
+        known = [c["name"] for source in sources for c in source[3].values()]
+        errors.append(f'column "{column}" does not exist in {names}{_suggest(column, known)}')
+        return None
+
+    def _output_columns(self, query: SelectQuery) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Columns a subquery or CTE returns; None when it selects *"""
+        columns = {}
+        for item in query.select_items:
+            if item.is_star:
+                return None
+            columns[item.output_name.lower()] = {"name": item.output_name, "type": ""}
+        return columns
@@ -0,0 +1,77 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from services.approximate_query import ApproximateQueryEngine
+
+SQL = "SELECT department_id, COUNT(*) AS n, AVG(salary) AS avg_salary FROM employees GROUP BY department_id LIMIT 2"
+
+
+def engine(db_type, execute=None):
+    return ApproximateQueryEngine(execute, db_type, min_rows=0)
+
+
+def test_postgresql_samples_rows_not_pages():
+    plan = engine("postgresql").plan(SQL)
+    assert "TABLESAMPLE BERNOULLI (1.0)" in engine("postgresql").build_sample_sql(plan, 1.0)
+
+
+def test_sqlserver_limit_becomes_top():
+    plan = engine("sqlserver").plan(SQL)
+    sample_sql = engine("sqlserver").build_sample_sql(plan, 1.0)
+    assert sample_sql.startswith("SELECT TOP 2 ")
+    assert "LIMIT" not in sample_sql and "TABLESAMPLE" not in sample_sql
+
+
+@pytest.mark.parametrize("sql", [SQL + " OFFSET 1", SQL.replace("LIMIT 2", "LIMIT ?")])
+def test_limit_beyond_a_plain_number_is_not_sampled(sql):
+    assert not engine("postgresql").plan(sql)["eligible"]
+
+
+def test_unsupported_dialect_is_not_eligible():
+    plan = engine("oracle").plan(SQL)
+    assert not plan["eligible"] and "oracle" in plan["reason"]
+
+
+def sqlite_execute():
+    connection = sqlite3.connect(":memory:")
+    connection.row_factory = sqlite3.Row
+    connection.execute("CREATE TABLE employees (id INTEGER PRIMARY KEY, salary INTEGER, department_id INTEGER)")
+    connection.executemany("INSERT INTO employees VALUES (?, ?, ?)",
+                           [(i, 1000 + i % 500, i % 3) for i in range(1, 20001)])
+
+    async def execute(sql, limit=None):
+        return [dict(row) for row in connection.execute(sql).fetchall()]
+    return execute
+
+
+def test_sqlite_estimate_runs():
+    sqlite_engine = engine("sqlite", sqlite_execute())
+    estimate = asyncio.run(sqlite_engine.estimate(sqlite_engine.plan(SQL), 50.0))
+    assert len(estimate["results"]) == 2
+    for row, bounds in zip(estimate["results"], estimate["bounds"]):
+        assert bounds["n"]["low"] <= row["n"] <= bounds["n"]["high"]
+        assert 1000 <= row["avg_salary"] <= 1500
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT department_id, COUNT(*), AVG(salary) FROM employees GROUP BY department_id",
+    'SELECT department_id, count(*) AS "Head Count", SUM(salary) AS "order" FROM employees GROUP BY department_id',
+])
+def test_estimates_and_exact_result_share_column_names(sql):
+    sqlite_engine = engine("sqlite", sqlite_execute())
+
+    async def run():
+        return [stage async for stage in sqlite_engine.progressive(sql, sample_percents=[50.0])]
+
+    estimate, exact = asyncio.run(run())
+    assert exact["stage"] == "exact"
+    assert set(estimate["results"][0]) == set(exact["results"][0]) == set(estimate["bounds"][0]) | {"department_id"}
+
+
+def test_unaliased_aggregates_are_named_by_their_text_in_every_dialect():
+    # Otherwise PostgreSQL names the exact column "count" and SQL Server leaves it unnamed
+    plan = engine("postgresql").plan("SELECT department_id, COUNT(*), avg(salary) FROM employees GROUP BY department_id")
+    assert plan["sql"] == ('SELECT department_id, COUNT(*) AS "COUNT(*)", avg(salary) AS "avg(salary)" '
+                           'FROM employees GROUP BY department_id')
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from utils import deadline as deadline_module
+from utils.deadline import Deadline
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(deadline_module.time, "monotonic", clock)
+    return clock
+
+
+@pytest.mark.parametrize("budget_ms, header, expected", [
+    (None, None, None),
+    (2000, None, 2.0),
+    (None, "1500", 1.5),
+    (2000, "1500", 1.5),
+    (1000, "1500", 1.0),
+    (2000, "soon", 2.0),
+    (2000, "-5", 2.0),
+    (None, "inf", None),
+])
+def test_tighter_of_field_and_header(budget_ms, header, expected):
+    assert Deadline.from_request(budget_ms, header).budget == expected
+
+
+def test_stage_keeps_what_later_stages_are_guaranteed(clock):
+    deadline = Deadline(1000)
+    # Schema may take everything but the 85% reserved for lookup, generation and execution
+    assert deadline.stage_timeout("schema") == pytest.approx(0.15)
+    assert deadline.stage_timeout("generation") == pytest.approx(0.75)
+    # Time an earlier stage left unused goes to the next one
+    clock.now += 0.05
+    assert deadline.stage_timeout("lookup") == pytest.approx(0.20)
+    clock.now += 2
+    assert deadline.remaining() == 0.0 and deadline.stage_timeout("execution") == 0.0
+
+
+def test_no_budget_never_times_out():
+    deadline = Deadline()
+    assert not deadline.enabled and deadline.stage_timeout("generation") is None
+
+    async def slow():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    assert asyncio.run(deadline.within("generation", slow())) == "done"
+
+
+def test_stage_over_its_time_is_cancelled():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        deadline = Deadline(100)
+        with pytest.raises(asyncio.TimeoutError):
+            await deadline.within("execution", slow())
+        deadline.degrade("skipped_execution")
+        return deadline
+
+    assert asyncio.run(run()).degradations == ["skipped_execution"]
+    assert cancelled == [True]
+
+
+def test_detached_stage_finishes_in_the_background():
+    finished = []
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        finished.append(True)
+
+    async def run():
+        deadline = Deadline(10)
+        with pytest.raises(asyncio.TimeoutError):
+            await deadline.within("schema", fetch(), detach=True)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert finished == [True]
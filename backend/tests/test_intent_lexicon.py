@@ -0,0 +1,64 @@
+import json
+
+from services.intent_lexicon import DEFAULT_LEXICON, IntentLexicon, SchemaIndex, load_lexicon
+from services.sql_generator import SQLGenerator
+
+
+def test_multi_word_terms_and_plurals_match():
+    found = IntentLexicon(DEFAULT_LEXICON).scan("How many orders, and the averages per region?")
+    assert found["aggregation"] == {"COUNT", "AVG"}
+    assert "grouping" in found
+
+
+def test_terms_match_whole_words_only():
+    found = IntentLexicon(DEFAULT_LEXICON).scan("discounted maximizers")
+    assert "aggregation" not in found
+
+
+def test_first_value_in_lexicon_order_wins():
+    lexicon = IntentLexicon(DEFAULT_LEXICON)
+    assert lexicon.first(lexicon.scan("count the total revenue"), "aggregation") == "SUM"
+    assert lexicon.first(lexicon.scan("list customers"), "aggregation") is None
+
+
+def test_custom_terms_extend_the_defaults(tmp_path):
+    path = tmp_path / "lexicon.json"
+    path.write_text(json.dumps({
+        "aggregation": {"COUNT": ["tally"]},
+        "domains": {"revenue": {"terms": ["turnover"], "tables": ["sale"], "columns": ["amount"]}},
+    }))
+    lexicon = IntentLexicon(load_lexicon(str(path)))
+    found = lexicon.scan("tally of turnover")
+    assert found["aggregation"] == {"COUNT"} and found["domains"] == {"revenue"}
+    assert lexicon.scan("how many")["aggregation"] == {"COUNT"}
+    assert "tally" not in DEFAULT_LEXICON["aggregation"]["COUNT"]
+
+
+def test_unreadable_lexicon_falls_back_to_the_defaults(tmp_path):
+    path = tmp_path / "lexicon.json"
+    path.write_text("{not json")
+    assert load_lexicon(str(path)) == DEFAULT_LEXICON
+
+
+def index():
+    analysis = SQLGenerator(client=object())._analyze_schema([
+        {"name": "order_items", "columns": [{"name": "id", "type": "integer", "isPrimary": True},
+                                            {"name": "unit_price", "type": "numeric"}]},
+        {"name": "orders", "columns": [{"name": "id", "type": "integer", "isPrimary": True},
+                                       {"name": "order_date", "type": "date"}]},
+        {"name": "categories", "columns": [{"name": "id", "type": "integer", "isPrimary": True}]},
+    ])
+    return SchemaIndex(analysis)
+
+
+def test_whole_table_names_come_before_shared_words():
+    assert index().find_tables(["order"]) == ["orders", "order_items"]
+    assert index().find_tables(["category"]) == ["categories"]
+    assert index().find_tables(["customer"]) == []
+
+
+def test_columns_are_found_by_name_or_word():
+    schema_index = index()
+    assert schema_index.find_columns(["prices"]) == {("order_items", "unit_price")}
+    assert schema_index.find_columns(["order_date"]) == {("orders", "order_date")}
+    assert schema_index.table_columns["orders"][1]["order_date"]["type"] == "date"
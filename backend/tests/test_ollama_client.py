@@ -0,0 +1,146 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services import ollama_client
+from services.ollama_client import (
+    OllamaPool, OllamaProbe, close_shared_ollama_client, create_ollama_client, model_names, shared_ollama_client
+)
+from services.sql_explainer import SQLExplainer
+from services.sql_generator import SQLGenerator
+
+
+def test_client_has_connect_and_read_timeouts():
+    client = create_ollama_client("http://ollama:11434")
+    timeout = client._client.timeout
+    assert timeout.connect == ollama_client.OLLAMA_CONNECT_TIMEOUT
+    assert timeout.read == ollama_client.OLLAMA_TIMEOUT
+    assert str(client._client.base_url).startswith("http://ollama:11434")
+
+
+@pytest.mark.parametrize("response", [
+    {"models": [{"name": "sqlcoder:latest"}, {"model": "nomic-embed-text"}]},
+    SimpleNamespace(models=[SimpleNamespace(model="sqlcoder:latest"), SimpleNamespace(model="nomic-embed-text")]),
+])
+def test_model_names_from_either_response_format(response):
+    assert model_names(response) == ["sqlcoder:latest", "nomic-embed-text"]
+
+
+def test_services_share_the_process_client():
+    async def run():
+        client = shared_ollama_client()
+        try:
+            assert shared_ollama_client() is client
+            assert SQLGenerator(client=client).client is SQLExplainer(client=client).client is client
+        finally:
+            await close_shared_ollama_client()
+        # Closed at shutdown: the next use gets a fresh pool
+        reopened = shared_ollama_client()
+        await close_shared_ollama_client()
+        return client, reopened
+
+    client, reopened = asyncio.run(run())
+    assert reopened is not client
+
+
+class FakeModels:
+    def __init__(self, models):
+        self.models = models
+
+    async def list(self):
+        return {"models": [{"name": name} for name in self.models]}
+
+
+def test_missing_model_is_reported_not_raised():
+    # FakeModels has no generate(): initializing must not send a generation
+    asyncio.run(SQLGenerator(client=FakeModels(["other:latest"])).initialize())
+
+
+def test_initialize_reports_an_unreachable_server():
+    class Unreachable:
+        async def list(self):
+            raise ConnectionError("refused")
+
+    with pytest.raises(Exception, match="Cannot initialize Ollama client"):
+        asyncio.run(SQLGenerator(client=Unreachable()).initialize())
+
+
+class FakeServer:
+    """Ollama server stand-in for the readiness probe"""
+
+    def __init__(self, models=("sqlcoder:latest",), up=True):
+        self.models = list(models)
+        self.up = up
+        self.generations = []
+
+    async def list(self):
+        if not self.up:
+            raise ConnectionError("refused")
+        return {"models": [{"name": name} for name in self.models]}
+
+    async def generate(self, **kwargs):
+        if not self.up:
+            raise ConnectionError("refused")
+        self.generations.append(kwargs)
+        return {"response": ""}
+
+
+def check(probe, times=1):
+    async def run():
+        return [await probe.check() for _ in range(times)]
+    return asyncio.run(run())
+
+
+def test_probe_warms_the_model_up_once():
+    server = FakeServer()
+    probe = OllamaProbe(server, "sqlcoder:latest", keep_alive="24h")
+    assert probe.state == "starting" and not probe.ready
+    assert check(probe, times=3) == ["ready"] * 3
+    # An empty prompt loads the model and keeps it loaded; later checks only list models
+    assert server.generations == [{"model": "sqlcoder:latest", "prompt": "", "keep_alive": "24h"}]
+    assert probe.status()["warmup_ms"] is not None
+
+
+def test_probe_reports_a_missing_model_then_warms_it_up_once_pulled():
+    server = FakeServer(models=["other:latest"])
+    probe = OllamaProbe(server, "sqlcoder:latest")
+    assert check(probe) == ["model_missing"]
+    server.models.append("sqlcoder:latest")
+    assert check(probe) == ["ready"]
+    assert len(server.generations) == 1
+
+
+def test_probe_warms_up_again_after_an_outage():
+    server = FakeServer()
+    probe = OllamaProbe(server, "sqlcoder:latest")
+    check(probe)
+    server.up = False
+    assert check(probe) == ["unavailable"]
+    assert probe.status()["last_error"] == "refused"
+    server.up = True
+    assert check(probe) == ["ready"]
+    assert len(server.generations) == 2
+
+
+def test_pool_is_ready_once_any_server_is():
+    servers = {}
+
+    def factory(host):
+        servers[host] = FakeServer(up=host == "b")
+        return servers[host]
+
+    async def run():
+        pool = OllamaPool(["a", "b"], client_factory=factory)
+        pool.start("sqlcoder:latest", interval=60)
+        try:
+            for _ in range(100):
+                if pool.ready:
+                    break
+                await asyncio.sleep(0.01)
+            return pool.ready, [endpoint["model"]["state"] for endpoint in pool.status()["endpoints"]]
+        finally:
+            for endpoint in pool.endpoints:
+                await endpoint.probe.stop()
+
+    assert asyncio.run(run()) == (True, ["unavailable", "ready"])
@@ -0,0 +1,215 @@
+import asyncio
+
+import ollama
+import pytest
+
+from services import ollama_client
+from services.ollama_client import OllamaPool
+
+
+class FakeOllama:
+    """
+    Ollama server stand-in: answers with its host name, or raises the queued errors
+    first. A stream fails after `stream_chunks_before_error` chunks when an error is queued.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.errors = []
+        self.stream_chunks_before_error = 0
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+        self.gate = None  # an asyncio.Event holding requests until set
+
+    async def generate(self, **kwargs):
+        self.calls += 1
+        if kwargs.get("stream"):
+            if self.errors and self.stream_chunks_before_error == 0:
+                raise self.errors.pop(0)
+            return self._stream()
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            if self.gate is not None:
+                await self.gate.wait()
+            if self.errors:
+                raise self.errors.pop(0)
+            return {"response": self.host}
+        finally:
+            self.running -= 1
+
+    async def _stream(self):
+        for index in range(3):
+            if self.errors and index == self.stream_chunks_before_error:
+                raise self.errors.pop(0)
+            yield {"response": f"{self.host}-{index}"}
+
+    async def list(self):
+        return {"models": []}
+
+    async def embeddings(self, **kwargs):
+        return {"embedding": [0.0]}
+
+
+def make_pool(hosts, **kwargs):
+    servers = {}
+
+    def factory(host):
+        servers[host] = FakeOllama(host)
+        return servers[host]
+
+    return OllamaPool(hosts, client_factory=factory, **kwargs), servers
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ollama_client.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def first_choice(monkeypatch):
+    """Draws servers in configured order, so the first one is tried first"""
+    monkeypatch.setattr(ollama_client.random, "sample", lambda population, k: population[:k])
+
+
+def generate(pool):
+    return asyncio.run(pool.generate(model="m", prompt="p"))
+
+
+def test_request_fails_over_to_another_server(first_choice):
+    pool, servers = make_pool(["a", "b"])
+    servers["a"].errors = [ConnectionError("refused")]
+    assert generate(pool)["response"] == "b"
+    assert pool.failovers == 1
+    assert [endpoint.errors for endpoint in pool.endpoints] == [1, 0]
+
+
+def test_client_errors_are_not_retried_elsewhere():
+    pool, servers = make_pool(["a", "b"])
+    for server in servers.values():
+        server.errors = [ollama.ResponseError("model not found", 404)]
+    with pytest.raises(ollama.ResponseError):
+        generate(pool)
+    assert pool.failovers == 0
+    assert all(endpoint.failures == 0 for endpoint in pool.endpoints)
+
+
+def test_breaker_opens_then_half_opens_for_one_trial(clock):
+    pool, servers = make_pool(["a"], failure_threshold=2, cooldown=30)
+    endpoint = pool.endpoints[0]
+    servers["a"].errors = [ConnectionError("down"), ConnectionError("down")]
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            generate(pool)
+    assert pool.status()["endpoints"][0]["circuit"] == "open"
+
+    # Open: no request reaches the server until the cooldown is over
+    with pytest.raises(ConnectionError, match="No Ollama server available"):
+        generate(pool)
+    assert servers["a"].calls == 2
+
+    # Half-open: a single trial goes through, concurrent requests are refused meanwhile
+    clock.now += 30
+    servers["a"].gate = asyncio.Event()
+
+    async def trial_and_second():
+        trial = asyncio.create_task(pool.generate(model="m", prompt="p"))
+        await asyncio.sleep(0)
+        assert endpoint.trial
+        with pytest.raises(ConnectionError):
+            await pool.generate(model="m", prompt="p")
+        servers["a"].gate.set()
+        return await trial
+
+    assert asyncio.run(trial_and_second())["response"] == "a"
+    assert pool.status()["endpoints"][0]["circuit"] == "closed"
+    assert endpoint.failures == 0 and not endpoint.trial
+
+
+def test_failed_trial_reopens_the_breaker(clock):
+    pool, servers = make_pool(["a"], failure_threshold=1, cooldown=30)
+    servers["a"].errors = [ConnectionError("down"), ConnectionError("still down")]
+    with pytest.raises(ConnectionError):
+        generate(pool)
+    clock.now += 30
+    with pytest.raises(ConnectionError, match="still down"):
+        generate(pool)
+    # Open again for a full cooldown from the failed trial
+    clock.now += 10
+    with pytest.raises(ConnectionError, match="No Ollama server available"):
+        generate(pool)
+    assert pool.endpoints[0].opened_at == 1030.0
+
+
+def test_open_server_is_skipped_while_others_serve(clock):
+    pool, servers = make_pool(["a", "b"], failure_threshold=1, cooldown=30)
+    pool.endpoints[0].record_failure(ConnectionError("down"), 1)
+    assert [generate(pool)["response"] for _ in range(5)] == ["b"] * 5
+    assert servers["a"].calls == 0
+
+
+def test_less_loaded_of_two_random_choices(monkeypatch):
+    pool, _ = make_pool(["a", "b", "c"], capacity=4)
+    a, b, c = pool.endpoints
+    a.in_flight, b.in_flight, c.in_flight = 3, 0, 2
+    # b is the least loaded overall, but only a and c were drawn
+    monkeypatch.setattr(ollama_client.random, "sample", lambda population, k: [a, c])
+    assert asyncio.run(pool._acquire(set())) is c
+
+
+def test_full_servers_are_not_chosen():
+    pool, _ = make_pool(["a", "b"], capacity=2)
+    a, b = pool.endpoints
+    a.in_flight = 2
+    for _ in range(10):
+        endpoint = asyncio.run(pool._acquire(set()))
+        assert endpoint is b
+        b.in_flight -= 1
+
+
+def test_requests_wait_for_a_free_slot():
+    pool, servers = make_pool(["a"], capacity=1)
+    servers["a"].gate = asyncio.Event()
+
+    async def run():
+        calls = [asyncio.create_task(pool.generate(model="m", prompt=str(i))) for i in range(3)]
+        await asyncio.sleep(0.01)
+        servers["a"].gate.set()
+        return await asyncio.gather(*calls)
+
+    assert [r["response"] for r in asyncio.run(run())] == ["a"] * 3
+    assert servers["a"].max_running == 1
+
+
+def collect(stream):
+    async def run():
+        return [chunk["response"] async for chunk in await stream]
+    return asyncio.run(run())
+
+
+def test_stream_fails_over_before_the_first_chunk(first_choice):
+    pool, servers = make_pool(["a", "b"])
+    servers["a"].errors = [ConnectionError("refused")]
+    assert collect(pool.generate(model="m", prompt="p", stream=True)) == ["b-0", "b-1", "b-2"]
+    assert pool.failovers == 1
+
+
+def test_stream_failure_after_output_is_raised(first_choice):
+    pool, servers = make_pool(["a", "b"])
+    servers["a"].errors = [ConnectionError("reset")]
+    servers["a"].stream_chunks_before_error = 1
+    with pytest.raises(ConnectionError, match="reset"):
+        collect(pool.generate(model="m", prompt="p", stream=True))
+    # The first chunk already went out: retrying on b would repeat it
+    assert pool.failovers == 0 and servers["b"].calls == 0
@@ -0,0 +1,65 @@
+import pytest
+
+from services.prompt_budget import PromptBudget, compact_type, estimate_tokens
+from services.sql_generator import SQLGenerator
+
+
+def table(name, columns, primary="id", foreign=()):
+    return {
+        "name": name,
+        "columns": [{"name": column, "type": "integer", "is_primary": column == primary} for column in columns],
+        "foreign_keys": list(foreign)
+    }
+
+
+def schema(count, width=8):
+    return [table(f"archive_{index}", ["id"] + [f"field_{index}_{c}" for c in range(width)]) for index in range(count)]
+
+
+@pytest.mark.parametrize("data_type, compact", [
+    ("character varying(255)", "varchar(255)"),
+    ("timestamp without time zone", "timestamp"),
+    ("double precision", "double"),
+    ("numeric(10,2)", "dec(10,2)"),
+    ("TEXT", "text"),
+])
+def test_types_are_abbreviated(data_type, compact):
+    assert compact_type(data_type) == compact
+
+
+def test_schema_that_fits_is_kept_whole_in_name_order():
+    tables = [table("orders", ["id", "total"]), table("customers", ["id", "name"])]
+    kept, lines = PromptBudget(num_predict=100).fit_schema(tables, "total of orders", ["orders"], budget=1000)
+    assert [t["name"] for t in kept] == ["customers", "orders"]
+    assert lines == ["customers(id int PK, name int)", "orders(id int PK, total int)"]
+
+
+def test_oversized_schema_keeps_the_tables_the_question_mentions():
+    tables = schema(50) + [table("employees", ["id", "salary", "department_id"], foreign=["department_id"])]
+    budget = 60
+    kept, lines = PromptBudget(num_predict=100).fit_schema(tables, "average salary of employees", [], budget)
+    assert "employees" in [t["name"] for t in kept]
+    assert len(kept) < len(tables)
+    assert sum(estimate_tokens(line + "\n") for line in lines) <= budget
+
+
+def test_wide_relevant_table_keeps_keys_and_mentioned_columns():
+    wide = table("employees", ["id", "salary", "department_id"] + [f"note_{i}" for i in range(40)],
+                 foreign=["department_id"])
+    kept, lines = PromptBudget(num_predict=100).fit_schema([wide], "salary of employees", ["employees"], budget=30)
+    assert lines == ["employees(id int PK, salary int, department_id int, ...)"]
+
+
+def test_generator_prompt_fits_the_context_window():
+    generator = SQLGenerator(client=object())
+    raw = [{"name": f"archive_{index}", "columns": [{"name": "id", "type": "integer", "isPrimary": True}] +
+            [{"name": f"field_{c}", "type": "character varying"} for c in range(12)]} for index in range(300)]
+    raw.append({"name": "employees", "columns": [{"name": "id", "type": "integer", "isPrimary": True},
+                                                  {"name": "salary", "type": "numeric"}]})
+    analysis = generator._analyze_schema(raw)
+    question = "average salary of employees"
+    prompt = generator._build_prompt(question, analysis, generator._analyze_intent(question, analysis))
+    budget = generator.budget
+    assert estimate_tokens(prompt) <= budget.num_ctx - budget.num_predict - budget.margin
+    assert "employees(id int PK, salary dec)" in prompt
+    assert generator.stats["trimmed_prompts"] == 1
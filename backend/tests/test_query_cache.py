@@ -0,0 +1,24 @@
+from services.query_cache import QueryCache
+
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    QueryCache(path=path).put("k", {"sql": "SELECT 1"}, "schema")
+    assert QueryCache(path=path).get("k") == {"sql": "SELECT 1"}
+
+
+def test_invalidate_drops_entries_of_the_old_schema(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = QueryCache(path=path)
+    cache.put("old", "SELECT 1", "v1")
+    cache.put("new", "SELECT 2", "v2")
+    cache.invalidate("v1")
+    assert cache.get("old") is None and cache.get("new") == "SELECT 2"
+    assert QueryCache(path=path).get("old") is None
+
+
+def test_expired_entries_are_misses():
+    cache = QueryCache(path=":memory:", ttl=-1)
+    cache.put("k", "SELECT 1")
+    assert cache.get("k") is None
+    assert cache.stats()["misses"] == 1
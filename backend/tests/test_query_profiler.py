@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+import aiosqlite
+
+from services.query_profiler import QueryProfiler
+
+
+def test_sqlite_profile_counts_rows_without_keeping_them():
+    async def run():
+        async with aiosqlite.connect(":memory:") as connection:
+            await connection.execute("CREATE TABLE t (id INTEGER PRIMARY KEY)")
+            await connection.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(2500)])
+            await connection.commit()
+            return await QueryProfiler(connection, "sqlite").profile("SELECT id FROM t WHERE id % 2 = 0")
+
+    profile = asyncio.run(run())
+    assert profile["plan"]["rows"] == 1250
+    assert profile["plan"]["children"][0]["relation"] == "t"
+
+
+class FakeCursor:
+    """pyodbc cursor: the query's rows, then one STATISTICS PROFILE result set"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.result_sets = []
+        self.description = None
+
+    def execute(self, sql):
+        self.connection.threads.add(threading.get_ident())
+        self.connection.statements.append(sql)
+        if not sql.startswith("SET"):
+            self.result_sets = [
+                ([("id",)], [(1,), (2,)]),
+                ([("Rows",), ("Executes",), ("StmtText",), ("NodeId",), ("Parent",), ("PhysicalOp",)],
+                 [(2, 1, "SELECT id FROM t", 1, 0, "Clustered Index Scan")]),
+            ]
+            self._next()
+        return self
+
+    def _next(self):
+        self.description, self.rows = self.result_sets.pop(0) if self.result_sets else (None, [])
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def nextset(self):
+        if not self.result_sets:
+            return False
+        self._next()
+        return True
+
+
+class FakeConnection:
+    def __init__(self):
+        self.threads = set()
+        self.statements = []
+        self.rolled_back = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.threads.add(threading.get_ident())
+        self.rolled_back = True
+
+
+def test_sqlserver_profile_runs_off_the_event_loop():
+    connection = FakeConnection()
+    profile = asyncio.run(QueryProfiler(connection, "sqlserver").profile("SELECT id FROM t"))
+    assert profile["plan"]["operation"] == "Clustered Index Scan" and profile["plan"]["rows"] == 2
+    assert threading.get_ident() not in connection.threads
+    assert connection.statements == ["SET STATISTICS PROFILE ON", "SELECT id FROM t", "SET STATISTICS PROFILE OFF"]
+    assert connection.rolled_back
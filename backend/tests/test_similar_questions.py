@@ -0,0 +1,68 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from services.similar_questions import SimilarQuestionIndex
+
+
+class FakeEmbeddings:
+    """Embedding model answering with fixed vectors"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    async def embeddings(self, model, prompt):
+        return {"embedding": self.vectors[prompt]}
+
+
+def search(index, stored, question, dialect="postgresql"):
+    async def run():
+        await index.add(stored, "SELECT 1", "schema", "postgresql")
+        return await index.search(question, "schema", dialect)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("stored, question", [
+    ("list orders sorted by order date ascending", "list orders sorted by order date descending"),
+    ("employees in the engineering department with their salary",
+     "employees not in the engineering department with their salary"),
+    ("names and salaries of all employees who were hired in march 2021 ordered by salary",
+     "names and salaries of all employees who were hired in may 2021 ordered by salary"),
+])
+def test_hashed_ngram_matches_are_only_hints(stored, question):
+    # No embedding model: the hashed n-gram fallback scores these pairs above the reuse threshold
+    match = search(SimilarQuestionIndex(client=None), stored, question)
+    assert match is not None and match["similarity"] >= 0.92
+    assert not match["reuse"]
+
+
+def test_embedding_model_rewordings_are_reused():
+    vectors = {"top 5 earners": [1.0, 0.0], "show me the top five earners": [0.99, 0.14]}
+    match = search(SimilarQuestionIndex(client=FakeEmbeddings(vectors)), "top 5 earners", "show me the top five earners")
+    assert match["similarity"] == pytest.approx(np.dot([1.0, 0.0], [0.99, 0.14]) / np.linalg.norm([0.99, 0.14]))
+    assert match["reuse"]
+
+
+@pytest.mark.parametrize("stored, question", [
+    ("top 5 earners", "five highest paid employees"),
+    ("employees in sales", "employees in marketing"),
+    ("orders shipped last month", "orders not shipped last month"),
+])
+def test_embedding_model_paraphrases_with_other_words_are_hints(stored, question):
+    vectors = {stored: [1.0, 0.0], question: [0.99, 0.14]}
+    match = search(SimilarQuestionIndex(client=FakeEmbeddings(vectors)), stored, question)
+    assert match["similarity"] >= 0.92
+    assert not match["reuse"]
+
+
+def test_different_numbers_are_not_reused():
+    vectors = {"top 5 earners": [1.0, 0.0], "top 10 earners": [1.0, 0.01]}
+    match = search(SimilarQuestionIndex(client=FakeEmbeddings(vectors)), "top 5 earners", "top 10 earners")
+    assert not match["reuse"]
+
+
+def test_questions_are_not_matched_across_dialects():
+    vectors = {"top 5 earners": [1.0, 0.0]}
+    index = SimilarQuestionIndex(client=FakeEmbeddings(vectors))
+    assert search(index, "top 5 earners", "top 5 earners", dialect="sqlserver") is None
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+
+class Work:
+    """Counted work that finishes when released"""
+
+    def __init__(self, result="rows", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_callers_share_one_run():
+    flight, work = SingleFlight(), Work()
+
+    async def run():
+        work.release = asyncio.Event()
+        callers = [asyncio.create_task(flight.do("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert flight.in_flight("key")
+        work.release.set()
+        return await asyncio.gather(*callers)
+
+    assert asyncio.run(run()) == ["rows"] * 3
+    assert work.calls == 1
+    assert flight.stats() == {"started": 1, "joined": 2}
+    assert not flight.in_flight("key")
+
+
+def test_different_keys_run_separately():
+    flight, work = SingleFlight(), Work()
+
+    async def run():
+        work.release = asyncio.Event()
+        work.release.set()
+        return await asyncio.gather(flight.do("a", work), flight.do("b", work))
+
+    asyncio.run(run())
+    assert work.calls == 2
+
+
+def test_every_waiter_gets_the_exception():
+    flight, work = SingleFlight(), Work(error=ValueError("boom"))
+
+    async def run():
+        work.release = asyncio.Event()
+        callers = [asyncio.create_task(flight.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        work.release.set()
+        return await asyncio.gather(*callers, return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(run())] == [ValueError, ValueError]
+    assert work.calls == 1
+
+
+def test_finished_calls_are_not_reused():
+    flight, work = SingleFlight(), Work()
+
+    async def run():
+        work.release = asyncio.Event()
+        work.release.set()
+        await flight.do("key", work)
+        await flight.do("key", work)
+
+    asyncio.run(run())
+    assert work.calls == 2
+
+
+def test_one_waiter_leaving_does_not_cancel_the_others():
+    flight, work = SingleFlight(), Work()
+
+    async def run():
+        work.release = asyncio.Event()
+        leaving = asyncio.create_task(flight.do("key", work))
+        staying = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        await asyncio.sleep(0)
+        work.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        return await staying
+
+    assert asyncio.run(run()) == "rows"
+    assert not work.cancelled
+
+
+def test_work_is_cancelled_once_every_waiter_left():
+    flight, work = SingleFlight(), Work()
+
+    async def run():
+        work.release = asyncio.Event()
+        callers = [asyncio.create_task(flight.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        # The next caller starts afresh instead of joining cancelled work
+        assert not flight.in_flight("key")
+
+    asyncio.run(run())
+    assert work.cancelled
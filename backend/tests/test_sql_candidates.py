@@ -0,0 +1,97 @@
+import asyncio
+
+from services.sql_generator import SQLGenerator
+
+SCHEMA = [
+    {"name": "employees", "columns": [
+        {"name": "id", "type": "integer", "isPrimary": True},
+        {"name": "first_name", "type": "varchar"},
+        {"name": "salary", "type": "numeric"},
+    ]},
+]
+QUESTION = "employees earning more than 1000"
+
+
+class CandidateStream:
+    def __init__(self, sql, delay):
+        self.chunks = [{"response": sql}, {"response": "", "done": True}]
+        self.delay = delay
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(self.delay)
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def aclose(self):
+        self.closed = True
+
+
+class CandidateModel:
+    """Answers candidate `seed` with answers[seed] = (sql, seconds per chunk)"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.requests = []
+        self.streams = {}
+
+    async def generate(self, **kwargs):
+        options = kwargs["options"]
+        self.requests.append(options)
+        sql, delay = self.answers[options["seed"]]
+        self.streams[options["seed"]] = CandidateStream(sql, delay)
+        return self.streams[options["seed"]]
+
+
+def generate(answers, validate=None):
+    model = CandidateModel(answers)
+    generator = SQLGenerator(client=model, candidates=len(answers))
+    sql = asyncio.run(generator.generate(QUESTION, SCHEMA, validate=validate, dialect="postgresql"))
+    return generator, model, sql
+
+
+def test_candidates_sample_differently():
+    _, model, _ = generate({i: ("SELECT id FROM employees", 0) for i in range(3)})
+    assert sorted((r["seed"], r["temperature"]) for r in model.requests) == [(0, 0.1), (1, 0.4), (2, 0.7)]
+
+
+def test_first_finished_valid_candidate_wins_and_the_rest_are_cancelled():
+    generator, model, sql = generate({
+        0: ("SELECT first_name FROM employees WHERE salary > 1000", 0.2),
+        1: ("SELECT id FROM employees WHERE salary > 1000", 0.0),
+    })
+    assert sql == "SELECT id\nFROM employees\nWHERE salary > 1000;"
+    assert model.streams[0].closed
+    assert generator.stats["candidate_rounds"] == 1 and generator.stats["candidate_rejections"] == 0
+
+
+def test_candidates_that_do_not_fit_the_schema_are_skipped():
+    generator, _, sql = generate({
+        0: ("SELECT first_name FROM employees WHERE salary > 1000", 0.05),
+        1: ("SELECT name FROM staff WHERE pay > 1000", 0.0),
+    })
+    assert "FROM employees" in sql
+    assert generator.stats["candidate_rejections"] == 1
+
+
+def test_database_check_rejects_candidates():
+    async def validate(sql):
+        return "first_name" in sql
+
+    _, _, sql = generate({
+        0: ("SELECT first_name FROM employees WHERE salary > 1000", 0.05),
+        1: ("SELECT id FROM employees WHERE salary > 1000", 0.0),
+    }, validate=validate)
+    assert "first_name" in sql
+
+
+def test_no_valid_candidate_falls_back():
+    generator, _, sql = generate({0: ("SELECT name FROM staff", 0.0), 1: ("SELECT name FROM staff", 0.0)})
+    analysis = generator._analyze_schema(SCHEMA)
+    fallback = generator._get_intelligent_fallback(QUESTION, analysis, generator._analyze_intent(QUESTION, analysis))
+    assert sql == generator._format_sql(fallback)
+    assert generator.stats["candidate_failures"] == 1
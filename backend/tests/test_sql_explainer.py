@@ -0,0 +1,68 @@
+import asyncio
+
+from services.sql_explainer import SQLExplainer
+
+# Mixed AND/OR: left to the model by the rule-based explainer
+SQL = ("SELECT first_name FROM employees WHERE salary > {salary} AND department = '{department}' "
+       "OR employee_id < {count}")
+EXPLANATION = ("1. It reads the employees table. 2. It keeps employees earning more than 5000 "
+               "in the Sales department, and those whose id is below 2. 3. It returns their first names.")
+
+
+class FakeModel:
+    """Ollama client answering every prompt with the same explanation"""
+
+    def __init__(self, explanation):
+        self.explanation = explanation
+        self.calls = 0
+
+    async def generate(self, **kwargs):
+        self.calls += 1
+        return {"response": self.explanation}
+
+
+def explainer_for(explanation):
+    model = FakeModel(explanation)
+    explainer = SQLExplainer(client=model)
+    return explainer, model
+
+
+def test_long_literals_are_substituted():
+    explainer, _ = explainer_for(EXPLANATION)
+    entry = explainer._entry(EXPLANATION, ["5000", "Sales", "2"])
+    adapted = explainer._with_literals(entry, ["7000", "Marketing", "2"])
+    assert adapted == EXPLANATION.replace("5000", "7000").replace("Sales", "Marketing")
+
+
+def test_short_literals_never_touch_the_prose():
+    explainer, _ = explainer_for(EXPLANATION)
+    entry = explainer._entry(EXPLANATION, ["5000", "Sales", "2"])
+    # "2" is also the second step's number: the explanation is not adapted but regenerated
+    assert explainer._with_literals(entry, ["5000", "Sales", "3"]) is None
+
+
+def test_literal_mentioned_twice_is_not_substituted():
+    explanation = "Employees earning 5000, shown as 5000 in the report."
+    explainer, _ = explainer_for(explanation)
+    entry = explainer._entry(explanation, ["5000"])
+    assert explainer._with_literals(entry, ["6000"]) is None
+
+
+def test_entries_without_template_only_match_their_own_literals():
+    explainer, _ = explainer_for(EXPLANATION)
+    entry = {"literals": ["5000", "Sales", "2"], "explanation": EXPLANATION}
+    assert explainer._with_literals(entry, ["5000", "Sales", "2"]) == EXPLANATION
+    assert explainer._with_literals(entry, ["7000", "Sales", "2"]) is None
+
+
+def test_shared_explanation_is_regenerated_when_a_short_literal_changes():
+    explainer, model = explainer_for(EXPLANATION)
+
+    async def run():
+        first = await explainer.explain_cached(SQL.format(salary=5000, department="Sales", count=2))
+        second = await explainer.explain_cached(SQL.format(salary=5000, department="Sales", count=3))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == (EXPLANATION, False) and second == (EXPLANATION, False)
+    assert model.calls == 2
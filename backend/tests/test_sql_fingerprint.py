@@ -0,0 +1,19 @@
+from utils.sql_ir import ParsedSQL
+
+
+def test_identifier_case_separates_statements_but_not_shapes():
+    upper, lower = ParsedSQL("SELECT * FROM Users WHERE id = 1"), ParsedSQL("SELECT * FROM users WHERE id = 1")
+    # One latency shape, but MySQL may read two different tables
+    assert upper.fingerprint == lower.fingerprint
+    assert upper.compact != lower.compact
+
+
+def test_spacing_and_comments_do_not_separate_statements():
+    assert (ParsedSQL("SELECT a\n  FROM t -- latest\nWHERE b = 'X'").compact
+            == ParsedSQL("SELECT a FROM t /* again */ WHERE b = 'X'").compact)
+
+
+def test_literals_and_hints_separate_statements():
+    assert ParsedSQL("SELECT a FROM t WHERE b = 'X'").compact != ParsedSQL("SELECT a FROM t WHERE b = 'x'").compact
+    assert (ParsedSQL("SELECT /*+ INDEX(t i) */ a FROM t").compact
+            != ParsedSQL("SELECT a FROM t").compact)
@@ -0,0 +1,59 @@
+import asyncio
+
+from services.sql_generator import SQLGenerator
+
+
+class FakeStream:
+    """Ollama response stream yielding fixed chunks"""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def aclose(self):
+        self.chunks = []
+
+
+class FakeClient:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def generate(self, **kwargs):
+        return FakeStream(self.chunks)
+
+
+def generate(chunks):
+    generator = SQLGenerator(client=FakeClient(chunks))
+
+    async def run():
+        return "".join([token async for token in generator._stream_statement("prompt")])
+    return generator, asyncio.run(run())
+
+
+def test_early_stopped_generation_is_counted_as_unreported():
+    chunks = [{"response": "SELECT 1;"}, {"response": " SELECT 2"},
+              {"response": "", "done": True, "eval_count": 5, "eval_duration": 1000000}]
+    generator, sql = generate(chunks)
+    assert sql == "SELECT 1;"
+    stats = generator.generation_stats()
+    assert stats["early_stops"] == 1
+    assert stats["unreported_generations"] == 1
+    assert stats["reported_generations"] == 0 and stats["eval_tokens"] == 0
+
+
+def test_completed_generation_reports_eval_counts():
+    chunks = [{"response": "SELECT 1"},
+              {"response": "", "done": True, "eval_count": 5, "eval_duration": 2000000}]
+    generator, sql = generate(chunks)
+    assert sql == "SELECT 1"
+    stats = generator.generation_stats()
+    assert stats["reported_generations"] == 1 and stats["unreported_generations"] == 0
+    assert stats["eval_tokens"] == 5 and stats["eval_ms"] == 2.0
+    assert stats["first_tokens"] == 1 and stats["avg_time_to_first_token_ms"] is not None
@@ -0,0 +1,89 @@
+import asyncio
+
+from services.sql_generator import SQLGenerator
+
+SCHEMA = [
+    {"name": "employees", "columns": [
+        {"name": "id", "type": "integer", "isPrimary": True},
+        {"name": "first_name", "type": "varchar"},
+        {"name": "salary", "type": "numeric"},
+    ]},
+]
+
+CHUNKS = [{"response": "SELECT first_name "}, {"response": "FROM employees "}, {"response": "WHERE salary > 1000"},
+          {"response": "", "done": True, "eval_count": 3, "eval_duration": 1000}]
+
+
+class FakeStream:
+    """Ollama response stream yielding fixed chunks, recording whether it was closed"""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, chunks=CHUNKS, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.streams = []
+
+    async def generate(self, **kwargs):
+        if self.error:
+            raise self.error
+        self.streams.append(FakeStream(self.chunks))
+        return self.streams[-1]
+
+
+def events(generator, question, limit=None):
+    async def run():
+        collected = []
+        stream = generator.generate_stream(question, SCHEMA, dialect="postgresql")
+        async for event in stream:
+            collected.append(event)
+            if limit and len(collected) == limit:
+                await stream.aclose()
+                break
+        return collected
+    return asyncio.run(run())
+
+
+def test_tokens_stream_before_the_final_statement():
+    generator = SQLGenerator(client=FakeClient())
+    stream = events(generator, "employees earning more than 1000")
+    assert [event["type"] for event in stream] == ["token", "token", "token", "sql"]
+    assert [event["token"] for event in stream[:-1]] == ["SELECT first_name ", "FROM employees ", "WHERE salary > 1000"]
+    # Each token event carries the statement so far, formatted
+    assert stream[1]["sql"] == "SELECT first_name\nFROM employees"
+    assert stream[-1]["sql"] == "SELECT first_name\nFROM employees\nWHERE salary > 1000;"
+
+
+def test_closing_the_stream_aborts_the_generation():
+    client = FakeClient()
+    stream = events(SQLGenerator(client=client), "employees earning more than 1000", limit=1)
+    assert len(stream) == 1
+    assert client.streams[0].closed
+
+
+def test_template_answers_skip_the_model():
+    client = FakeClient()
+    stream = events(SQLGenerator(client=client), "how many employees")
+    assert [event["type"] for event in stream] == ["sql"]
+    assert "COUNT(*)" in stream[0]["sql"] and not client.streams
+
+
+def test_model_failure_ends_with_the_fallback_statement():
+    generator = SQLGenerator(client=FakeClient(error=ConnectionError("refused")))
+    stream = events(generator, "employees earning more than 1000")
+    assert stream == [{"type": "sql", "sql": generator._get_fallback_query("employees earning more than 1000")}]
@@ -0,0 +1,56 @@
+import sqlite3
+
+import pytest
+
+from utils.sql_ir import ParsedSQL, parse_sql
+
+
+@pytest.mark.parametrize("sql, dialect, expected", [
+    ("SELECT a FROM t", "postgresql", "SELECT a FROM t LIMIT 10"),
+    ("SELECT a FROM t", "mysql", "SELECT a FROM t LIMIT 10"),
+    ("SELECT a FROM t", "sqlite", "SELECT a FROM t LIMIT 10"),
+    ("SELECT a FROM t", "sqlserver", "SELECT TOP 10 a FROM t"),
+    ("SELECT DISTINCT a FROM t", "sqlserver", "SELECT DISTINCT TOP 10 a FROM t"),
+    ("WITH c AS (SELECT TOP 1 x FROM y) SELECT x FROM c", "sqlserver",
+     "WITH c AS (SELECT TOP 1 x FROM y) SELECT TOP 10 x FROM c"),
+    # A trailing comment would swallow the LIMIT
+    ("SELECT a FROM t -- newest first", "mysql", "SELECT a FROM t LIMIT 10"),
+    # A limit inside a subquery does not bound the result
+    ("SELECT a FROM t WHERE a IN (SELECT b FROM u LIMIT 3)", "postgresql",
+     "SELECT a FROM t WHERE a IN (SELECT b FROM u LIMIT 3) LIMIT 10"),
+    ("SELECT a FROM t UNION SELECT b FROM u", "sqlite", "SELECT a FROM t UNION SELECT b FROM u LIMIT 10"),
+])
+def test_limit_in_the_dialects_syntax(sql, dialect, expected):
+    assert ParsedSQL(sql).with_limit(10, dialect) == expected
+
+
+@pytest.mark.parametrize("sql, dialect", [
+    ("SELECT a FROM t LIMIT 5", "postgresql"),
+    ("SELECT a FROM t LIMIT 5 OFFSET 10", "mysql"),
+    ("SELECT TOP 5 a FROM t", "sqlserver"),
+    ("SELECT TOP (5) a FROM t", "sqlserver"),
+    ("SELECT a FROM t ORDER BY a OFFSET 0 ROWS FETCH NEXT 5 ROWS ONLY", "sqlserver"),
+    ("SELECT a FROM t ORDER BY a FETCH FIRST 5 ROWS ONLY", "postgresql"),
+    ("SELECT * FROM t FOR UPDATE", "postgresql"),
+    # TOP would bound only the first SELECT of a set operation
+    ("SELECT a FROM t UNION SELECT b FROM u", "sqlserver"),
+    ("UPDATE t SET a = 1", "postgresql"),
+])
+def test_statements_left_as_they_are(sql, dialect):
+    assert ParsedSQL(sql).with_limit(10, dialect) == sql
+
+
+def test_no_limit_requested():
+    assert ParsedSQL("SELECT a FROM t").with_limit(None, "postgresql") == "SELECT a FROM t"
+
+
+def test_limited_statement_runs():
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE t (a INTEGER)")
+    connection.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(50)])
+    sql = parse_sql("SELECT a FROM t ORDER BY a -- all of them").with_limit(10, "sqlite")
+    assert len(connection.execute(sql).fetchall()) == 10
+
+
+def test_parses_are_shared():
+    assert parse_sql("SELECT 1") is parse_sql("SELECT 1")
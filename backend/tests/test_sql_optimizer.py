@@ -0,0 +1,154 @@
+import sqlite3
+
+import pytest
+
+from services.sql_optimizer import OPTIMIZER_RULES, SQLOptimizer
+
+SCHEMA = [
+    {"name": "departments", "columns": [
+        {"name": "department_id", "type": "integer", "isPrimary": True},
+        {"name": "name", "type": "text"},
+    ]},
+    {"name": "employees", "columns": [
+        {"name": "employee_id", "type": "integer", "isPrimary": True},
+        {"name": "first_name", "type": "text"},
+        {"name": "salary", "type": "integer"},
+        {"name": "department_id", "type": "integer"},
+    ]},
+]
+
+
+@pytest.fixture(scope="module")
+def db():
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE departments (department_id INTEGER PRIMARY KEY, name TEXT)")
+    connection.execute("CREATE TABLE employees (employee_id INTEGER PRIMARY KEY, first_name TEXT, "
+                       "salary INTEGER, department_id INTEGER)")
+    connection.executemany("INSERT INTO departments VALUES (?, ?)",
+                           [(1, "Engineering"), (2, "Sales"), (3, "Support"), (4, "Empty")])
+    # Uneven salaries per department, and some employees without one
+    connection.executemany("INSERT INTO employees VALUES (?, ?, ?, ?)", [
+        (i, f"name{i % 17}", 1000 + (i * 37) % 5000, None if i % 11 == 0 else i % 3 + 1)
+        for i in range(1, 121)
+    ])
+    yield connection
+    connection.close()
+
+
+def rows(db, sql):
+    return sorted(db.execute(sql).fetchall(), key=repr)
+
+
+def optimize_with(sql, rule, **kwargs):
+    """Optimize with only `rule` switched on"""
+    return SQLOptimizer().optimize(sql, schema=SCHEMA, db_type="sqlite",
+                                   rules={name: name == rule for name in OPTIMIZER_RULES}, **kwargs)
+
+
+CORRELATED_AVG = ("SELECT e.first_name, e.salary FROM employees e WHERE e.salary > "
+                  "(SELECT AVG(i.salary) FROM employees i WHERE i.department_id = e.department_id)")
+
+EQUIVALENT = [
+    ("window_functions", CORRELATED_AVG),
+    ("window_functions", "SELECT e.employee_id, (SELECT COUNT(*) FROM employees i "
+                         "WHERE i.department_id = e.department_id) AS colleagues FROM employees e"),
+    ("hoist_scalar_subqueries", CORRELATED_AVG),
+    ("hoist_scalar_subqueries", "SELECT e.first_name FROM employees e WHERE e.salary > "
+                                "(SELECT AVG(i.salary) FROM employees i WHERE i.salary > 3000)"),
+    ("hoist_scalar_subqueries", "SELECT e.first_name FROM employees e WHERE e.salary > (SELECT AVG(i.salary) "
+                                "FROM employees i WHERE i.department_id = e.department_id AND i.salary > 3000)"),
+    ("hoist_scalar_subqueries", "SELECT d.name, (SELECT COUNT(*) FROM employees i "
+                                "WHERE i.department_id = d.department_id) AS headcount FROM departments d"),
+    ("remove_redundant_distinct", "SELECT DISTINCT employee_id, first_name FROM employees"),
+    ("remove_redundant_distinct", "SELECT DISTINCT department_id, COUNT(*) FROM employees GROUP BY department_id"),
+    ("remove_redundant_order_by", "SELECT s.first_name FROM (SELECT first_name FROM employees ORDER BY salary) s"),
+    ("remove_redundant_order_by", "SELECT MAX(salary) FROM employees ORDER BY 1"),
+]
+
+
+@pytest.mark.parametrize("rule, sql", EQUIVALENT)
+def test_rewrite_keeps_result(db, rule, sql):
+    optimized = optimize_with(sql, rule)
+    assert [r["rule"] for r in optimized["rewrites"]] and {r["rule"] for r in optimized["rewrites"]} == {rule}
+    assert rows(db, optimized["sql"]) == rows(db, sql)
+
+
+MIXED_AND_OR = [
+    # AND binds tighter than OR: the OR branch is not a local filter of the correlated subquery
+    "SELECT e.first_name FROM employees e WHERE e.salary > (SELECT AVG(i.salary) FROM employees i "
+    "WHERE i.department_id = e.department_id AND i.salary > 3000 OR i.employee_id < 3)",
+    "SELECT e.first_name FROM employees e WHERE e.salary > (SELECT AVG(i.salary) FROM employees i "
+    "WHERE i.salary > 3000 AND i.department_id = 2 OR i.employee_id < 3)",
+    "SELECT e.first_name FROM employees e WHERE e.salary > (SELECT AVG(i.salary) FROM employees i "
+    "WHERE (i.salary > 3000 OR i.employee_id < 3) AND i.department_id = e.department_id)",
+    "SELECT e.first_name FROM employees e WHERE e.department_id = 1 OR e.salary > "
+    "(SELECT AVG(i.salary) FROM employees i WHERE i.department_id = e.department_id)",
+]
+
+
+@pytest.mark.parametrize("rule", ["window_functions", "hoist_scalar_subqueries"])
+@pytest.mark.parametrize("sql", MIXED_AND_OR)
+def test_mixed_and_or_keeps_result(db, rule, sql):
+    assert rows(db, optimize_with(sql, rule)["sql"]) == rows(db, sql)
+
+
+def test_all_rules_keep_result(db):
+    for _, sql in EQUIVALENT:
+        optimized = SQLOptimizer().optimize(sql, schema=SCHEMA, db_type="sqlite")
+        assert rows(db, optimized["sql"]) == rows(db, sql)
+    for sql in MIXED_AND_OR:
+        optimized = SQLOptimizer().optimize(sql, schema=SCHEMA, db_type="sqlite")
+        assert rows(db, optimized["sql"]) == rows(db, sql)
+
+
+def test_project_columns_keeps_displayed_columns(db):
+    sql = "SELECT * FROM employees WHERE salary > 3000"
+    optimized = optimize_with(sql, "project_columns", visible_columns=["first_name", "salary"])
+    assert [r["rule"] for r in optimized["rewrites"]] == ["project_columns"]
+    assert rows(db, optimized["sql"]) == rows(db, "SELECT first_name, salary FROM employees WHERE salary > 3000")
+
+
+@pytest.mark.parametrize("sql", [
+    # Runs once already; a window over all of employees would add a full scan
+    "SELECT e.first_name FROM employees e WHERE e.salary > (SELECT AVG(i.salary) FROM employees i)",
+    "SELECT e.first_name, (SELECT MAX(i.salary) FROM employees i) AS top_salary FROM employees e",
+])
+def test_uncorrelated_subquery_is_not_windowed(sql):
+    assert optimize_with(sql, "window_functions")["rewrites"] == []
+
+
+@pytest.mark.parametrize("rule, db_type, version, applied", [
+    ("window_functions", "mysql", "5.7.44", False),
+    ("window_functions", "mysql", "8.0.36", True),
+    ("window_functions", "mysql", "10.1.48-MariaDB", False),
+    ("window_functions", "mysql", "10.6.16-MariaDB", True),
+    ("window_functions", "mysql", None, False),
+    ("window_functions", "sqlite", "3.22.0", False),
+    ("window_functions", "sqlite", "3.45.1", True),
+    ("window_functions", "postgresql", None, True),
+    ("hoist_scalar_subqueries", "mysql", "5.7.44", False),
+    ("hoist_scalar_subqueries", "sqlite", "3.8.2", False),
+])
+def test_rules_follow_server_version(rule, db_type, version, applied):
+    optimized = SQLOptimizer().optimize(CORRELATED_AVG, schema=SCHEMA, db_type=db_type, server_version=version,
+                                        rules={name: name == rule for name in OPTIMIZER_RULES})
+    assert bool(optimized["rewrites"]) == applied
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT s.first_name FROM (SELECT first_name FROM employees ORDER BY salary LIMIT 5) s",
+    "SELECT s.first_name FROM (SELECT first_name FROM employees ORDER BY salary OFFSET 5) s",
+    "SELECT s.first_name FROM (SELECT first_name FROM employees ORDER BY salary FETCH FIRST 5 ROWS ONLY) s",
+    "SELECT s.first_name FROM (SELECT first_name FROM employees ORDER BY salary "
+    "OFFSET 5 ROWS FETCH NEXT 5 ROWS ONLY) s",
+    "WITH s AS (SELECT first_name FROM employees ORDER BY salary OFFSET 5) SELECT first_name FROM s",
+    "SELECT MAX(salary) FROM employees ORDER BY 1 OFFSET 1",
+])
+def test_order_by_kept_when_rows_are_limited(sql):
+    optimized = optimize_with(sql, "remove_redundant_order_by")
+    assert optimized["rewrites"] == [] and optimized["sql"] == sql
+
+
+def test_order_by_with_limit_and_offset_keeps_result(db):
+    sql = "SELECT s.first_name FROM (SELECT first_name FROM employees ORDER BY salary, employee_id LIMIT 5 OFFSET 10) s"
+    assert rows(db, optimize_with(sql, "remove_redundant_order_by")["sql"]) == rows(db, sql)
@@ -0,0 +1,44 @@
+import pytest
+
+from services.sql_rule_explainer import RuleBasedExplainer
+
+
+@pytest.fixture
+def explainer():
+    return RuleBasedExplainer()
+
+
+def test_simple_query(explainer):
+    explanation = explainer.explain(
+        "SELECT name, salary FROM employees WHERE salary > 5000 AND department_id = 2 ORDER BY salary DESC LIMIT 5"
+    )
+    assert explanation == (
+        "1. Reads rows from the employees table.\n"
+        "2. Keeps only the rows where salary is greater than 5000 and department_id equals 2.\n"
+        "3. Returns name and salary.\n"
+        "4. Sorts the results by salary from highest to lowest.\n"
+        "5. Returns only the first 5 rows."
+    )
+
+
+def test_plain_alternatives(explainer):
+    assert "a equals 1 or b equals 2." in explainer.explain("SELECT name FROM t WHERE a = 1 OR b = 2")
+    assert "a equals 1 or b equals 2." in explainer.explain("SELECT name FROM t WHERE (a = 1 OR b = 2)")
+
+
+@pytest.mark.parametrize("sql", [
+    # Mixed AND/OR: the grouping would be lost in words
+    "SELECT name FROM t WHERE (a = 1 OR b = 2) AND c = 3",
+    "SELECT name FROM t WHERE a = 1 AND (b = 2 OR c = 3)",
+    "SELECT name FROM t WHERE a = 1 AND b = 2 OR c = 3",
+    "SELECT name FROM t WHERE a = 1 OR b = 2 AND c = 3",
+    "SELECT name, COUNT(*) FROM t GROUP BY name HAVING COUNT(*) > 1 AND MIN(a) = 1 OR MAX(a) = 3",
+    # Row limits the parser does not decompose
+    "SELECT name FROM t FETCH FIRST 5 ROWS ONLY",
+    "SELECT name FROM t ORDER BY name OFFSET 5 ROWS FETCH NEXT 5 ROWS ONLY",
+    # Positional references
+    "SELECT name, salary FROM t ORDER BY 2",
+    "SELECT name, COUNT(*) FROM t GROUP BY 1",
+])
+def test_left_to_the_model(explainer, sql):
+    assert explainer.explain(sql) is None
@@ -0,0 +1,56 @@
+import pytest
+
+from utils.sql_ir import ParsedSQL
+from utils.sql_safety import read_only_violation
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT created_at, updated_by, deleted_at, insert_id FROM t",
+    "SELECT count(*) AS replace FROM t",
+    "SELECT 1 AS delete",
+    "SELECT a AS delete FROM t",
+    "SELECT merge FROM t",
+    "SELECT status, replace FROM t",
+    "SELECT a FROM t WHERE x = merge ORDER BY update",
+    "SELECT a FROM t JOIN update u ON u.id = t.id",
+    "SELECT insert('abc', 1, 1, 'x')",
+    "SELECT a AS waitfor FROM t",
+    "SELECT waitfor FROM t",
+    'SELECT "waitfor" FROM t',
+    "SELECT t.waitfor, t.into, t.update FROM t",
+    "SELECT sleep, benchmark FROM t",
+    "SELECT replace(name, 'a', 'b') FROM t",
+    "SELECT a FROM t AS sleep (a)",
+    "WITH sleep (x) AS (SELECT 1) SELECT * FROM sleep",
+])
+def test_names_are_not_mistaken_for_commands(sql):
+    assert read_only_violation(sql) is None
+    # Coalescing and retries go by the same classification
+    assert ParsedSQL(sql).read_only
+
+
+@pytest.mark.parametrize("sql, reason", [
+    ("SELECT a INTO b FROM t", "INTO"),
+    ("SELECT * FROM t INTO OUTFILE '/tmp/t'", "INTO"),
+    ("SELECT 1 WAITFOR DELAY '00:00:05'", "WAITFOR"),
+    ("SELECT * FROM t WHERE a IN (SELECT b FROM u) WAITFOR TIME '10:00'", "WAITFOR"),
+    ("SELECT pg_sleep(1)", "pg_sleep()"),
+    ("SELECT pg_catalog.pg_sleep(1)", "pg_sleep()"),
+    ("SELECT sleep(1) AS x FROM t", "sleep()"),
+    ("WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d", "DELETE"),
+    ("WITH d AS MATERIALIZED (UPDATE t SET a = 1 RETURNING *) SELECT * FROM d", "UPDATE"),
+    # T-SQL runs both statements of a batch without semicolons
+    ("SELECT a FROM t DELETE FROM t", "DELETE"),
+    ("SELECT * FROM t WHERE a IN (SELECT b FROM u) UPDATE t SET a = 1", "UPDATE"),
+    ("SELECT * FROM t FOR UPDATE", "UPDATE"),
+    ("EXPLAIN ANALYZE UPDATE t SET a = 1", "UPDATE"),
+    ("DROP TABLE t", "DROP"),
+])
+def test_commands_are_refused(sql, reason):
+    violation = read_only_violation(sql)
+    assert violation is not None and reason in violation
+    assert not ParsedSQL(sql).read_only
+
+
+def test_single_statement_only():
+    assert "single statement" in read_only_violation("SELECT 1; SELECT 2")
@@ -0,0 +1,106 @@
+import sqlite3
+
+import pytest
+
+from services.sql_generator import SQLGenerator
+from services.sql_templates import SQLTemplateEngine
+
+SCHEMA = [
+    {"name": "departments", "columns": [
+        {"name": "id", "type": "integer", "isPrimary": True},
+        {"name": "name", "type": "varchar"},
+    ]},
+    {"name": "employees", "columns": [
+        {"name": "id", "type": "integer", "isPrimary": True},
+        {"name": "first_name", "type": "varchar"},
+        {"name": "salary", "type": "numeric"},
+        {"name": "department_id", "type": "integer", "isForeign": True,
+         "references": {"table": "departments", "column": "id"}},
+    ]},
+    {"name": "Order Items", "columns": [
+        {"name": "id", "type": "integer", "isPrimary": True},
+        {"name": "Unit Price", "type": "numeric"},
+    ]},
+]
+
+
+@pytest.fixture(scope="module")
+def analysis():
+    return SQLGenerator(client=object())._analyze_schema(SCHEMA)
+
+
+def sql_for(question, analysis, dialect=None):
+    match = SQLTemplateEngine().match(question, analysis, dialect)
+    return match and match["sql"]
+
+
+@pytest.mark.parametrize("dialect, expected", [
+    ("postgresql", "SELECT * FROM employees ORDER BY salary DESC LIMIT 5;"),
+    ("sqlite", "SELECT * FROM employees ORDER BY salary DESC LIMIT 5;"),
+    ("sqlserver", "SELECT TOP 5 * FROM employees ORDER BY salary DESC;"),
+])
+def test_top_n_limit_in_dialect(analysis, dialect, expected):
+    assert sql_for("top five employees by salary", analysis, dialect) == expected
+
+
+@pytest.mark.parametrize("dialect, table, column", [
+    ("postgresql", '"Order Items"', '"Unit Price"'),
+    ("mysql", "`Order Items`", "`Unit Price`"),
+    ("sqlserver", "[Order Items]", "[Unit Price]"),
+])
+def test_identifiers_quoted_in_dialect(analysis, dialect, table, column):
+    assert sql_for("how many order items", analysis, dialect) == f"SELECT COUNT(*) AS count FROM {table};"
+    assert sql_for("lowest 3 order items by unit price", analysis, dialect).count(column) == 1
+
+
+def test_template_sql_runs(analysis):
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE departments (id INTEGER PRIMARY KEY, name TEXT)")
+    connection.execute("CREATE TABLE employees (id INTEGER PRIMARY KEY, first_name TEXT, salary NUMERIC, department_id INTEGER)")
+    connection.execute('CREATE TABLE "Order Items" (id INTEGER PRIMARY KEY, "Unit Price" NUMERIC)')
+    for question in ["how many order items", "top 3 order items by unit price", "lowest 2 employees by salary",
+                     "average salary per department", "list employees where first_name is 'Ann'"]:
+        sql = sql_for(question, analysis, "sqlite")
+        assert sql, question
+        connection.execute(sql).fetchall()
+
+
+RESERVED_SCHEMA = [
+    {"name": "order", "columns": [
+        {"name": "id", "type": "int4", "isPrimary": True},
+        {"name": "user", "type": "varchar"},
+        {"name": "location", "type": "point"},
+        {"name": "duration", "type": "interval"},
+        {"name": "total", "type": "double precision"},
+    ]},
+]
+
+
+@pytest.fixture(scope="module")
+def reserved_analysis():
+    return SQLGenerator(client=object())._analyze_schema(RESERVED_SCHEMA)
+
+
+@pytest.mark.parametrize("question", ["average location per user", "top 3 order by duration"])
+def test_non_numeric_types_containing_int_are_not_aggregated(reserved_analysis, question):
+    assert sql_for(question, reserved_analysis, "postgresql") is None
+
+
+@pytest.mark.parametrize("dialect, table, column", [
+    ("postgresql", '"order"', '"user"'),
+    ("mysql", "`order`", "`user`"),
+    ("sqlserver", "[order]", "[user]"),
+])
+def test_reserved_words_are_quoted(reserved_analysis, dialect, table, column):
+    sql = sql_for("average total per user", reserved_analysis, dialect)
+    assert f"FROM {table}" in sql and f"GROUP BY {column}" in sql
+
+
+def test_reserved_names_run():
+    connection = sqlite3.connect(":memory:")
+    connection.execute('CREATE TABLE "order" (id INTEGER PRIMARY KEY, "user" TEXT, total REAL)')
+    analysis = SQLGenerator(client=object())._analyze_schema([
+        {"name": "order", "columns": [{"name": "id", "type": "INTEGER", "isPrimary": True},
+                                      {"name": "user", "type": "TEXT"}, {"name": "total", "type": "REAL"}]}
+    ])
+    connection.execute(sql_for("average total per user", analysis, "sqlite")).fetchall()
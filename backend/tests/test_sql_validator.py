@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from services.sql_generator import SQLGenerator
+
+SCHEMA = [
+    {"name": "departments", "columns": [
+        {"name": "id", "type": "integer", "isPrimary": True},
+        {"name": "name", "type": "varchar"},
+    ]},
+    {"name": "employees", "columns": [
+        {"name": "id", "type": "integer", "isPrimary": True},
+        {"name": "first_name", "type": "varchar"},
+        {"name": "salary", "type": "numeric(10,2)"},
+        {"name": "notice", "type": "interval"},
+        {"name": "department_id", "type": "integer", "isForeign": True,
+         "references": {"table": "departments", "column": "id"}},
+    ]},
+]
+
+
+@pytest.fixture(scope="module")
+def generator():
+    return SQLGenerator(client=object())
+
+
+@pytest.fixture(scope="module")
+def analysis(generator):
+    return generator._analyze_schema(SCHEMA)
+
+
+def errors(generator, analysis, sql):
+    return generator.validator.validate(sql, analysis)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT e.first_name, d.name FROM employees e JOIN departments d ON e.department_id = d.id",
+    "WITH rich AS (SELECT id, salary AS pay FROM employees) SELECT pay FROM rich WHERE pay > 1000",
+    "SELECT x.n FROM (SELECT COUNT(*) AS n FROM employees) x",
+    "SELECT first_name FROM employees e WHERE salary > (SELECT AVG(salary) FROM employees WHERE department_id = e.department_id)",
+    "SELECT department_id, AVG(salary) AS avg_salary FROM employees GROUP BY department_id ORDER BY avg_salary",
+    "SELECT first_name FROM employees WHERE salary = '1000'",
+    # Set operations are not parsed: nothing is reported rather than a false error
+    "SELECT name FROM staff UNION SELECT name FROM departments",
+])
+def test_statements_that_fit_the_schema(generator, analysis, sql):
+    assert errors(generator, analysis, sql) == []
+
+
+@pytest.mark.parametrize("sql, error", [
+    ("SELECT first_name FROM employee", 'table "employee" does not exist (did you mean "employees"?)'),
+    ("SELECT firstname FROM employees", 'column "firstname" does not exist in employees (did you mean "first_name"?)'),
+    ("SELECT employees.first_name FROM employees e", 'table "employees" is aliased as "e": write e.first_name'),
+    ("SELECT id FROM employees JOIN departments ON department_id = departments.id",
+     'column "id" is ambiguous: write employees.id or departments.id'),
+    ("SELECT first_name FROM employees WHERE salary > 'high'",
+     "salary is numeric (numeric(10,2)) but is compared with the text 'high'"),
+    ("SELECT SUM(first_name) FROM employees", "SUM(first_name) needs a numeric column, but first_name is varchar"),
+    ("SELECT AVG(notice) FROM employees", "AVG(notice) needs a numeric column, but notice is interval"),
+])
+def test_errors_are_worded_for_the_model(generator, analysis, sql, error):
+    assert error in errors(generator, analysis, sql)
+
+
+class RepairModel:
+    """Answers the regeneration prompt with a fixed statement"""
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.prompts = []
+
+    async def generate(self, **kwargs):
+        self.prompts.append(kwargs["prompt"])
+        return Stream(self.sql)
+
+
+class Stream:
+    def __init__(self, sql):
+        self.chunks = [{"response": sql}, {"response": "", "done": True}]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def aclose(self):
+        self.chunks = []
+
+
+def repair(sql, regenerated):
+    model = RepairModel(regenerated)
+    generator = SQLGenerator(client=model)
+    analysis = generator._analyze_schema(SCHEMA)
+    question = "names of employees"
+    intent = generator._analyze_intent(question, analysis)
+    return generator, model, asyncio.run(generator._repair(sql, question, analysis, intent))
+
+
+def test_valid_statement_is_not_regenerated():
+    generator, model, sql = repair("SELECT first_name FROM employees", "SELECT 1")
+    assert sql == "SELECT first_name FROM employees" and model.prompts == []
+
+
+def test_one_regeneration_with_the_errors_in_the_prompt():
+    generator, model, sql = repair("SELECT firstname FROM employees", "SELECT first_name FROM employees")
+    assert sql == "SELECT first_name\nFROM employees;"
+    assert len(model.prompts) == 1
+    assert "SELECT firstname FROM employees" in model.prompts[0]
+    assert 'column "firstname" does not exist' in model.prompts[0]
+    assert generator.stats["schema_rejections"] == 1 and generator.stats["schema_repairs"] == 1
+
+
+def test_first_attempt_is_kept_when_the_regeneration_is_no_better():
+    generator, model, sql = repair("SELECT firstname FROM employees", "SELECT fname FROM employees")
+    assert sql == "SELECT firstname FROM employees"
+    assert len(model.prompts) == 1 and generator.stats["schema_repairs"] == 0
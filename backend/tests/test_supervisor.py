@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+# The supervisor classifies errors of every driver it supports
+pytest.importorskip("asyncpg")
+pytest.importorskip("pyodbc")
+
+from database.supervisor import ConnectionSupervisor
+
+
+class ExclusiveConnection:
+    """Connection that, like asyncpg, refuses an operation while another is running"""
+
+    def __init__(self):
+        self.busy = False
+        self.closed = False
+
+    async def fetch(self, sql):
+        if self.busy:
+            raise RuntimeError("another operation is in progress")
+        self.busy = True
+        try:
+            await asyncio.sleep(0.01)
+            return [{"sql": sql}]
+        finally:
+            self.busy = False
+
+    async def close(self):
+        self.closed = True
+
+
+def supervised(connections):
+    async def connect():
+        return connections.pop(0)
+    return ConnectionSupervisor("postgresql", connect)
+
+
+def test_concurrent_operations_run_one_at_a_time():
+    async def run():
+        supervisor = supervised([ExclusiveConnection()])
+        await supervisor.start()
+        try:
+            return await asyncio.gather(
+                supervisor.run(lambda connection: connection.fetch("SELECT 1"), read_only=True),
+                supervisor.run(lambda connection: connection.fetch("SELECT 2"), read_only=True)
+            )
+        finally:
+            await supervisor.stop()
+
+    assert asyncio.run(run()) == [[{"sql": "SELECT 1"}], [{"sql": "SELECT 2"}]]
+
+
+def test_waiting_operation_uses_the_reconnected_connection():
+    first, second = ExclusiveConnection(), ExclusiveConnection()
+    used = []
+
+    async def drop(connection):
+        used.append(connection)
+        await asyncio.sleep(0.01)
+        raise ConnectionError("connection reset")
+
+    async def read(connection):
+        used.append(connection)
+        return await connection.fetch("SELECT 1")
+
+    async def run():
+        supervisor = supervised([first, second])
+        await supervisor.start()
+        try:
+            return await asyncio.gather(supervisor.run(drop), supervisor.run(read, read_only=True),
+                                        return_exceptions=True)
+        finally:
+            await supervisor.stop()
+
+    dropped, rows = asyncio.run(run())
+    assert isinstance(dropped, ConnectionError)
+    assert rows == [{"sql": "SELECT 1"}]
+    assert used == [first, second] and first.closed
@@ -2,6 +2,8 @@
 import re
 from typing import Dict, Any, Optional
 
+from utils.sql_ir import parse_sql
+
 def parse_connection_string(connection_string: str) -> Dict[str, Any]:
     """Parse database connection string into components"""
     # Basic regex for connection string parsing
@@ -22,31 +24,9 @@ def parse_connection_string(connection_string: str) -> Dict[str, Any]:
 
 def validate_sql_query(sql: str) -> bool:
     """Basic SQL validation (prevent injection, dangerous operations)"""
-    sql_upper = sql.upper().strip()
-    
-    # Check for dangerous operations
-    dangerous_keywords = ['DROP', 'DELETE', 'TRUNCATE', 'ALTER', 'CREATE', 'INSERT', 'UPDATE']
-    
-    # Allow SELECT, WITH, EXPLAIN, etc.
-    first_word = sql_upper.split()[0] if sql_upper.split() else ''
-    
-    if first_word not in ['SELECT', 'WITH', 'EXPLAIN', 'SHOW', 'DESCRIBE']:
-        # Check if any dangerous keyword appears
-        for keyword in dangerous_keywords:
-            if keyword in sql_upper:
-                return False
-    
-    return True
+    # A single read-only statement, checked on the parse tree
+    return parse_sql(sql).read_only_violation is None
 
 def format_sql(sql: str) -> str:
     """Basic SQL formatting"""
-    # Remove extra whitespace
-    sql = ' '.join(sql.split())
-    
-    # Add newlines for major keywords
-    keywords = ['SELECT', 'FROM', 'WHERE', 'GROUP BY', 'ORDER BY', 'HAVING', 'JOIN', 'LEFT JOIN', 'RIGHT JOIN', 'INNER JOIN']
-    
-    for keyword in keywords:
-        sql = sql.replace(f' {keyword} ', f'\n{keyword} ')
-    
-    return sql
\ No newline at end of file
+    return parse_sql(sql).formatted
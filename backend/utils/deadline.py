@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Awaitable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages in order, with the share of the budget each one is guaranteed.
+# A stage may also use whatever earlier stages left unused; only the shares of the
+# stages after it are held back.
+DEADLINE_STAGES: List[Tuple[str, float]] = [
+    ("schema", 0.15),
+    ("lookup", 0.10),
+    ("generation", 0.50),
+    ("execution", 0.25),
+]
+
+
+class Deadline:
+    """
+    Latency budget of one request, split across the pipeline stages. A stage awaited
+    with within() raises asyncio.TimeoutError once its time is up; the caller then
+    degrades (stale schema, no model, no execution) and records it with degrade().
+    Without a budget nothing is ever timed out.
+    """
+
+    def __init__(self, budget_ms: Optional[float] = None, stages: List[Tuple[str, float]] = DEADLINE_STAGES):
+        self.budget = budget_ms / 1000 if budget_ms else None
+        self.expires_at = time.monotonic() + self.budget if self.budget else None
+        self.stages = stages
+        self.degradations: List[str] = []
+
+    @classmethod
+    def from_request(cls, budget_ms: Optional[float], header: Optional[str]) -> "Deadline":
+        """The tighter of the request field and the header (milliseconds); an unparsable header is ignored"""
+        budgets = [budget_ms] if budget_ms else []
+        if header:
+            try:
+                value = float(header)
+            except ValueError:
+                value = 0
+            if math.isfinite(value) and value > 0:
+                budgets.append(value)
+            else:
+                logger.warning(f"Ignoring invalid deadline header: {header!r}")
+        return cls(min(budgets) if budgets else None)
+
+    @property
+    def enabled(self) -> bool:
+        return self.expires_at is not None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, never negative; None without a budget"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def stage_timeout(self, stage: str) -> Optional[float]:
+        """Seconds the stage may take: what is left minus what the later stages are guaranteed"""
+        if self.expires_at is None:
+            return None
+        names = [name for name, _ in self.stages]
+        reserved = sum(share for _, share in self.stages[names.index(stage) + 1:])
+        return max(0.0, self.remaining() - self.budget * reserved)
+
+    async def within(self, stage: str, awaitable: Awaitable[Any], detach: bool = False) -> Any:
+        """
+        Await within the stage's time. detach: on timeout let the work finish in the
+        background (e.g. a schema fetch that refreshes the snapshot) instead of cancelling it.
+        """
+        timeout = self.stage_timeout(stage)
+        if timeout is None:
+            return await awaitable
+        if not detach:
+            return await asyncio.wait_for(awaitable, timeout)
+
+        task = asyncio.ensure_future(awaitable)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            # Nobody awaits it any more: retrieve its exception so it is not reported as lost
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            raise
+
+    def degrade(self, degradation: str) -> None:
+        self.degradations.append(degradation)
+        logger.warning(f"⏱️ Deadline: {degradation} ({self.budget * 1000:.0f}ms budget)")
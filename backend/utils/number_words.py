@@ -0,0 +1,6 @@
+# Number words a question may spell out ("top five"), as digits
+NUMBER_WORDS = {
+    'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5', 'six': '6', 'seven': '7', 'eight': '8',
+    'nine': '9', 'ten': '10', 'eleven': '11', 'twelve': '12', 'fifteen': '15', 'twenty': '20', 'fifty': '50',
+    'hundred': '100', 'thousand': '1000'
+}
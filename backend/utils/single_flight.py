@@ -0,0 +1,50 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: the first caller for a key starts the
+    work, later callers with the same key await the same task while it is in
+    flight. Every waiter gets the result or the exception; the work is cancelled
+    only once all of its waiters have gone away.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Dict[str, Any]] = {}
+        self.started = 0
+        self.joined = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = {"task": asyncio.ensure_future(work()), "waiters": 0}
+            self._calls[key] = call
+            call["task"].add_done_callback(lambda _: self._forget(key, call))
+            self.started += 1
+        else:
+            self.joined += 1
+
+        call["waiters"] += 1
+        cancelled = False
+        try:
+            # shield: one waiter being cancelled must not cancel the others' work
+            return await asyncio.shield(call["task"])
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            call["waiters"] -= 1
+            if cancelled and call["waiters"] == 0 and not call["task"].done():
+                call["task"].cancel()
+                self._forget(key, call)
+
+    def stats(self) -> Dict[str, int]:
+        return {"started": self.started, "joined": self.joined}
+
+    def _forget(self, key: Hashable, call: Dict[str, Any]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,578 @@
+import os
+import re
+from functools import lru_cache
+from typing import Optional, List, Tuple
+
+import sqlparse
+from sqlparse import tokens as T
+
+# Distinct SQL texts kept lexed: generation, validation, execution and explanation read the same statement
+SQL_PARSE_CACHE_SIZE = int(os.getenv("SQL_PARSE_CACHE_SIZE", "1024"))
+
+# Keywords that start a new clause of a SELECT statement at paren depth 0
+CLAUSE_KEYWORDS = ['FROM', 'WHERE', 'GROUP BY', 'HAVING', 'ORDER BY', 'LIMIT', 'OFFSET']
+SET_OPERATORS = ['UNION', 'UNION ALL', 'INTERSECT', 'EXCEPT']
+AGGREGATE_FUNCTIONS = ['COUNT', 'SUM', 'AVG', 'MIN', 'MAX']
+# FETCH is not a clause keyword: without OFFSET before it, it ends up in the last ORDER BY item
+FETCH_FIRST = re.compile(r'\bFETCH\s+(FIRST|NEXT)\b', re.IGNORECASE)
+# Reserved in at least one supported dialect, so never a bare identifier: `SELECT user FROM order`
+# reads the current user in PostgreSQL and SQL Server and fails to parse everywhere
+RESERVED_WORDS = {
+    'ALL', 'ALTER', 'ANALYSE', 'ANALYZE', 'AND', 'ANY', 'ARRAY', 'AS', 'ASC', 'BETWEEN', 'BOTH', 'BY', 'CASE',
+    'CAST', 'CHECK', 'COLLATE', 'COLUMN', 'CONSTRAINT', 'CREATE', 'CROSS', 'CURRENT_DATE', 'CURRENT_TIME',
+    'CURRENT_TIMESTAMP', 'CURRENT_USER', 'DATABASE', 'DEFAULT', 'DELETE', 'DESC', 'DESCRIBE', 'DISTINCT', 'DIV',
+    'DO', 'DROP', 'ELSE', 'END', 'EXCEPT', 'EXISTS', 'EXPLAIN', 'FALSE', 'FETCH', 'FILE', 'FOR', 'FOREIGN', 'FROM',
+    'FULL', 'FUNCTION', 'GRANT', 'GROUP', 'GROUPS', 'HAVING', 'IDENTITY', 'IN', 'INDEX', 'INNER', 'INSERT',
+    'INTERSECT', 'INTERVAL', 'INTO', 'IS', 'JOIN', 'KEY', 'KEYS', 'LATERAL', 'LEADING', 'LEFT', 'LIKE', 'LIMIT',
+    'LOCK', 'MATCH', 'MOD', 'NATURAL', 'NOT', 'NULL', 'OFFSET', 'ON', 'ONLY', 'OPTION', 'OR', 'ORDER', 'OUTER',
+    'PERCENT', 'PLAN', 'PRIMARY', 'PROCEDURE', 'PUBLIC', 'RANGE', 'RANK', 'READ', 'REFERENCES', 'RETURNING',
+    'REVOKE', 'RIGHT', 'ROW', 'ROWS', 'RULE', 'SCHEMA', 'SELECT', 'SESSION_USER', 'SET', 'SHOW', 'SOME', 'TABLE',
+    'THEN', 'TO', 'TOP', 'TRAILING', 'TRIGGER', 'TRUE', 'UNION', 'UNIQUE', 'UPDATE', 'USAGE', 'USER', 'USING',
+    'VALUES', 'VIEW', 'WHEN', 'WHERE', 'WINDOW', 'WITH'
+}
+
+
+def normalized_keyword(token) -> str:
+    """Upper-cased keyword value with internal whitespace collapsed ("GROUP\\n BY" -> "GROUP BY")"""
+    return ' '.join(token.value.upper().split())
+
+
+def parse_statements(sql: str, cache: bool = True) -> Tuple[sqlparse.sql.Statement, ...]:
+    """
+    sqlparse statements of SQL, trailing semicolons dropped. Memoized by text, so a
+    statement is lexed once however many stages read it: the result is shared and
+    must not be modified. cache=False for throwaway text such as a partial statement.
+    """
+    text = sql.strip().rstrip(';').strip()
+    return _parse_cached(text) if cache else tuple(sqlparse.parse(text))
+
+
+@lru_cache(maxsize=SQL_PARSE_CACHE_SIZE)
+def _parse_cached(text: str) -> Tuple[sqlparse.sql.Statement, ...]:
+    return tuple(sqlparse.parse(text))
+
+
+def tokenize(sql: str, cache: bool = True) -> list:
+    """Flatten the first statement of SQL into sqlparse tokens, dropping comments"""
+    statements = parse_statements(sql, cache)
+    if not statements:
+        return []
+    return [t for t in statements[0].flatten() if t.ttype not in T.Comment]
+
+
+def tokens_to_sql(tokens: list) -> str:
+    """Render tokens back to SQL with whitespace collapsed to single spaces"""
+    parts = []
+    for token in tokens:
+        if token.is_whitespace:
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+        else:
+            parts.append(token.value)
+    return ''.join(parts).strip()
+
+
+def strip_whitespace(tokens: list) -> list:
+    """Drop leading and trailing whitespace tokens"""
+    start, end = 0, len(tokens)
+    while start < end and tokens[start].is_whitespace:
+        start += 1
+    while end > start and tokens[end - 1].is_whitespace:
+        end -= 1
+    return tokens[start:end]
+
+
+def split_top_level(tokens: list, separator: str = ',') -> List[list]:
+    """Split tokens on a punctuation separator that is not nested in parentheses"""
+    parts, current, depth = [], [], 0
+    for token in tokens:
+        if token.match(T.Punctuation, '('):
+            depth += 1
+        elif token.match(T.Punctuation, ')'):
+            depth -= 1
+        elif depth == 0 and token.match(T.Punctuation, separator):
+            parts.append(strip_whitespace(current))
+            current = []
+            continue
+        current.append(token)
+    parts.append(strip_whitespace(current))
+    return [p for p in parts if p]
+
+
+def is_identifier(token) -> bool:
+    """Whether a token can name a table, column or alias"""
+    return token.ttype in T.Name or token.ttype in T.Literal.String.Symbol
+
+
+def unquote(name: str) -> str:
+    """Strip identifier quoting: "x", `x` and [x]"""
+    if len(name) >= 2 and name[0] + name[-1] in ('""', '``', '[]'):
+        return name[1:-1]
+    return name
+
+
+def split_conjuncts(sql: str) -> List[str]:
+    """
+    Split a condition on top-level AND (leaving `BETWEEN x AND y` intact). A condition
+    with a top-level OR is returned whole: AND binds tighter, so `a AND b OR c` is not
+    the conjunction of `a` and `b OR c`.
+    """
+    parts, current, depth, between = [], [], 0, False
+    for token in tokenize(sql):
+        if token.match(T.Punctuation, '('):
+            depth += 1
+        elif token.match(T.Punctuation, ')'):
+            depth -= 1
+        elif depth == 0 and token.is_keyword and normalized_keyword(token) == 'OR':
+            return [sql.strip()] if sql.strip() else []
+        elif depth == 0 and token.is_keyword and normalized_keyword(token) == 'BETWEEN':
+            between = True
+        elif depth == 0 and token.is_keyword and normalized_keyword(token) == 'AND':
+            if between:
+                between = False
+            else:
+                parts.append(tokens_to_sql(current))
+                current = []
+                continue
+        current.append(token)
+    parts.append(tokens_to_sql(current))
+    return [p for p in parts if p]
+
+
+def column_references(tokens: list) -> List[Tuple[Optional[str], str]]:
+    """(qualifier, column) for every column-looking reference; qualifier is None when bare"""
+    tokens = [t for t in tokens if not t.is_whitespace]
+    references = []
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if is_identifier(token) or token.ttype in T.Name.Builtin:
+            following = tokens[index + 1] if index + 1 < len(tokens) else None
+            if following is not None and following.match(T.Punctuation, '('):
+                # Function call, not a column
+                index += 1
+                continue
+            if (following is not None and following.match(T.Punctuation, '.')
+                    and index + 2 < len(tokens) and is_identifier(tokens[index + 2])):
+                references.append((unquote(token.value), unquote(tokens[index + 2].value)))
+                index += 3
+                continue
+            references.append((None, unquote(token.value)))
+        index += 1
+    return references
+
+
+def quote_identifier(name: str, db_type: Optional[str] = None) -> str:
+    """Quote an identifier only when it needs it, in the dialect's style"""
+    if re.match(r'^[a-z_][a-z0-9_]*$', name) and name.upper() not in RESERVED_WORDS:
+        return name
+    if db_type == "mysql":
+        return f"`{name}`"
+    if db_type == "sqlserver":
+        return f"[{name}]"
+    return '"' + name.replace('"', '""') + '"'
+
+
+def split_alias(tokens: list) -> Tuple[list, Optional[str]]:
+    """Split `expr [AS] alias` into the expression tokens and the alias"""
+    tokens = strip_whitespace(tokens)
+    if len(tokens) < 2:
+        return tokens, None
+
+    last = tokens[-1]
+    rest = strip_whitespace(tokens[:-1])
+    # After AS even a keyword is an alias: `COUNT(*) AS count`
+    if rest and rest[-1].match(T.Keyword, 'AS') and (is_identifier(last) or last.is_keyword):
+        return strip_whitespace(rest[:-1]), unquote(last.value)
+
+    if not is_identifier(last):
+        return tokens, None
+
+    # Implicit alias: `expr alias`, but not `schema.table` or `a . b`
+    if len(tokens) > len(rest) and tokens[-2].is_whitespace and rest:
+        previous = rest[-1]
+        if previous.match(T.Punctuation, '.') or previous.ttype in T.Operator:
+            return tokens, None
+        if previous.is_keyword and normalized_keyword(previous) not in ('END',):
+            return tokens, None
+        return rest, unquote(last.value)
+
+    return tokens, None
+
+
+def function_call(tokens: list) -> Optional[Tuple[str, list]]:
+    """Return (FUNCTION_NAME, argument tokens) when tokens are exactly one call like AVG(x)"""
+    tokens = strip_whitespace(tokens)
+    if len(tokens) < 3:
+        return None
+    name = tokens[0]
+    if not (is_identifier(name) or name.is_keyword):
+        return None
+    rest = strip_whitespace(tokens[1:])
+    if not rest or not rest[0].match(T.Punctuation, '(') or not rest[-1].match(T.Punctuation, ')'):
+        return None
+
+    # Make sure the opening parenthesis closes at the very end
+    depth = 0
+    for index, token in enumerate(rest):
+        if token.match(T.Punctuation, '('):
+            depth += 1
+        elif token.match(T.Punctuation, ')'):
+            depth -= 1
+            if depth == 0 and index != len(rest) - 1:
+                return None
+    return name.value.upper(), strip_whitespace(rest[1:-1])
+
+
+class SelectItem:
+    """One entry of a SELECT list"""
+
+    def __init__(self, tokens: list):
+        expr_tokens, alias = split_alias(tokens)
+        self.tokens = expr_tokens
+        self.expr = tokens_to_sql(expr_tokens)
+        self.alias = alias
+        # As written, quotes and case included: "Total" and Total name different columns in PostgreSQL
+        self._written_alias = (alias, strip_whitespace(tokens)[-1].value) if alias else None
+
+    @classmethod
+    def from_sql(cls, sql: str) -> 'SelectItem':
+        return cls(strip_whitespace(tokenize(sql)))
+
+    @property
+    def is_star(self) -> bool:
+        return self.expr == '*' or self.expr.endswith('.*')
+
+    @property
+    def aggregate(self) -> Optional[Tuple[str, list]]:
+        """(FUNCTION, argument tokens) when the item is a bare aggregate call"""
+        call = function_call(self.tokens)
+        if call and call[0] in AGGREGATE_FUNCTIONS:
+            return call
+        return None
+
+    @property
+    def output_name(self) -> str:
+        """Name the column is expected to have in the result set"""
+        if self.alias:
+            return self.alias
+        identifiers = [t for t in self.tokens if not t.is_whitespace]
+        if identifiers and all(is_identifier(t) or t.match(T.Punctuation, '.') for t in identifiers):
+            return unquote(identifiers[-1].value)
+        return self.expr
+
+    @property
+    def alias_sql(self) -> Optional[str]:
+        """The alias as written, or quoted (a double-quoted alias is accepted by every dialect) when set since"""
+        if not self.alias:
+            return None
+        if self._written_alias and self._written_alias[0] == self.alias:
+            return self._written_alias[1]
+        if re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', self.alias) and self.alias.upper() not in RESERVED_WORDS:
+            return self.alias
+        return '"' + self.alias.replace('"', '""') + '"'
+
+    def to_sql(self) -> str:
+        return f"{self.expr} AS {self.alias_sql}" if self.alias else self.expr
+
+
+class TableRef:
+    """One source of a FROM clause: a table or a derived table, optionally joined"""
+
+    def __init__(self, tokens: list, join: Optional[str] = None):
+        self.join = join
+        self.condition = None
+        self.subquery = None
+
+        condition_at = None
+        depth = 0
+        for index, token in enumerate(tokens):
+            if token.match(T.Punctuation, '('):
+                depth += 1
+            elif token.match(T.Punctuation, ')'):
+                depth -= 1
+            elif depth == 0 and token.is_keyword and normalized_keyword(token) in ('ON', 'USING'):
+                condition_at = index
+                break
+
+        source = tokens
+        if condition_at is not None:
+            source = strip_whitespace(tokens[:condition_at])
+            self.condition = tokens_to_sql(tokens[condition_at:])
+
+        source_tokens, alias = split_alias(source)
+        self.alias = alias
+        self.source = tokens_to_sql(source_tokens)
+        self.name = None
+        if source_tokens and source_tokens[0].match(T.Punctuation, '('):
+            self.subquery = parse_select(self.source[1:-1])
+        else:
+            self.name = unquote(self.source.split('.')[-1])
+
+    @property
+    def reference(self) -> str:
+        """Name other clauses use to refer to this source"""
+        return self.alias or self.name or self.source
+
+    def to_sql(self) -> str:
+        sql = self.source
+        if self.alias:
+            sql += f" AS {self.alias}"
+        if self.join:
+            sql = f"{self.join} {sql}"
+        if self.condition:
+            sql += f" {self.condition}"
+        return sql
+
+
+class SelectQuery:
+    """A single SELECT statement decomposed into its clauses.
+
+    Clause bodies are kept as SQL text (whitespace collapsed); the select list
+    and the FROM clause are broken down further since rewrites need them.
+    """
+
+    def __init__(self):
+        self.ctes: List[Tuple[str, str]] = []
+        self.recursive = False
+        self.distinct = False
+        self.top: Optional[str] = None
+        self.select_items: List[SelectItem] = []
+        self.tables: List[TableRef] = []
+        self.where: Optional[str] = None
+        self.group_by: List[str] = []
+        self.having: Optional[str] = None
+        self.order_by: List[str] = []
+        self.limit: Optional[str] = None
+        self.offset: Optional[str] = None
+
+    @property
+    def has_joins(self) -> bool:
+        return len(self.tables) > 1
+
+    @property
+    def aggregates(self) -> List[SelectItem]:
+        return [item for item in self.select_items if item.aggregate]
+
+    @property
+    def limits_rows(self) -> bool:
+        """LIMIT, TOP, OFFSET or FETCH FIRST: which rows come back depends on ORDER BY"""
+        return bool(self.limit or self.top or self.offset) or any(FETCH_FIRST.search(o) for o in self.order_by)
+
+    def to_sql(self) -> str:
+        parts = []
+        if self.ctes:
+            ctes = ', '.join(f"{name} AS ({body})" for name, body in self.ctes)
+            parts.append(f"WITH {'RECURSIVE ' if self.recursive else ''}{ctes}")
+        select = 'SELECT'
+        if self.distinct:
+            select += ' DISTINCT'
+        if self.top:
+            select += f' TOP {self.top}'
+        parts.append(f"{select} {', '.join(item.to_sql() for item in self.select_items)}")
+        if self.tables:
+            sources = self.tables[0].to_sql()
+            for table in self.tables[1:]:
+                sources += f" {table.to_sql()}" if table.join else f", {table.to_sql()}"
+            parts.append(f"FROM {sources}")
+        if self.where:
+            parts.append(f"WHERE {self.where}")
+        if self.group_by:
+            parts.append(f"GROUP BY {', '.join(self.group_by)}")
+        if self.having:
+            parts.append(f"HAVING {self.having}")
+        if self.order_by:
+            parts.append(f"ORDER BY {', '.join(self.order_by)}")
+        if self.limit:
+            parts.append(f"LIMIT {self.limit}")
+        if self.offset:
+            parts.append(f"OFFSET {self.offset}")
+        return ' '.join(parts)
+
+
+def _split_clauses(tokens: list) -> Optional[List[Tuple[str, list]]]:
+    """Split the tokens after SELECT into (clause keyword, body tokens) at depth 0"""
+    clauses = [('SELECT', [])]
+    depth = 0
+    for token in tokens:
+        if token.match(T.Punctuation, '('):
+            depth += 1
+        elif token.match(T.Punctuation, ')'):
+            depth -= 1
+        elif depth == 0 and token.is_keyword:
+            keyword = normalized_keyword(token)
+            if keyword in SET_OPERATORS:
+                return None
+            if keyword in CLAUSE_KEYWORDS:
+                clauses.append((keyword, []))
+                continue
+        clauses[-1][1].append(token)
+    return clauses
+
+
+def _parse_ctes(tokens: list, query: SelectQuery) -> Optional[list]:
+    """Consume `WITH [RECURSIVE] name AS (...), ...` and return the remaining tokens"""
+    index = 1
+    while index < len(tokens):
+        token = tokens[index]
+        if token.is_whitespace or token.match(T.Punctuation, ','):
+            index += 1
+            continue
+        if token.is_keyword and normalized_keyword(token) == 'RECURSIVE':
+            query.recursive = True
+            index += 1
+            continue
+        if token.match(T.Keyword.DML, 'SELECT'):
+            return tokens[index:]
+        if not (is_identifier(token) or token.is_keyword):
+            return None
+
+        name = token.value
+        index = _skip_whitespace(tokens, index + 1)
+        # Optional column list: name(a, b) AS (...)
+        if index < len(tokens) and tokens[index].match(T.Punctuation, '('):
+            end = _closing_paren(tokens, index)
+            if end is None:
+                return None
+            name += tokens_to_sql(tokens[index:end + 1])
+            index = _skip_whitespace(tokens, end + 1)
+        if index >= len(tokens) or not tokens[index].match(T.Keyword, 'AS'):
+            return None
+        index = _skip_whitespace(tokens, index + 1)
+        if index >= len(tokens) or not tokens[index].match(T.Punctuation, '('):
+            return None
+
+        end = _closing_paren(tokens, index)
+        if end is None:
+            return None
+        query.ctes.append((name, tokens_to_sql(tokens[index + 1:end])))
+        index = end + 1
+    return None
+
+
+def _skip_whitespace(tokens: list, index: int) -> int:
+    while index < len(tokens) and tokens[index].is_whitespace:
+        index += 1
+    return index
+
+
+def _closing_paren(tokens: list, start: int) -> Optional[int]:
+    """Index of the parenthesis closing the one at `start`"""
+    depth = 0
+    for index in range(start, len(tokens)):
+        if tokens[index].match(T.Punctuation, '('):
+            depth += 1
+        elif tokens[index].match(T.Punctuation, ')'):
+            depth -= 1
+            if depth == 0:
+                return index
+    return None
+
+
+def _parse_from(tokens: list) -> List[TableRef]:
+    """Break a FROM clause into table references, keeping join types and conditions"""
+    tables = []
+    current, join, depth = [], None, 0
+
+    def flush():
+        body = strip_whitespace(current)
+        if body:
+            tables.append(TableRef(body, join))
+
+    for token in tokens:
+        if token.match(T.Punctuation, '('):
+            depth += 1
+        elif token.match(T.Punctuation, ')'):
+            depth -= 1
+        elif depth == 0 and token.match(T.Punctuation, ','):
+            flush()
+            current, join = [], None
+            continue
+        elif depth == 0 and token.is_keyword and normalized_keyword(token).endswith('JOIN'):
+            flush()
+            current, join = [], normalized_keyword(token)
+            continue
+        current.append(token)
+    flush()
+    return tables
+
+
+def is_top_modifier(tokens: list) -> bool:
+    """TOP n / TOP (n) at the start of a select list: sqlparse lexes TOP as a name"""
+    rest = strip_whitespace(tokens[1:])
+    return (normalized_keyword(tokens[0]) == 'TOP' and bool(rest)
+            and (rest[0].ttype in T.Number or rest[0].match(T.Punctuation, '(')))
+
+
+def parse_select(sql: str) -> Optional[SelectQuery]:
+    """Parse a single SELECT (optionally with CTEs) into a SelectQuery.
+
+    Returns None for anything else - other statement types, set operations,
+    or text the clause splitter cannot make sense of - so callers can treat
+    the query as opaque and leave it untouched.
+    """
+    if not sql or not sql.strip():
+        return None
+
+    tokens = strip_whitespace(tokenize(sql))
+    if any(t.match(T.Punctuation, ';') for t in tokens):
+        return None
+    if not tokens:
+        return None
+
+    query = SelectQuery()
+    if tokens[0].ttype in T.Keyword.CTE:
+        tokens = _parse_ctes(tokens, query)
+        if tokens is None:
+            return None
+
+    if not tokens or not tokens[0].match(T.Keyword.DML, 'SELECT'):
+        return None
+
+    clauses = _split_clauses(tokens[1:])
+    if clauses is None:
+        return None
+
+    seen = set()
+    for keyword, body in clauses:
+        if keyword in seen:
+            return None
+        seen.add(keyword)
+        body = strip_whitespace(body)
+
+        if keyword == 'SELECT':
+            while body and ((body[0].is_keyword and normalized_keyword(body[0]) in ('DISTINCT', 'ALL')) or is_top_modifier(body)):
+                modifier = normalized_keyword(body[0])
+                body = strip_whitespace(body[1:])
+                if modifier == 'DISTINCT':
+                    query.distinct = True
+                elif modifier == 'TOP' and body:
+                    end = _closing_paren(body, 0) if body[0].match(T.Punctuation, '(') else 0
+                    if end is None:
+                        return None
+                    query.top = tokens_to_sql(body[:end + 1])
+                    body = strip_whitespace(body[end + 1:])
+            query.select_items = [SelectItem(item) for item in split_top_level(body)]
+            if not query.select_items:
+                return None
+        elif keyword == 'FROM':
+            query.tables = _parse_from(body)
+        elif keyword == 'WHERE':
+            query.where = tokens_to_sql(body)
+        elif keyword == 'GROUP BY':
+            query.group_by = [tokens_to_sql(part) for part in split_top_level(body)]
+        elif keyword == 'HAVING':
+            query.having = tokens_to_sql(body)
+        elif keyword == 'ORDER BY':
+            query.order_by = [tokens_to_sql(part) for part in split_top_level(body)]
+        elif keyword == 'LIMIT':
+            limit = tokens_to_sql(body)
+            # MySQL `LIMIT offset, count`
+            if ',' in limit:
+                offset, limit = [p.strip() for p in limit.split(',', 1)]
+                query.offset = offset
+            query.limit = limit
+        elif keyword == 'OFFSET':
+            query.offset = re.sub(r'\s+ROWS?$', '', tokens_to_sql(body), flags=re.IGNORECASE)
+
+    return query
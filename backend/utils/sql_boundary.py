@@ -0,0 +1,174 @@
+from typing import Optional
+
+QUOTE_CLOSERS = {"'": "'", '"': '"', '`': '`', '[': ']'}
+WORD_CHARS = set('_$@#')
+# A statement ending in one of these cannot be complete yet
+CONTINUATION_CHARS = set(',(.+-*/%=<>|')
+CONTINUATION_KEYWORDS = {
+    'SELECT', 'FROM', 'WHERE', 'AND', 'OR', 'NOT', 'ON', 'USING', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL',
+    'OUTER', 'CROSS', 'BY', 'GROUP', 'ORDER', 'HAVING', 'AS', 'WITH', 'RECURSIVE', 'IN', 'IS', 'LIKE', 'ILIKE',
+    'BETWEEN', 'CASE', 'WHEN', 'THEN', 'ELSE', 'UNION', 'INTERSECT', 'EXCEPT', 'ALL', 'DISTINCT', 'LIMIT',
+    'OFFSET', 'TOP', 'EXISTS', 'INTO', 'VALUES', 'SET', 'OVER', 'PARTITION'
+}
+# Keywords that start the main statement after the CTEs of a WITH
+STATEMENT_KEYWORDS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'MERGE', 'VALUES'}
+
+
+class StatementBoundaryDetector:
+    """
+    Incrementally find where the first complete SQL statement in streamed model
+    output ends. feed() text as it arrives; it returns the offset in self.text just
+    past the statement once it is complete, else None. A statement ends at:
+    - a ';' outside string literals, quoted identifiers and comments
+    - a closing ``` fence
+    - a blank line, if what came before can stand alone (parentheses balanced,
+      not ending in a keyword or operator, a WITH has reached its main statement)
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.end = None
+        self._pos = 0
+        self._quote = None
+        self._comment = None
+        self._depth = 0
+        self._word = ""
+        self._last = None
+        self._started = False
+        self._first_word = None
+        self._ctes_closed = False
+        self._main_seen = False
+
+    def feed(self, chunk: str) -> Optional[int]:
+        self.text += chunk
+        while self.end is None and self._pos < len(self.text) and self._step():
+            pass
+        return self.end
+
+    def finish(self) -> int:
+        """The model stopped on its own: whatever was produced is the statement"""
+        if self.end is None:
+            self.end = len(self.text)
+        return self.end
+
+    def _step(self) -> bool:
+        """Consume one character or token; False when the next characters are needed to decide"""
+        text, i = self.text, self._pos
+        c = text[i]
+
+        if self._comment == '--':
+            if c == '\n':
+                self._comment = None
+            else:
+                self._pos += 1
+            return True
+
+        if self._comment == '/*':
+            if c == '*':
+                if i + 1 >= len(text):
+                    return False
+                if text[i + 1] == '/':
+                    self._comment = None
+                    self._pos += 2
+                    return True
+            self._pos += 1
+            return True
+
+        if self._quote:
+            closer = QUOTE_CLOSERS[self._quote]
+            if c == closer:
+                if i + 1 >= len(text):
+                    return False
+                if text[i + 1] == closer and closer != ']':
+                    # Doubled quote is an escaped quote
+                    self._pos += 2
+                    return True
+                self._quote = None
+            self._pos += 1
+            return True
+
+        if c.isalnum() or c in WORD_CHARS:
+            self._word += c
+            self._pos += 1
+            return True
+        self._end_word()
+
+        if c.isspace():
+            if c == '\n' and self._started and self._can_stand_alone():
+                j = i + 1
+                while j < len(text) and text[j] in ' \t\r':
+                    j += 1
+                if j >= len(text):
+                    return False
+                if text[j] == '\n':
+                    self.end = i
+                    return True
+            self._pos += 1
+            return True
+
+        if c in '-/':
+            if i + 1 >= len(text):
+                return False
+            if text[i:i + 2] in ('--', '/*'):
+                self._comment = text[i:i + 2]
+                self._pos += 2
+                return True
+
+        if c == '`':
+            if i + 2 >= len(text):
+                return False
+            if text[i:i + 3] == '```':
+                if self._started:
+                    self.end = i
+                    return True
+                # Opening fence: skip it along with its language tag
+                j = text.find('\n', i)
+                if j < 0:
+                    return False
+                self._pos = j
+                return True
+
+        if c in QUOTE_CLOSERS:
+            self._quote = c
+            self._token(c)
+            self._pos += 1
+            return True
+
+        if c == ';':
+            if self._started:
+                self.end = i + 1
+                return True
+            self._pos += 1
+            return True
+
+        if c == '(':
+            self._depth += 1
+        elif c == ')':
+            self._depth = max(self._depth - 1, 0)
+            if self._depth == 0 and self._first_word == 'WITH':
+                self._ctes_closed = True
+        self._token(c)
+        self._pos += 1
+        return True
+
+    def _end_word(self):
+        if not self._word:
+            return
+        word, self._word = self._word.upper(), ""
+        if self._depth == 0:
+            if self._first_word is None:
+                self._first_word = word
+            elif self._first_word == 'WITH' and self._ctes_closed and word in STATEMENT_KEYWORDS:
+                self._main_seen = True
+        self._token(word)
+
+    def _token(self, token: str):
+        self._last = token
+        self._started = True
+
+    def _can_stand_alone(self) -> bool:
+        if self._depth > 0:
+            return False
+        if self._first_word == 'WITH' and not self._main_seen:
+            return False
+        return self._last not in CONTINUATION_CHARS and self._last not in CONTINUATION_KEYWORDS
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from sqlparse import tokens as T
+
+from utils.sql_ast import parse_statements, tokenize
+
+
+# A list of placeholders after IN, whatever its length
+IN_LIST = re.compile(r'\bIN \( \?(?: , \?)* \)')
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Reduce SQL to its shape: literals become ?, IN lists of them (?+), keywords upper
+    case and unquoted identifiers lower case; comments and whitespace are dropped.
+    Quoted identifiers keep their case, as the database does.
+    """
+    parts = []
+    for token in tokenize(sql):
+        if token.is_whitespace or token.ttype in T.Comment:
+            continue
+        if token.ttype in T.Literal.String.Single or token.ttype in T.Literal.Number:
+            parts.append('?')
+        elif token.ttype in T.Name.Placeholder:
+            parts.append('?')
+        elif token.is_keyword:
+            parts.append(' '.join(token.value.upper().split()))
+        elif token.value[:1] in ('"', '`', '['):
+            parts.append(token.value)
+        else:
+            parts.append(token.value.lower())
+    return IN_LIST.sub('IN ( ?+ )', ' '.join(parts))
+
+
+def compact_sql(sql: str) -> str:
+    """
+    SQL with comments dropped and whitespace collapsed, every other token exactly as
+    written: equal only for statements that are the same on every database, whose
+    identifiers may be case sensitive (MySQL table names on Linux, quoted names).
+    Hint comments (/*+ */, /*! */) are kept, as they change what runs.
+    """
+    parts = []
+    for token in (t for statement in parse_statements(sql) for t in statement.flatten()):
+        if token.is_whitespace:
+            continue
+        if token.ttype in T.Comment and not token.value.startswith(('/*+', '/*!')):
+            continue
+        parts.append(token.value)
+    return ' '.join(parts)
+
+
+def sql_literals(sql: str) -> List[str]:
+    """Literal values in order of appearance: what normalize_sql replaces with ? (or, in an IN list, (?+))"""
+    values = []
+    for token in tokenize(sql):
+        if token.ttype in T.Literal.String.Single:
+            values.append(token.value[1:-1].replace("''", "'"))
+        elif token.ttype in T.Literal.Number:
+            values.append(token.value)
+    return values
+
+
+def fingerprint_sql(sql: str) -> str:
+    """
+    Stable short hash identifying all queries of the same shape: the key for caching
+    explanations, coalescing executions and latency statistics per shape
+    """
+    return hashlib.sha1(normalize_sql(sql).encode('utf-8')).hexdigest()[:16]
+
+
+def schema_fingerprint(schema: Optional[List[Dict[str, Any]]]) -> Optional[str]:
+    """Hash of what the generator sees of a schema; row counts are left out as they change constantly"""
+    if not schema:
+        return None
+    shape = sorted(
+        (table.get('name') or table.get('table_name', ''),
+         [(c.get('name'), c.get('type'), bool(c.get('isPrimary'))) for c in table.get('columns', [])])
+        for table in schema if isinstance(table, dict)
+    )
+    return hashlib.sha1(json.dumps(shape, default=str).encode('utf-8')).hexdigest()[:16]
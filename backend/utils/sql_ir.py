@@ -0,0 +1,190 @@
+from functools import cached_property, lru_cache
+from typing import Iterator, List, Optional, Tuple
+
+from sqlparse import tokens as T
+
+from utils.sql_ast import (
+    SQL_PARSE_CACHE_SIZE, SelectQuery, is_top_modifier, normalized_keyword, parse_select,
+    parse_statements, strip_whitespace, tokenize
+)
+from utils.sql_fingerprint import compact_sql, fingerprint_sql, normalize_sql, sql_literals
+from utils.sql_safety import read_only_violation
+
+# A clause keyword starts a new line when formatting; so does every kind of JOIN
+FORMAT_BREAK_KEYWORDS = {'SELECT', 'FROM', 'WHERE', 'GROUP BY', 'ORDER BY', 'HAVING', 'LIMIT'}
+# Top-level keywords ending the select list
+SELECT_LIST_END = {'FROM', 'WHERE', 'GROUP BY', 'HAVING', 'ORDER BY', 'LIMIT', 'OFFSET', 'FETCH', 'INTO'}
+# A row limit cannot simply be added to a statement that already bounds its rows, skips
+# rows (LIMIT must come before OFFSET), or ends in a locking clause
+LIMIT_BLOCKERS = {'LIMIT', 'TOP', 'FETCH', 'OFFSET', 'FOR'}
+SET_OPERATORS = {'UNION', 'UNION ALL', 'INTERSECT', 'EXCEPT'}
+
+
+def _top_level(tokens: list) -> Iterator[Tuple[int, object]]:
+    """(index, token) of the non-whitespace tokens outside parentheses, the outermost parentheses included"""
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token.match(T.Punctuation, ')'):
+            depth -= 1
+        if depth == 0 and not token.is_whitespace:
+            yield index, token
+        if token.match(T.Punctuation, '('):
+            depth += 1
+
+
+def format_sql(sql: str, cache: bool = True) -> str:
+    """
+    A line per top-level clause keyword and JOIN, and one per column of the outer select list,
+    with other whitespace collapsed. Works on tokens, so literals and identifiers that
+    contain keywords are left alone; SQL that is not a single statement is returned as is.
+    """
+    statements = [s for s in parse_statements(sql, cache) if s.token_first(skip_cm=True) is not None]
+    if len(statements) != 1:
+        return sql
+
+    parts: List[str] = []
+    depth, space, in_select_list, seen_select = 0, False, False, False
+    for token in tokenize(sql, cache):
+        if token.is_whitespace:
+            space = bool(parts) and not parts[-1].endswith('\n    ')
+            continue
+        keyword = normalized_keyword(token) if token.is_keyword else None
+        if space and depth == 0 and keyword and (keyword in FORMAT_BREAK_KEYWORDS or keyword.endswith('JOIN')):
+            separator = '\n'
+        else:
+            separator = ' ' if space else ''
+        parts.append(separator + (' '.join(token.value.split()) if keyword else token.value))
+        space = False
+
+        if token.match(T.Punctuation, '('):
+            depth += 1
+        elif token.match(T.Punctuation, ')'):
+            depth -= 1
+        elif depth == 0 and keyword == 'SELECT' and not seen_select:
+            in_select_list = seen_select = True
+        elif depth == 0 and keyword in SELECT_LIST_END:
+            in_select_list = False
+        elif depth == 0 and in_select_list and token.match(T.Punctuation, ','):
+            parts.append('\n    ')
+
+    formatted = ''.join(parts)
+    return formatted + ';' if sql.rstrip().endswith(';') else formatted
+
+
+class ParsedSQL:
+    """
+    One SQL text parsed once and shared by every stage that reads it: statement
+    type, read-only and safety checks, the decomposed SELECT, fingerprint and literals,
+    formatting and row-limit injection. Get it from parse_sql(), which memoizes by
+    text; each property is computed on first use.
+
+    select is shared between callers: rewrites take their own copy from parse_select().
+    """
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.statements = [s for s in parse_statements(sql) if s.token_first(skip_cm=True) is not None]
+        self.tokens = tokenize(sql) if self.statements else []
+
+    @property
+    def statement_count(self) -> int:
+        return len(self.statements)
+
+    @cached_property
+    def statement_type(self) -> str:
+        """sqlparse's type of a single statement (SELECT for WITH ... SELECT); UNKNOWN otherwise"""
+        return self.statements[0].get_type() if len(self.statements) == 1 else 'UNKNOWN'
+
+    @cached_property
+    def first_keyword(self) -> str:
+        first = next((t for t in self.tokens if not t.is_whitespace), None)
+        return normalized_keyword(first) if first is not None else ''
+
+    @cached_property
+    def keywords(self) -> frozenset:
+        """Every keyword in every statement, upper case"""
+        return frozenset(
+            normalized_keyword(token) for statement in self.statements for token in statement.flatten() if token.is_keyword
+        )
+
+    @cached_property
+    def read_only(self) -> bool:
+        """A single statement that only reads: safe to retry and to share between callers"""
+        return self.read_only_violation is None
+
+    @cached_property
+    def read_only_violation(self) -> Optional[str]:
+        """Why the SQL may not be run (see sql_safety.read_only_violation); None when it may"""
+        return read_only_violation(self.sql)
+
+    @cached_property
+    def select(self) -> Optional[SelectQuery]:
+        return parse_select(self.sql)
+
+    @cached_property
+    def normalized(self) -> str:
+        """The query's shape: literals as placeholders, canonical casing and spacing"""
+        return normalize_sql(self.sql)
+
+    @cached_property
+    def compact(self) -> str:
+        """The statement itself, comments and spacing aside; identifiers and literals keep their case"""
+        return compact_sql(self.sql)
+
+    @cached_property
+    def fingerprint(self) -> str:
+        return fingerprint_sql(self.sql)
+
+    @cached_property
+    def literals(self) -> List[str]:
+        return sql_literals(self.sql)
+
+    @cached_property
+    def formatted(self) -> str:
+        return format_sql(self.sql)
+
+    @cached_property
+    def has_row_limit(self) -> bool:
+        """A top-level LIMIT, TOP, FETCH or OFFSET; one inside a subquery or CTE does not count"""
+        top_level = [token for _, token in _top_level(self.tokens)]
+        for index, token in enumerate(top_level):
+            if token.is_keyword and normalized_keyword(token) in LIMIT_BLOCKERS:
+                return True
+            if index and is_top_modifier(top_level[index:]) and top_level[index - 1].is_keyword:
+                return True
+        return False
+
+    def with_limit(self, limit: Optional[int], dialect: Optional[str] = None) -> str:
+        """
+        The statement returning at most `limit` rows: LIMIT n appended, or TOP n after
+        SELECT on SQL Server. Left as is when it is not a single SELECT, already has a
+        row limit, or (SQL Server) is a set operation TOP cannot bound as a whole.
+        """
+        if not limit or self.statement_type != 'SELECT' or self.has_row_limit:
+            return self.sql
+        # Comments dropped: a trailing -- comment would swallow the LIMIT
+        body = ''.join(token.value for token in strip_whitespace(self.tokens))
+
+        if (dialect or '').lower() != 'sqlserver':
+            return f"{body} LIMIT {int(limit)}"
+
+        tokens = strip_whitespace(self.tokens)
+        top_level = list(_top_level(tokens))
+        if any(token.is_keyword and normalized_keyword(token) in SET_OPERATORS for _, token in top_level):
+            return self.sql
+        select = next((i for i, (_, token) in enumerate(top_level) if token.match(T.Keyword.DML, 'SELECT')), None)
+        if select is None:
+            return self.sql
+        position = top_level[select][0]
+        following = top_level[select + 1][1] if select + 1 < len(top_level) else None
+        if following is not None and following.is_keyword and normalized_keyword(following) in ('DISTINCT', 'ALL'):
+            position = top_level[select + 1][0]
+        head = ''.join(token.value for token in tokens[:position + 1])
+        tail = ''.join(token.value for token in tokens[position + 1:])
+        return f"{head} TOP {int(limit)}{tail}"
+
+
+@lru_cache(maxsize=SQL_PARSE_CACHE_SIZE)
+def parse_sql(sql: str) -> ParsedSQL:
+    """The memoized parse of a SQL text"""
+    return ParsedSQL(sql)
@@ -0,0 +1,143 @@
+import os
+from typing import Optional
+
+from sqlparse import tokens as T
+
+from utils.sql_ast import is_identifier, normalized_keyword, parse_statements, unquote
+
+# Statements that may be run, by first keyword (EXPLAIN only of a statement passing the same checks)
+READ_ONLY_STATEMENTS = {'SELECT', 'WITH', 'EXPLAIN', 'SHOW', 'DESCRIBE', 'DESC'}
+
+# Functions that read the server's files, sleep, lock, signal other sessions or change
+# settings and sequences: callable from an innocent-looking SELECT, so refused by name
+DENIED_FUNCTIONS = {
+    # PostgreSQL
+    'pg_sleep', 'pg_sleep_for', 'pg_sleep_until', 'pg_read_file', 'pg_read_binary_file', 'pg_ls_dir',
+    'pg_stat_file', 'lo_import', 'lo_export', 'lo_unlink', 'dblink', 'dblink_exec', 'dblink_connect',
+    'pg_terminate_backend', 'pg_cancel_backend', 'pg_reload_conf', 'pg_rotate_logfile', 'set_config',
+    'pg_advisory_lock', 'pg_advisory_xact_lock', 'pg_try_advisory_lock', 'nextval', 'setval',
+    # MySQL
+    'sleep', 'benchmark', 'load_file', 'get_lock', 'release_lock',
+    # SQLite
+    'load_extension', 'readfile', 'writefile', 'edit',
+    # SQL Server
+    'openrowset', 'opendatasource', 'openquery', 'xp_cmdshell',
+} | {name.strip().lower() for name in os.getenv("SQL_DENIED_FUNCTIONS", "").split(",") if name.strip()}
+
+# What may follow WAITFOR when it is a statement (T-SQL) rather than a name
+WAITFOR_ARGUMENTS = {'DELAY', 'TIME'}
+
+# Keywords that must be followed by an expression or a name, never by another statement
+# (T-SQL needs no semicolon between statements, so elsewhere a DELETE may start one)
+EXPRESSION_KEYWORDS = {
+    'SELECT', 'DISTINCT', 'AS', 'FROM', 'WHERE', 'HAVING', 'AND', 'OR', 'NOT', 'ON',
+    'GROUP BY', 'ORDER BY', 'PARTITION BY', 'WHEN', 'THEN', 'ELSE', 'IN', 'LIKE', 'IS', 'BETWEEN'
+}
+# Before "(", these make it the body of a CTE, where PostgreSQL accepts data-modifying statements
+# (MATERIALIZED is not in sqlparse's keyword list)
+CTE_BODY_KEYWORDS = {'AS', 'MATERIALIZED'}
+
+
+def _is_alias(tokens: list, index: int) -> bool:
+    """Whether the token is an alias after AS, or a name after a qualifier"""
+    previous = tokens[index - 1] if index else None
+    return previous is not None and (previous.match(T.Keyword, 'AS') or previous.match(T.Punctuation, '.'))
+
+
+def _is_name(tokens: list, index: int) -> bool:
+    """
+    Whether a command keyword (DELETE, MERGE, REPLACE, ...) is used as a name or function:
+    an alias or qualified name, a qualifier itself, a call, or where only an expression or
+    a name can stand (select list, conditions, operands, arguments)
+    """
+    if _is_alias(tokens, index) or _is_call(tokens, index):
+        return True
+    following = tokens[index + 1] if index + 1 < len(tokens) else None
+    if following is not None and following.match(T.Punctuation, '.'):
+        return True
+    previous = tokens[index - 1] if index else None
+    if previous is None:
+        return False
+    if previous.match(T.Punctuation, ',') or previous.ttype in T.Operator:
+        return True
+    if previous.match(T.Punctuation, '('):
+        before = tokens[index - 2] if index > 1 else None
+        return not (before is not None and normalized_keyword(before) in CTE_BODY_KEYWORDS)
+    if previous.is_keyword:
+        keyword = normalized_keyword(previous)
+        return keyword in EXPRESSION_KEYWORDS or keyword.endswith('JOIN')
+    return False
+
+
+def _closing(tokens: list, index: int) -> int:
+    """Index of the parenthesis closing the one at index (len(tokens) when unbalanced)"""
+    depth = 0
+    for position in range(index, len(tokens)):
+        if tokens[position].match(T.Punctuation, '('):
+            depth += 1
+        elif tokens[position].match(T.Punctuation, ')'):
+            depth -= 1
+            if depth == 0:
+                return position
+    return len(tokens)
+
+
+def _is_call(tokens: list, index: int) -> bool:
+    """
+    Whether the identifier is called: followed by "(", and neither an alias with a column
+    list (AS s(a, b)) nor a CTE's (name (a, b) AS (...))
+    """
+    if index + 1 >= len(tokens) or not tokens[index + 1].match(T.Punctuation, '('):
+        return False
+    if index and tokens[index - 1].match(T.Keyword, 'AS'):
+        return False
+    end = _closing(tokens, index + 1)
+    return not (end + 2 < len(tokens) and tokens[end + 1].match(T.Keyword, 'AS')
+                and tokens[end + 2].match(T.Punctuation, '('))
+
+
+def read_only_violation(sql: str) -> Optional[str]:
+    """
+    Why the SQL may not be run, or None when it is a single read-only statement: one
+    statement whose type is allowed, no data-modifying or DDL command anywhere (a DELETE
+    in a CTE, EXPLAIN ANALYZE of an UPDATE), no SELECT ... INTO, no WAITFOR statement and
+    no call of a denied function. Works on tokens and their position, so columns and
+    aliases such as created_at, updated_by, merge, "AS replace" or t.waitfor are not
+    mistaken for commands. Also what decides ParsedSQL.read_only.
+    """
+    statements = [s for s in parse_statements(sql) if s.token_first(skip_cm=True) is not None]
+    if not statements:
+        return "No SQL statement found"
+    if len(statements) > 1:
+        return f"Only a single statement can be run, found {len(statements)}"
+
+    tokens = [t for t in statements[0].flatten() if not t.is_whitespace and t.ttype not in T.Comment]
+    first = normalized_keyword(tokens[0])
+    if first not in READ_ONLY_STATEMENTS:
+        return f"{first} statements are not allowed: only read-only queries can be run"
+
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token.match(T.Punctuation, '('):
+            depth += 1
+        elif token.match(T.Punctuation, ')'):
+            depth -= 1
+        # Checked before names are skipped: a qualified call (pg_catalog.pg_sleep(1)) still runs
+        if is_identifier(token) and _is_call(tokens, index) and unquote(token.value).lower() in DENIED_FUNCTIONS:
+            return f"Function {unquote(token.value)}() is not allowed"
+        if _is_alias(tokens, index):
+            continue
+        keyword = normalized_keyword(token)
+        following = tokens[index + 1] if index + 1 < len(tokens) else None
+
+        if token.ttype in T.Keyword.DDL or (token.ttype in T.Keyword.DML and keyword != 'SELECT'):
+            if not _is_name(tokens, index):
+                return f"{keyword} is not allowed: only read-only queries can be run"
+        # SELECT ... INTO (a table, OUTFILE, a variable): INTO only follows a select list here
+        if token.is_keyword and keyword == 'INTO':
+            return "SELECT ... INTO is not allowed: only read-only queries can be run"
+        # Not in sqlparse's keyword list: a statement of its own when a delay or time follows
+        if (is_identifier(token) and keyword == 'WAITFOR' and depth == 0 and following is not None
+                and normalized_keyword(following) in WAITFOR_ARGUMENTS):
+            return "WAITFOR is not allowed: only read-only queries can be run"
+    return None